@@ -0,0 +1,468 @@
+"""
+Benchmarks for the Quake .map -> Source converter.
+Runs against the bundled quake_maps_input/E1M*.MAP files by default.
+
+    python benchmark.py parse [--repeat N] [map files...]
+    python benchmark.py emit [--repeat N] [--grid UNITS] [map files...]
+    python benchmark.py stages [--repeat N] [--scale K ...] [--wad PATH] [--json FILE]
+                               [--profile cprofile|tracemalloc] [map files...]
+"""
+import argparse
+import contextlib
+import cProfile
+import glob
+import io
+import itertools
+import json
+import os
+import platform
+import pstats
+import re
+import shutil
+import stat
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+import vmapconverter
+
+
+def legacy_parse_quake_map(map_filepath):
+    """
+    The original per-line regex parser, kept verbatim (minus console output) as the
+    baseline that parse_quake_map is measured and cross-checked against.
+    """
+    brushes = []
+    unique_textures = set()
+    current_brush_planes = []
+    in_entity_block = False
+
+    with open(map_filepath, 'r') as f:
+        for line in f:
+            stripped_line = line.strip()
+            if not stripped_line or stripped_line.startswith('//'):
+                continue
+
+            if stripped_line == '{':
+                if not in_entity_block:
+                    in_entity_block = True
+                current_brush_planes = []
+            elif stripped_line == '}':
+                if current_brush_planes:
+                    brushes.append(current_brush_planes)
+                    current_brush_planes = []
+                elif in_entity_block:
+                    in_entity_block = False
+            elif in_entity_block:
+                plane_match = re.match(r'\(\s*([\d\.\-]+)\s+([\d\.\-]+)\s+([\d\.\-]+)\s*\)\s*\(\s*([\d\.\-]+)\s+([\d\.\-]+)\s+([\d\.\-]+)\s*\)\s*\(\s*([\d\.\-]+)\s+([\d\.\-]+)\s+([\d\.\-]+)\s*\)\s*([^\s]+).*', stripped_line)
+                if plane_match:
+                    p1 = (float(plane_match.group(1)), float(plane_match.group(2)), float(plane_match.group(3)))
+                    p2 = (float(plane_match.group(4)), float(plane_match.group(5)), float(plane_match.group(6)))
+                    p3 = (float(plane_match.group(7)), float(plane_match.group(8)), float(plane_match.group(9)))
+                    texture_name = plane_match.group(10).lower()
+                    current_brush_planes.append({'plane': (p1, p2, p3), 'texture': texture_name})
+                    unique_textures.add(texture_name)
+
+    if current_brush_planes:
+        brushes.append(current_brush_planes)
+    return brushes, list(unique_textures)
+
+
+class FixedPointFormatter(vmapconverter.CoordinateFormatter):
+    """
+    The emitter's original number formatting with no cache, kept as the baseline that
+    CoordinateFormatter is measured and cross-checked against: plane coordinates through
+    f"{value:.6f}", texture axis values rounded per face (one np.round call each, as the old
+    per-face formatter did) and written with :g.
+    """
+    def format_array(self, values, decimals=None, snap=True):
+        values = np.asarray(values, dtype=np.float64)
+        if snap:
+            return [f"{value:.6f}" for value in values.ravel().tolist()]
+        return [f"{value:g}" for row in values.reshape(len(values), -1)
+                for value in (np.round(row, self.decimals if decimals is None else decimals) + 0.0).tolist()]
+
+
+# VMF plane and texture axis lines, for reading the emitted numbers back
+_PLANE_LINE_RE = re.compile(r'"plane" "\(([^)]*)\) \(([^)]*)\) \(([^)]*)\)"')
+_AXIS_LINE_RE = re.compile(r'"[uv]axis" "\[([^\]]*)\] ([^"]*)"')
+
+
+def emitted_numbers(vmf_content):
+    """(all plane coordinates, all texture axis values) of a .vmf text, in file order."""
+    coordinates = [float(value) for match in _PLANE_LINE_RE.finditer(vmf_content) for group in match.groups() for value in group.split()]
+    axis_values = [float(value) for match in _AXIS_LINE_RE.finditer(vmf_content) for group in match.groups() for value in group.split()]
+    return np.array(coordinates), np.array(axis_values)
+
+
+def default_map_files():
+    """Returns the bundled E1 episode maps."""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return sorted(glob.glob(os.path.join(script_dir, "quake_maps_input", "E1M*.MAP")))
+
+
+def time_call(function, repeat):
+    """Returns the best wall-clock time of `repeat` calls to function()."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def quiet_parse(map_filepath):
+    """parse_quake_map without its progress output."""
+    with open(os.devnull, 'w') as devnull, vmapconverter.contextlib.redirect_stdout(devnull):
+        return vmapconverter.parse_quake_map(map_filepath)
+
+
+def traced_memory(function):
+    """Returns (peak, retained) bytes allocated while running function(), keeping its result alive."""
+    tracemalloc.start()
+    try:
+        result = function()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak, retained
+
+
+def benchmark_parse(map_files, repeat, measure_memory=False):
+    """Times the legacy regex parser against parse_quake_map on each map and checks they agree."""
+    header = f"{'map':<12}{'size KB':>10}{'faces':>9}{'legacy ms':>12}{'current ms':>12}{'speedup':>9}"
+    if measure_memory:
+        header += f"{'legacy peak KB':>16}{'current peak KB':>17}{'legacy kept KB':>16}{'current kept KB':>17}"
+    print(header)
+    total_legacy = total_current = 0.0
+    for map_filepath in map_files:
+        legacy_brushes, legacy_textures = legacy_parse_quake_map(map_filepath)
+        geometry, textures = quiet_parse(map_filepath)
+        # Geometry and texture names must match the baseline exactly
+        legacy_faces = [face for brush in legacy_brushes for face in brush]
+        if (geometry.points.tolist() != [[c for point in face['plane'] for c in point] for face in legacy_faces]
+                or geometry.face_textures != [face['texture'] for face in legacy_faces]
+                or geometry.brush_offsets.tolist()[1:] != list(itertools.accumulate(len(brush) for brush in legacy_brushes))
+                or sorted(textures) != sorted(legacy_textures)):
+            raise SystemExit(f"parse_quake_map disagrees with the legacy parser on {map_filepath}")
+
+        legacy_time = time_call(lambda: legacy_parse_quake_map(map_filepath), repeat)
+        current_time = time_call(lambda: quiet_parse(map_filepath), repeat)
+        total_legacy += legacy_time
+        total_current += current_time
+        line = (f"{os.path.basename(map_filepath):<12}{os.path.getsize(map_filepath) / 1024:>10.0f}"
+                f"{geometry.face_count:>9}{legacy_time * 1000:>12.1f}{current_time * 1000:>12.1f}"
+                f"{legacy_time / current_time:>8.1f}x")
+        if measure_memory:
+            legacy_peak, legacy_kept = traced_memory(lambda: legacy_parse_quake_map(map_filepath))
+            current_peak, current_kept = traced_memory(lambda: quiet_parse(map_filepath))
+            line += f"{legacy_peak / 1024:>16.0f}{current_peak / 1024:>17.0f}{legacy_kept / 1024:>16.0f}{current_kept / 1024:>17.0f}"
+        print(line)
+    print(f"{'total':<12}{'':>10}{'':>9}{total_legacy * 1000:>12.1f}{total_current * 1000:>12.1f}"
+          f"{total_legacy / total_current:>8.1f}x")
+
+
+def benchmark_emit(map_files, repeat, grid=None):
+    """
+    Times generate_vmf_content with the original fixed-point coordinate formatting against
+    CoordinateFormatter on each map, reporting emission time, output size and the formatter's
+    cache hit rate. Without a grid, both outputs must read back as the same coordinates.
+    """
+    print(f"{'map':<12}{'faces':>9}{'fixed ms':>11}{'cached ms':>11}{'speedup':>9}{'fixed KB':>10}{'cached KB':>11}{'size':>8}{'values':>8}{'hits':>8}")
+    total_fixed_time = total_cached_time = 0.0
+    total_fixed_bytes = total_cached_bytes = 0
+    for map_filepath in map_files:
+        geometry, _ = quiet_parse(map_filepath)
+        fixed_content = vmapconverter.generate_vmf_content(geometry, formatter=FixedPointFormatter())
+        formatter = vmapconverter.CoordinateFormatter(grid)
+        cached_content = vmapconverter.generate_vmf_content(geometry, formatter=formatter)
+        (fixed_coordinates, fixed_axes), (cached_coordinates, cached_axes) = emitted_numbers(fixed_content), emitted_numbers(cached_content)
+        # Both round coordinates to 6 decimals, so they must read back equal up to float noise;
+        # axis values may only differ where :g cut them to 6 significant digits
+        if grid is None and (len(fixed_coordinates) != len(cached_coordinates) or np.abs(fixed_coordinates - cached_coordinates).max(initial=0.0) > 1e-9
+                             or len(fixed_axes) != len(cached_axes) or not np.allclose(fixed_axes, cached_axes, rtol=1e-5, atol=1e-9)):
+            raise SystemExit(f"CoordinateFormatter output disagrees with the fixed-point baseline on {map_filepath}")
+
+        fixed_time = time_call(lambda: vmapconverter.generate_vmf_content(geometry, formatter=FixedPointFormatter()), repeat)
+        cached_time = time_call(lambda: vmapconverter.generate_vmf_content(geometry, formatter=vmapconverter.CoordinateFormatter(grid)), repeat)
+        fixed_bytes, cached_bytes = len(fixed_content.encode('utf-8')), len(cached_content.encode('utf-8'))
+        total_fixed_time += fixed_time
+        total_cached_time += cached_time
+        total_fixed_bytes += fixed_bytes
+        total_cached_bytes += cached_bytes
+        lookups = formatter.hits + formatter.misses
+        print(f"{os.path.basename(map_filepath):<12}{geometry.face_count:>9}{fixed_time * 1000:>11.1f}{cached_time * 1000:>11.1f}"
+              f"{fixed_time / cached_time:>8.2f}x{fixed_bytes / 1024:>10.0f}{cached_bytes / 1024:>11.0f}{cached_bytes / fixed_bytes:>7.0%}"
+              f"{len(formatter.cache):>8}{formatter.hits / max(lookups, 1):>8.0%}")
+    print(f"{'total':<12}{'':>9}{total_fixed_time * 1000:>11.1f}{total_cached_time * 1000:>11.1f}{total_fixed_time / total_cached_time:>8.2f}x"
+          f"{total_fixed_bytes / 1024:>10.0f}{total_cached_bytes / 1024:>11.0f}{total_cached_bytes / total_fixed_bytes:>7.0%}")
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far, or None where the resource module is missing (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024 # ru_maxrss is in KB except on macOS
+
+
+def write_synthetic_wad(wad_filepath, texture_names, seed=0):
+    """
+    Writes a WAD2 holding a miptex (with its four mip levels) for every name in texture_names,
+    so the texture stages can run without the game's WADs. Pixels come from the bundled
+    wad_extracted/<name>.png where present (64x64 noise otherwise).
+    """
+    extracted_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wad_extracted")
+    rng = np.random.default_rng(seed)
+    body = bytearray(12)
+    directory = []
+    for texture_name in sorted(set(texture_names)):
+        png_filepath = os.path.join(extracted_dir, f"{texture_name}.png")
+        if os.path.isfile(png_filepath):
+            with Image.open(png_filepath) as image:
+                pixels = np.asarray(image.convert('P') if image.mode != 'P' else image, dtype=np.uint8)
+        else:
+            pixels = rng.integers(0, 224, size=(64, 64), dtype=np.uint8)
+        height, width = pixels.shape
+        levels = [np.ascontiguousarray(pixels[::1 << level, ::1 << level]).tobytes() for level in range(4)]
+        header_size = struct.calcsize('<16sII4I')
+        offsets = list(itertools.accumulate([header_size] + [len(level) for level in levels[:3]]))
+        lump = struct.pack('<16sII4I', texture_name.encode('ascii')[:15], width, height, *offsets) + b"".join(levels)
+        directory.append(struct.pack('<IIIBBH16s', len(body), len(lump), len(lump), 0x44, 0, 0, texture_name.encode('ascii')[:15]))
+        body += lump
+    directory_offset = len(body)
+    body += b"".join(directory)
+    body[0:12] = struct.pack('<4sII', b'WAD2', len(directory), directory_offset)
+    with open(wad_filepath, 'wb') as f:
+        f.write(body)
+
+
+def write_scaled_map(geometry, copies, map_filepath):
+    """
+    Writes a standard-format .map whose worldspawn holds `copies` copies of geometry's brushes
+    side by side along X, to measure how the stages scale past the size of the real maps.
+    """
+    xs = geometry.points[:, 0::3]
+    spacing = float(xs.max() - xs.min()) + 256.0 if geometry.face_count else 0.0
+    face_texts = [f" {geometry.textures[texture_index]} {u[0]:g} {u[1]:g} {u[2]:g} {u[3]:g} {u[4]:g}"
+                  for texture_index, u in zip(geometry.texture_index.tolist(), geometry.uv.tolist())]
+    brush_offsets = geometry.brush_offsets.tolist()
+    with open(map_filepath, 'w') as f:
+        f.write('{\n"classname" "worldspawn"\n')
+        for copy in range(copies):
+            points = geometry.points.copy()
+            points[:, 0::3] += copy * spacing
+            rows = points.tolist()
+            for start, end in zip(brush_offsets[:-1], brush_offsets[1:]):
+                f.write("{\n")
+                for face in range(start, end):
+                    x1, y1, z1, x2, y2, z2, x3, y3, z3 = rows[face]
+                    f.write(f"( {x1:g} {y1:g} {z1:g} ) ( {x2:g} {y2:g} {z2:g} ) ( {x3:g} {y3:g} {z3:g} ){face_texts[face]}\n")
+                f.write("}\n")
+        f.write('}\n{\n"classname" "info_player_start"\n"origin" "0 0 0"\n}\n')
+
+
+def write_vtex_stub(stub_dir):
+    """
+    Writes a stand-in for vtex.exe that "converts" the PNG it is given by copying it to
+    <VPROJECT>/materials/<name>.vtf, so the vtex backend's process and file handling can be
+    timed without the Source SDK. Returns the path to run it by.
+    """
+    script_filepath = os.path.join(stub_dir, "vtex_stub.py")
+    with open(script_filepath, 'w') as f:
+        f.write(f"#!{sys.executable}\n"
+                "import os, shutil, sys\n"
+                "png_filepath = sys.argv[-1]\n"
+                "materials_dir = os.path.join(os.environ['VPROJECT'], 'materials')\n"
+                "os.makedirs(materials_dir, exist_ok=True)\n"
+                "shutil.copyfile(png_filepath, os.path.join(materials_dir, os.path.splitext(os.path.basename(png_filepath))[0] + '.vtf'))\n")
+    if os.name == 'nt':
+        batch_filepath = os.path.join(stub_dir, "vtex_stub.bat")
+        with open(batch_filepath, 'w') as f:
+            f.write(f'@"{sys.executable}" "{script_filepath}" %*\n')
+        return batch_filepath
+    os.chmod(script_filepath, os.stat(script_filepath).st_mode | stat.S_IXUSR)
+    return script_filepath
+
+
+def run_stage(function, repeat, profile=None, profile_top=15):
+    """
+    Runs function() `repeat` times and returns (best wall-clock seconds, the last result,
+    profile report or None). With profile='cprofile' or 'tracemalloc' one extra, untimed run
+    is made under that profiler and its top profile_top entries are reported.
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+
+    report = None
+    if profile == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        function()
+        profiler.disable()
+        report_stream = io.StringIO()
+        pstats.Stats(profiler, stream=report_stream).sort_stats('cumulative').print_stats(profile_top)
+        report = report_stream.getvalue()
+    elif profile == 'tracemalloc':
+        tracemalloc.start()
+        try:
+            retained = function() # Kept alive so the snapshot shows what the stage's result holds
+            snapshot = tracemalloc.take_snapshot()
+            del retained
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        lines = [f"traced peak: {peak / 1024:.0f} KB"]
+        lines.extend(str(statistic) for statistic in snapshot.statistics('lineno')[:profile_top])
+        report = "\n".join(lines)
+    return best, result, report
+
+
+def _texture_stage_functions(texture_names, wad_filepath, work_dir, vtex_path):
+    """The WAD lookup, PNG extraction and backend stage functions for one map's textures."""
+    png_dir = os.path.join(work_dir, "png")
+    vtf_dir = os.path.join(work_dir, "vtf")
+    vproject_dir = os.path.join(work_dir, "vproject")
+    for directory in (png_dir, vtf_dir, vproject_dir):
+        os.makedirs(directory, exist_ok=True)
+    wad_archives = vmapconverter.open_wad_archives([wad_filepath], lambda message: None)
+    texture_frames = {name: vmapconverter.texture_animation_frames(name, wad_archives) for name in texture_names}
+    found_names = [name for name in texture_names if texture_frames[name]]
+
+    def folder_bytes(directory):
+        return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def wad_lookup():
+        archives = vmapconverter.open_wad_archives([wad_filepath], lambda message: None)
+        try:
+            return sum(bool(vmapconverter.texture_animation_frames(name, archives)) for name in texture_names), 0
+        finally:
+            for archive in archives:
+                archive.close()
+
+    def png_extraction():
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name in found_names:
+                vmapconverter.extract_and_save_texture_png(name, png_dir, wad_archives, None, texture_frames[name])
+        return len(found_names), folder_bytes(png_dir)
+
+    def native_backend():
+        for name in found_names:
+            vmapconverter.write_vtf_from_miptex(name, vtf_dir, wad_archives, lambda message: None, None, texture_frames[name])
+        return len(found_names), folder_bytes(vtf_dir)
+
+    def vtex_backend():
+        for name in found_names:
+            vmapconverter.convert_png_to_vtf(os.path.join(png_dir, f"{name}.png"), vtf_dir, vtex_path, vproject_dir, lambda message: None)
+        return len(found_names), folder_bytes(vtf_dir)
+
+    return wad_archives, [('wad_lookup', wad_lookup, 'textures'), ('png_extraction', png_extraction, 'textures'),
+                          ('native_backend', native_backend, 'textures'), ('vtex_stub_backend', vtex_backend, 'textures')]
+
+
+def benchmark_stages(map_files, repeat, scales, wad_filepath=None, json_filepath=None, profile=None, profile_top=15):
+    """
+    Times each pipeline stage separately on each map: parse_quake_map, generate_vmf_content,
+    WAD lookup, PNG extraction and the texture backends (the native VTF encoder, and vtex
+    through write_vtex_stub). Maps scaled up `scales` times from the first map (see
+    write_scaled_map) are added for the parse and emit stages. Textures are read from
+    wad_filepath, or from a synthetic WAD of the maps' textures (see write_synthetic_wad).
+    Reports throughput (items/s and MB/s of input or output) and the peak RSS after each
+    stage, and writes every record to json_filepath if given.
+    """
+    records = []
+    print(f"{'map':<14}{'stage':<20}{'items':>8}{'unit':>10}{'ms':>10}{'items/s':>12}{'MB/s':>9}{'peak RSS MB':>13}")
+    with tempfile.TemporaryDirectory(prefix="quake_benchmark_") as work_dir:
+        map_texture_names = {map_filepath: sorted(vmapconverter.scan_map_textures(map_filepath)) for map_filepath in map_files}
+        if wad_filepath is None:
+            wad_filepath = os.path.join(work_dir, "synthetic.wad")
+            write_synthetic_wad(wad_filepath, set().union(*map_texture_names.values()) if map_texture_names else [])
+        vtex_path = write_vtex_stub(work_dir)
+
+        map_jobs = [(os.path.basename(map_filepath), map_filepath, map_texture_names[map_filepath]) for map_filepath in map_files]
+        if map_files:
+            base_geometry, _ = quiet_parse(map_files[0])
+            for scale in scales:
+                scaled_filepath = os.path.join(work_dir, f"{os.path.splitext(os.path.basename(map_files[0]))[0]}x{scale}.map")
+                write_scaled_map(base_geometry, scale, scaled_filepath)
+                map_jobs.append((os.path.basename(scaled_filepath), scaled_filepath, None))
+
+        def record(map_name, stage, items, unit, seconds, data_bytes, report):
+            entry = {'map': map_name, 'stage': stage, 'items': items, 'unit': unit, 'seconds': seconds,
+                     'items_per_second': items / seconds if seconds > 0 else None,
+                     'mb_per_second': data_bytes / 1e6 / seconds if seconds > 0 else None,
+                     'bytes': data_bytes, 'peak_rss_bytes': peak_rss_bytes()}
+            records.append(entry)
+            rss = f"{entry['peak_rss_bytes'] / 1e6:>13.0f}" if entry['peak_rss_bytes'] is not None else f"{'n/a':>13}"
+            print(f"{map_name:<14}{stage:<20}{items:>8}{unit:>10}{seconds * 1000:>10.1f}{entry['items_per_second'] or 0:>12.0f}"
+                  f"{entry['mb_per_second'] or 0:>9.1f}{rss}")
+            if report:
+                print(report)
+
+        for map_name, map_filepath, texture_names in map_jobs:
+            seconds, (geometry, _), report = run_stage(lambda: quiet_parse(map_filepath), repeat, profile, profile_top)
+            record(map_name, 'parse', geometry.face_count, 'faces', seconds, os.path.getsize(map_filepath), report)
+            seconds, content, report = run_stage(lambda: vmapconverter.generate_vmf_content(geometry), repeat, profile, profile_top)
+            record(map_name, 'emit', geometry.face_count, 'faces', seconds, len(content.encode('utf-8')), report)
+            del content
+            if texture_names is None:
+                continue # Scaled maps reuse the first map's textures
+            stage_dir = os.path.join(work_dir, os.path.splitext(map_name)[0])
+            wad_archives, stages = _texture_stage_functions(texture_names, wad_filepath, stage_dir, vtex_path)
+            try:
+                for stage, function, unit in stages:
+                    seconds, (items, data_bytes), report = run_stage(function, repeat, profile, profile_top)
+                    record(map_name, stage, items, unit, seconds, data_bytes, report)
+            finally:
+                for archive in wad_archives:
+                    archive.close()
+            shutil.rmtree(stage_dir, ignore_errors=True)
+
+    if json_filepath:
+        with open(json_filepath, 'w') as f:
+            json.dump({'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+                       'repeat': repeat, 'profile': profile, 'records': records}, f, indent=1)
+        print(f"Wrote {len(records)} records to {json_filepath}")
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    parse_parser = subparsers.add_parser("parse", help="compare parse_quake_map against the legacy regex parser")
+    parse_parser.add_argument("--repeat", type=int, default=3, help="runs per map; the best time is reported")
+    parse_parser.add_argument("--memory", action="store_true", help="also report tracemalloc peak and retained memory")
+    parse_parser.add_argument("maps", nargs="*", help="map files (default: bundled E1M*.MAP)")
+    emit_parser = subparsers.add_parser("emit", help="compare VMF emission with fixed-point and cached shortest coordinate formatting")
+    emit_parser.add_argument("--repeat", type=int, default=3, help="runs per map; the best time is reported")
+    emit_parser.add_argument("--grid", type=float, default=None, help="also snap coordinates to multiples of this many units")
+    emit_parser.add_argument("maps", nargs="*", help="map files (default: bundled E1M*.MAP)")
+    stages_parser = subparsers.add_parser("stages", help="time every pipeline stage separately and report throughput and peak RSS")
+    stages_parser.add_argument("--repeat", type=int, default=3, help="runs per stage; the best time is reported")
+    stages_parser.add_argument("--scale", type=int, nargs="*", default=[4, 16], metavar="K",
+                               help="also parse and emit synthetic maps holding K copies of the first map (default: 4 16)")
+    stages_parser.add_argument("--wad", help="texture source for the texture stages (default: a synthetic WAD of the maps' textures)")
+    stages_parser.add_argument("--json", help="write the results as JSON to this file for regression tracking")
+    stages_parser.add_argument("--profile", choices=("cprofile", "tracemalloc"), help="also profile every stage in one extra run")
+    stages_parser.add_argument("--profile-top", type=int, default=15, help="entries shown per profile (default: 15)")
+    stages_parser.add_argument("maps", nargs="*", help="map files (default: bundled E1M*.MAP)")
+    args = parser.parse_args()
+
+    if args.benchmark == "parse":
+        benchmark_parse(args.maps or default_map_files(), args.repeat, args.memory)
+    elif args.benchmark == "emit":
+        benchmark_emit(args.maps or default_map_files(), args.repeat, args.grid)
+    elif args.benchmark == "stages":
+        benchmark_stages(args.maps or default_map_files(), args.repeat, args.scale, args.wad, args.json, args.profile, args.profile_top)
@@ -0,0 +1,176 @@
+"""
+Assertion checks for invariants of the converter's .vmf output that a visual inspection in
+Hammer would otherwise be needed to catch. Each check emits a map (synthetic, or the bundled
+quake_maps_input/E1M*.MAP files), reads the .vmf text back and asserts on it:
+
+  atlas tiling   a face that tiles its texture past one repeat keeps its own material, and
+                 every side written with an atlas sheet samples only its texture's rect
+                 (see fit_texture_atlas)
+  entity         with the default y-up transform, door, push and spawn directions point
+  directions     where the transform takes their Quake directions, and a door slides
+                 along its remapped brush (see transform_entity_angles)
+
+    python checks.py [map files...]
+
+Exits with an AssertionError naming the broken invariant, or prints one line per check.
+"""
+import contextlib
+import glob
+import os
+import re
+import sys
+import tempfile
+
+import numpy as np
+
+import vmapconverter
+
+
+# VMF side lines, read back in file order
+_MATERIAL_LINE_RE = re.compile(r'"material" "([^"]*)"')
+_AXIS_LINE_RE = re.compile(r'"[uv]axis" "\[([^\]]*)\] ([^"]*)"')
+_PLANE_LINE_RE = re.compile(r'"plane" "\(([^)]*)\) \(([^)]*)\) \(([^)]*)\)"')
+# Entity blocks and their key-value lines
+_ENTITY_BLOCK_RE = re.compile(r'^entity\n\{\n(.*?)^\}', re.M | re.S)
+_KEYVALUE_LINE_RE = re.compile(r'^    "([^"]*)" "([^"]*)"$', re.M)
+
+# Texels a side may overhang its atlas rect by (the emitted offsets are rounded to 4 decimals)
+ATLAS_RECT_EPSILON = 1e-3
+
+
+def default_map_files():
+    """Returns the bundled E1 episode maps."""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return sorted(glob.glob(os.path.join(script_dir, "quake_maps_input", "E1M*.MAP")))
+
+
+def parse_map_text(map_text):
+    """Parses map_text (the contents of a .map file) into a MapGeometry, without console output."""
+    with tempfile.TemporaryDirectory(prefix="quake_check_") as work_dir:
+        map_filepath = os.path.join(work_dir, "check.map")
+        with open(map_filepath, 'w') as f:
+            f.write(map_text)
+        return parse_map_file(map_filepath)
+
+
+def parse_map_file(map_filepath):
+    """parse_quake_map's geometry for map_filepath, without console output."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        geometry, _ = vmapconverter.parse_quake_map(map_filepath)
+    return geometry
+
+
+def box_brush_text(mins, maxs, texture_name):
+    """A standard-format axis-aligned box brush from mins to maxs, every face using texture_name."""
+    (x0, y0, z0), (x1, y1, z1) = mins, maxs
+    planes = [((x0, y0, z0), (x0, y0 + 1, z0), (x0, y0, z0 + 1)), ((x0, y0, z0), (x0, y0, z0 + 1), (x0 + 1, y0, z0)),
+              ((x0, y0, z0), (x0 + 1, y0, z0), (x0, y0 + 1, z0)), ((x1, y1, z1), (x1, y1 + 1, z1), (x1 + 1, y1, z1)),
+              ((x1, y1, z1), (x1 + 1, y1, z1), (x1, y1, z1 + 1)), ((x1, y1, z1), (x1, y1, z1 + 1), (x1, y1 + 1, z1))]
+    lines = [" ".join(f"( {x:g} {y:g} {z:g} )" for x, y, z in plane) + f" {texture_name} 0 0 0 1 1" for plane in planes]
+    return "{\n" + "\n".join(lines) + "\n}\n"
+
+
+def emitted_face_rows(geometry):
+    """Face rows of geometry in the order the .vmf writes their sides: world brushes, then each entity's."""
+    world_entity_index = geometry.world_entity_index
+    entity_order = [world_entity_index] + [entity_index for entity_index in range(len(geometry.entities)) if entity_index != world_entity_index]
+    brush_offsets = geometry.brush_offsets.tolist()
+    return [face_row for entity_index in entity_order for brush_index in geometry.entity_brushes(entity_index).tolist()
+            for face_row in range(brush_offsets[brush_index], brush_offsets[brush_index + 1])]
+
+
+def atlas_sheet_texels(geometry, windings, vmf_content, atlas, transform=vmapconverter.DEFAULT_MAP_TRANSFORM):
+    """
+    For every side of vmf_content written with an atlas sheet, the sheet texels its winding
+    samples, with the rect of the texture it came from: yields (face row, texture name,
+    (u min, v min), (u max, v max), (x, y, width, height)).
+    """
+    materials = _MATERIAL_LINE_RE.findall(vmf_content)
+    axis_values = [[float(value) for group in match.groups() for value in group.split()] for match in _AXIS_LINE_RE.finditer(vmf_content)]
+    face_rows = emitted_face_rows(geometry)
+    assert len(materials) == len(face_rows) and len(axis_values) == 2 * len(face_rows), "the emitted sides do not line up with the map's faces"
+    sheet_materials = {atlas.sheet_name(sheet_index).upper() for sheet_index in range(len(atlas))}
+    for side, (material, face_row) in enumerate(zip(materials, face_rows)):
+        if material not in sheet_materials or not windings.face_valid[face_row]:
+            continue
+        points = transform.apply_points(windings.face_winding(face_row))
+        # Source texel coordinates: u = dot(p, axis) / scale + offset
+        texels = np.column_stack([points @ np.array(axis[0:3]) / axis[4] + axis[3] for axis in axis_values[2 * side:2 * side + 2]])
+        texture_name = vmapconverter.texture_family_name(geometry.textures[geometry.texture_index[face_row]])
+        yield face_row, texture_name, texels.min(axis=0), texels.max(axis=0), atlas.rects[texture_name][1:5]
+
+
+def assert_sides_within_rects(geometry, vmf_content, atlas, label):
+    """Asserts that every atlas side of vmf_content samples only its own rect; returns how many there are."""
+    windings = vmapconverter.clip_brush_windings(geometry)
+    sheet_sides = 0
+    for face_row, texture_name, texel_mins, texel_maxs, (x, y, width, height) in atlas_sheet_texels(geometry, windings, vmf_content, atlas):
+        assert np.all(texel_mins >= (x - ATLAS_RECT_EPSILON, y - ATLAS_RECT_EPSILON)) and \
+            np.all(texel_maxs <= (x + width + ATLAS_RECT_EPSILON, y + height + ATLAS_RECT_EPSILON)), \
+            f"face {face_row} ('{texture_name}') of {label} samples outside its atlas rect"
+        sheet_sides += 1
+    return sheet_sides
+
+
+def check_atlas_tiling(map_files):
+    """
+    A brush whose faces tile their texture keeps its own material while a brush within one
+    repeat moves onto the sheet; on each map, with every candidate texture packed as 64x64,
+    all sides written with a sheet sample only their own texture's rect.
+    """
+    geometry = parse_map_text('{\n"classname" "worldspawn"\n' + box_brush_text((0, 0, 0), (256, 256, 256), "tiled")
+                              + box_brush_text((512, 0, 0), (544, 32, 32), "single") + '}\n')
+    texture_sizes = {'tiled': (64, 64), 'single': (64, 64)}
+    atlas = vmapconverter.TextureAtlas.pack(texture_sizes)
+    content = vmapconverter.generate_vmf_content(geometry, atlas=atlas, texture_sizes=texture_sizes)
+    materials = _MATERIAL_LINE_RE.findall(content)
+    assert materials == ["TILED"] * 6 + [atlas.material('single').upper()] * 6, \
+        f"tiled faces must keep their own material and single-repeat faces use the sheet, got {materials}"
+    assert_sides_within_rects(geometry, content, atlas, "the tiling map")
+    print("atlas tiling: tiled faces keep their own material, single-repeat faces are on the sheet")
+
+    for map_filepath in map_files:
+        geometry = parse_map_file(map_filepath)
+        texture_sizes = {texture_name: (64, 64) for texture_name in geometry.textures}
+        candidates = {vmapconverter.texture_family_name(texture_name): (64, 64) for texture_name in geometry.textures
+                      if vmapconverter.tool_material(texture_name) is None and texture_name[0] not in '+{*'}
+        atlas = vmapconverter.TextureAtlas.pack(candidates)
+        content = vmapconverter.generate_vmf_content(geometry, atlas=atlas, texture_sizes=texture_sizes)
+        sheet_sides = assert_sides_within_rects(geometry, content, atlas, map_filepath)
+        print(f"atlas tiling: {os.path.basename(map_filepath)}: {sheet_sides} sheet side(s) sample only their own rect")
+
+
+def check_entity_directions(transform=vmapconverter.DEFAULT_MAP_TRANSFORM):
+    """
+    A door sliding along its long side (Quake 'angle'), a trigger_push pushing up (angle -1)
+    and a spawn with full 'angles' point in output space where transform takes their Quake
+    directions (forward and, for the spawn, up), and the door along its brush's longest extent.
+    """
+    geometry = parse_map_text('{\n"classname" "worldspawn"\n' + box_brush_text((-512, -512, -16), (512, 512, 0), "floor") + '}\n'
+                              '{\n"classname" "func_door"\n"angle" "90"\n' + box_brush_text((0, 0, 0), (16, 128, 64), "door") + '}\n'
+                              '{\n"classname" "trigger_push"\n"angle" "-1"\n' + box_brush_text((64, 0, 0), (128, 64, 64), "trigger") + '}\n'
+                              '{\n"classname" "info_player_start"\n"origin" "256 0 24"\n"angles" "-30 135 10"\n}\n')
+    content = vmapconverter.generate_vmf_content(geometry, transform)
+    entities = [(dict(_KEYVALUE_LINE_RE.findall(block)), block) for block in _ENTITY_BLOCK_RE.findall(content)]
+    rotation = transform.linear / np.linalg.norm(transform.linear[:, 0])
+    expected = {'func_door': ('movedir', (0, 1, 0), None), 'trigger_push': ('pushdir', (0, 0, 1), None),
+                'info_player_start': ('angles', None, (-30, 135, 10))}
+    for classname, (key, quake_forward, quake_angles) in expected.items():
+        keyvalues, block = next(entity for entity in entities if entity[0].get('classname') == classname)
+        forward, up = vmapconverter.angle_vectors([[float(c) for c in keyvalues[key].split()]])
+        if quake_angles is not None:
+            quake_forward, quake_up = vmapconverter.angle_vectors([quake_angles])
+            assert np.allclose(up, quake_up @ rotation.T, atol=1e-3), f"{classname} '{key}' {keyvalues[key]} is not rolled like the converted geometry"
+        assert np.allclose(forward, np.reshape(quake_forward, (1, 3)) @ rotation.T, atol=1e-3), \
+            f"{classname} '{key}' {keyvalues[key]} does not point where the transform takes its Quake direction"
+        if classname == 'func_door':
+            coordinates = np.array([float(c) for match in _PLANE_LINE_RE.finditer(block) for group in match.groups() for c in group.split()]).reshape(-1, 3)
+            long_axis = np.argmax(coordinates.max(axis=0) - coordinates.min(axis=0))
+            assert abs(forward[0, long_axis]) > 1.0 - 1e-3, f"func_door 'movedir' {keyvalues[key]} does not run along its brush's longest side"
+        print(f"entity directions: {classname} '{key}' {keyvalues[key]} matches the converted geometry")
+
+
+if __name__ == "__main__":
+    map_files = sys.argv[1:] or default_map_files()
+    check_atlas_tiling(map_files)
+    check_entity_directions()
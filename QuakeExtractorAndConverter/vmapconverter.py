@@ -1,499 +1,3771 @@
 import os
 import re
+import operator
 import shutil
-import tkinter as tk
-from tkinter import scrolledtext, messagebox, filedialog
+import argparse
 import threading
 import sys
 import subprocess
 import struct
+import mmap
+import io
+import contextlib
+import concurrent.futures
+import warnings
+import array
+import tempfile
+import hashlib
+import json
+import time
+import collections
 from PIL import Image
+import numpy as np
+
+# tkinter is only imported by run_gui(), so headless (command-line) runs never load Tk
+tk = scrolledtext = messagebox = filedialog = None
 
 # --- Quake 1 Default Palette (RGB values 0-255) ---
 QUAKE_PALETTE = [
     (0, 0, 0), (15, 15, 15), (31, 31, 31), (47, 47, 47), (63, 63, 63), (75, 75, 75), (91, 91, 91), (107, 107, 107),
     (123, 123, 123), (139, 139, 139), (155, 155, 155), (171, 171, 171), (187, 187, 187), (203, 203, 203), (219, 219, 219), (235, 235, 235),
-    (15, 11, 7), (23, 15, 11), (31, 19, 15), (39, 23, 19), (47, 27, 23), (55, 31, 27), (63, 35, 31), (71, 39, 35),
-    (79, 43, 39), (87, 47, 43), (95, 51, 47), (103, 55, 51), (111, 59, 55), (119, 63, 59), (127, 67, 63), (135, 71, 67),
-    (15, 7, 3), (23, 11, 7), (31, 15, 11), (39, 19, 15), (47, 23, 19), (55, 27, 23), (63, 31, 27), (71, 35, 31),
-    (79, 39, 35), (87, 43, 39), (95, 47, 43), (103, 51, 47), (111, 55, 51), (119, 59, 55), (127, 63, 59), (135, 67, 63),
-    (15, 15, 3), (23, 23, 7), (31, 31, 11), (39, 39, 15), (47, 47, 19), (55, 55, 23), (63, 63, 27), (71, 71, 31),
-    (79, 79, 35), (87, 87, 39), (95, 95, 43), (103, 103, 47), (111, 111, 51), (119, 119, 55), (127, 127, 59), (135, 135, 63),
-    (7, 3, 15), (11, 7, 23), (15, 11, 31), (19, 15, 39), (23, 19, 47), (27, 23, 55), (31, 27, 63), (35, 31, 71),
-    (39, 35, 79), (43, 39, 87), (47, 43, 95), (51, 47, 103), (55, 51, 111), (59, 55, 119), (63, 59, 127), (67, 63, 135),
-    (3, 7, 15), (7, 11, 23), (11, 15, 31), (15, 19, 39), (19, 23, 47), (23, 27, 55), (27, 31, 63), (31, 35, 71),
-    (35, 39, 79), (39, 43, 87), (43, 47, 95), (47, 51, 103), (51, 55, 111), (55, 59, 119), (59, 63, 127), (63, 67, 135),
-    (3, 15, 15), (7, 23, 23), (11, 31, 31), (15, 39, 39), (19, 47, 47), (23, 55, 55), (27, 63, 63), (31, 71, 71),
-    (35, 79, 79), (39, 87, 87), (43, 95, 95), (47, 103, 103), (51, 111, 111), (55, 119, 119), (59, 127, 127), (63, 135, 135),
-    (15, 3, 7), (23, 7, 11), (31, 11, 15), (39, 15, 19), (47, 19, 23), (55, 23, 27), (63, 27, 31), (71, 31, 35),
-    (79, 35, 39), (87, 39, 43), (95, 43, 47), (103, 47, 51), (111, 51, 55), (119, 55, 59), (127, 59, 63), (135, 63, 67),
-    (7, 15, 3), (11, 23, 7), (15, 31, 11), (19, 39, 15), (23, 47, 19), (27, 55, 23), (31, 63, 27), (35, 71, 31),
-    (39, 79, 35), (43, 87, 39), (47, 95, 43), (51, 103, 47), (55, 111, 51), (59, 119, 55), (63, 127, 59), (67, 135, 63),
-    (15, 7, 7), (23, 11, 11), (31, 15, 15), (39, 19, 19), (47, 23, 23), (55, 27, 27), (63, 31, 31), (71, 35, 35),
-    (79, 39, 39), (87, 43, 43), (95, 47, 47), (103, 51, 51), (111, 55, 55), (119, 59, 59), (127, 63, 63), (135, 67, 67),
-    (7, 3, 3), (11, 7, 7), (15, 11, 11), (19, 15, 15), (23, 19, 19), (27, 23, 23), (31, 27, 27), (35, 31, 31),
-    (39, 35, 35), (43, 39, 39), (47, 43, 43), (51, 47, 47), (55, 51, 51), (59, 55, 55), (63, 59, 59), (67, 63, 63),
-    (3, 7, 3), (7, 11, 7), (11, 15, 11), (15, 19, 15), (19, 23, 19), (23, 27, 23), (27, 31, 27), (31, 35, 31),
-    (35, 39, 35), (39, 43, 39), (43, 47, 43), (47, 51, 47), (51, 55, 51), (55, 59, 55), (59, 63, 59), (63, 67, 63),
-    (7, 3, 7), (11, 7, 11), (15, 11, 15), (19, 15, 19), (23, 19, 23), (27, 23, 27), (31, 27, 31), (35, 31, 35),
-    (39, 35, 39), (43, 39, 43), (47, 43, 47), (51, 47, 51), (55, 51, 55), (59, 55, 59), (63, 59, 63), (67, 63, 67),
-    (3, 3, 7), (7, 7, 11), (11, 11, 15), (15, 15, 19), (19, 19, 23), (23, 23, 27), (27, 27, 31), (31, 31, 35),
-    (35, 35, 39), (39, 39, 43), (43, 43, 47), (47, 47, 51), (51, 51, 55), (55, 55, 59), (59, 59, 63), (63, 63, 67),
-    (15, 3, 3), (23, 7, 7), (31, 11, 11), (39, 15, 15), (47, 19, 19), (55, 23, 23), (63, 27, 27), (71, 31, 31),
-    (79, 35, 35), (87, 39, 39), (95, 43, 43), (103, 47, 47), (111, 51, 51), (119, 55, 55), (127, 59, 59), (135, 63, 63),
-    (63, 0, 0), (71, 0, 0), (79, 0, 0), (87, 0, 0), (95, 0, 0), (103, 0, 0), (111, 0, 0), (119, 0, 0),
-    (127, 0, 0), (135, 0, 0), (143, 0, 0), (151, 0, 0), (159, 0, 0), (167, 0, 0), (175, 0, 0), (183, 0, 0),
-    (63, 63, 0), (71, 71, 0), (79, 79, 0), (87, 87, 0), (95, 95, 0), (103, 103, 0), (111, 111, 0), (119, 119, 0),
-    (127, 127, 0), (135, 135, 0), (143, 143, 0), (151, 151, 0), (159, 159, 0), (167, 167, 0), (175, 175, 0), (183, 183, 0),
-    (0, 63, 0), (0, 71, 0), (0, 79, 0), (0, 87, 0), (0, 95, 0), (0, 103, 0), (0, 111, 0), (0, 119, 0),
-    (0, 127, 0), (0, 135, 0), (0, 143, 0), (0, 151, 0), (0, 159, 0), (0, 167, 0), (0, 175, 0), (0, 183, 0),
-    (0, 63, 63), (0, 71, 71), (0, 79, 79), (0, 87, 87), (0, 95, 95), (0, 103, 103), (0, 111, 111), (0, 119, 119),
-    (0, 127, 127), (0, 135, 135), (0, 143, 143), (0, 151, 151), (0, 159, 159), (0, 167, 167), (0, 175, 175), (0, 183, 183),
-    (0, 0, 63), (0, 0, 71), (0, 0, 79), (0, 0, 87), (0, 0, 95), (0, 0, 103), (0, 0, 111), (0, 0, 119),
-    (0, 0, 127), (0, 0, 135), (0, 0, 143), (0, 0, 151), (0, 0, 159), (0, 0, 167), (0, 0, 175), (0, 0, 183),
-    (63, 0, 63), (71, 0, 71), (79, 0, 79), (87, 0, 87), (95, 0, 95), (103, 0, 103), (111, 0, 111), (119, 0, 119),
-    (127, 0, 127), (135, 0, 135), (143, 0, 143), (151, 0, 151), (159, 0, 159), (167, 0, 167), (175, 0, 175), (183, 0, 183),
-    (31, 31, 0), (39, 39, 0), (47, 47, 0), (55, 55, 0), (63, 63, 0), (71, 71, 0), (79, 79, 0), (87, 87, 0),
-    (95, 95, 0), (103, 103, 0), (111, 111, 0), (119, 119, 0), (127, 127, 0), (135, 135, 0), (143, 143, 0), (151, 151, 0),
-    (0, 31, 31), (0, 39, 39), (0, 47, 47), (0, 55, 55), (0, 63, 63), (0, 71, 71), (0, 79, 79), (0, 87, 87),
-    (0, 95, 95), (0, 103, 103), (0, 111, 111), (0, 119, 119), (0, 127, 127), (0, 135, 135), (0, 143, 143), (0, 151, 151),
-    (31, 0, 31), (39, 0, 39), (47, 0, 47), (55, 0, 55), (63, 0, 63), (71, 0, 71), (79, 0, 79), (87, 0, 87),
-    (95, 0, 95), (103, 0, 103), (111, 0, 111), (119, 0, 119), (127, 0, 127), (135, 0, 135), (143, 0, 143), (151, 0, 151),
-    (47, 31, 15), (55, 39, 23), (63, 47, 31), (71, 55, 39), (79, 63, 47), (87, 71, 55), (95, 79, 63), (103, 87, 71),
-    (111, 95, 79), (119, 103, 87), (127, 111, 95), (135, 119, 103), (143, 127, 111), (151, 135, 119), (159, 143, 127), (167, 151, 135),
-    (183, 159, 127), (191, 167, 135), (199, 175, 143), (207, 183, 151), (215, 191, 159), (223, 199, 167), (231, 207, 175), (239, 215, 183),
-    (247, 223, 191), (255, 231, 199), (255, 239, 207), (255, 247, 215), (255, 255, 223), (255, 255, 231), (255, 255, 239), (255, 255, 247)
+    (15, 11, 7), (23, 15, 11), (31, 23, 11), (39, 27, 15), (47, 35, 19), (55, 43, 23), (63, 47, 23), (75, 55, 27),
+    (83, 59, 27), (91, 67, 31), (99, 75, 31), (107, 83, 31), (115, 87, 31), (123, 95, 35), (131, 103, 35), (143, 111, 35),
+    (11, 11, 15), (19, 19, 27), (27, 27, 39), (39, 39, 51), (47, 47, 63), (55, 55, 75), (63, 63, 87), (71, 71, 103),
+    (79, 79, 115), (91, 91, 127), (99, 99, 139), (107, 107, 151), (115, 115, 163), (123, 123, 175), (131, 131, 187), (139, 139, 203),
+    (0, 0, 0), (7, 7, 0), (11, 11, 0), (19, 19, 0), (27, 27, 0), (35, 35, 0), (43, 43, 7), (47, 47, 7),
+    (55, 55, 7), (63, 63, 7), (71, 71, 7), (75, 75, 11), (83, 83, 11), (91, 91, 11), (99, 99, 11), (107, 107, 15),
+    (7, 0, 0), (15, 0, 0), (23, 0, 0), (31, 0, 0), (39, 0, 0), (47, 0, 0), (55, 0, 0), (63, 0, 0),
+    (71, 0, 0), (79, 0, 0), (87, 0, 0), (95, 0, 0), (103, 0, 0), (111, 0, 0), (119, 0, 0), (127, 0, 0),
+    (19, 19, 0), (27, 27, 0), (35, 35, 0), (47, 43, 0), (55, 47, 0), (67, 55, 0), (75, 59, 7), (87, 67, 7),
+    (95, 71, 7), (107, 75, 11), (119, 83, 15), (131, 87, 19), (139, 91, 19), (151, 95, 27), (163, 99, 31), (175, 103, 35),
+    (35, 19, 7), (47, 23, 11), (59, 31, 15), (75, 35, 19), (87, 43, 23), (99, 47, 31), (115, 55, 35), (127, 59, 43),
+    (143, 67, 51), (159, 79, 51), (175, 99, 47), (191, 119, 47), (207, 143, 43), (223, 171, 39), (239, 203, 31), (255, 243, 27),
+    (11, 7, 0), (27, 19, 0), (43, 35, 15), (55, 43, 19), (71, 51, 27), (83, 55, 35), (99, 63, 43), (111, 71, 51),
+    (127, 83, 63), (139, 95, 71), (155, 107, 83), (167, 123, 95), (183, 135, 107), (195, 147, 123), (211, 163, 139), (227, 179, 151),
+    (171, 139, 163), (159, 127, 151), (147, 115, 135), (139, 103, 123), (127, 91, 111), (119, 83, 99), (107, 75, 87), (95, 63, 75),
+    (87, 55, 67), (75, 47, 55), (67, 39, 47), (55, 31, 35), (43, 23, 27), (35, 19, 19), (23, 11, 11), (15, 7, 7),
+    (187, 115, 159), (175, 107, 143), (163, 95, 131), (151, 87, 119), (139, 79, 107), (127, 75, 95), (115, 67, 83), (107, 59, 75),
+    (95, 51, 63), (83, 43, 55), (71, 35, 43), (59, 31, 35), (47, 23, 27), (35, 19, 19), (23, 11, 11), (15, 7, 7),
+    (219, 195, 187), (203, 179, 167), (191, 163, 155), (175, 151, 139), (163, 135, 123), (151, 123, 111), (135, 111, 95), (123, 99, 83),
+    (107, 87, 71), (95, 75, 59), (83, 63, 51), (67, 51, 39), (55, 43, 31), (39, 31, 23), (27, 19, 15), (15, 11, 7),
+    (111, 131, 123), (103, 123, 111), (95, 115, 103), (87, 107, 95), (79, 99, 87), (71, 91, 79), (63, 83, 71), (55, 75, 63),
+    (47, 67, 55), (43, 59, 47), (35, 51, 39), (31, 43, 31), (23, 35, 23), (15, 27, 19), (11, 19, 11), (7, 11, 7),
+    (255, 243, 27), (239, 223, 23), (219, 203, 19), (203, 183, 15), (187, 167, 15), (171, 151, 11), (155, 131, 7), (139, 115, 7),
+    (123, 99, 7), (107, 83, 0), (91, 71, 0), (75, 55, 0), (59, 43, 0), (43, 31, 0), (27, 15, 0), (11, 7, 0),
+    (0, 0, 255), (11, 11, 239), (19, 19, 223), (27, 27, 207), (35, 35, 191), (43, 43, 175), (47, 47, 159), (47, 47, 143),
+    (47, 47, 127), (47, 47, 111), (47, 47, 95), (43, 43, 79), (35, 35, 63), (27, 27, 47), (19, 19, 31), (11, 11, 15),
+    (43, 0, 0), (59, 0, 0), (75, 7, 0), (95, 7, 0), (111, 15, 0), (127, 23, 7), (147, 31, 7), (163, 39, 11),
+    (183, 51, 15), (195, 75, 27), (207, 99, 43), (219, 127, 59), (227, 151, 79), (231, 171, 95), (239, 191, 119), (247, 211, 139),
+    (167, 123, 59), (183, 155, 55), (199, 195, 55), (231, 227, 87), (127, 191, 255), (171, 231, 255), (215, 255, 255), (103, 0, 0),
+    (139, 0, 0), (179, 0, 0), (215, 0, 0), (255, 0, 0), (255, 243, 147), (255, 247, 199), (255, 255, 255), (159, 91, 83)
 ]
 # Flatten the palette list of tuples into a single list of integers
 FLATTENED_PALETTE = [c for color_tuple in QUAKE_PALETTE for c in color_tuple]
 
 
-def parse_quake_map(map_filepath):
+class Palette:
+    """
+    A 256-colour Quake palette as a precomputed 256x4 uint8 RGBA lookup table, so a miptex
+    index buffer becomes an RGBA array with a single NumPy take.
+    Indices fullbright_start..254 are fullbright (drawn unlit by Quake); index 255 is the
+    transparency key of '{' textures. With fullbright_alpha, expanded opaque textures carry
+    a fullbright mask in alpha (255 where fullbright), as used by Source's $selfillum.
+    """
+    LMP_SIZE = 768 # palette.lmp: 256 RGB triplets
+    FULLBRIGHT_START = 224
+    TRANSPARENT_INDEX = 255
+
+    def __init__(self, colors=QUAKE_PALETTE, fullbright_start=FULLBRIGHT_START, fullbright_alpha=False, source="built-in"):
+        self.rgb = np.array(colors, dtype=np.uint8).reshape(256, 3)
+        self.fullbright_start = fullbright_start
+        self.fullbright_alpha = fullbright_alpha
+        self.source = source
+        self.lut = np.empty((256, 4), dtype=np.uint8)
+        self.lut[:, :3] = self.rgb
+        self.lut[:, 3] = 255
+        # '{' textures: index 255 becomes transparent black
+        self.transparent_lut = self.lut.copy()
+        self.transparent_lut[self.TRANSPARENT_INDEX] = 0
+        # Opaque textures with a fullbright mask in alpha
+        self.fullbright_lut = self.lut.copy()
+        self.fullbright_lut[:, 3] = 0
+        self.fullbright_lut[fullbright_start:self.TRANSPARENT_INDEX, 3] = 255
+        self.is_fullbright = np.zeros(256, dtype=bool)
+        self.is_fullbright[fullbright_start:self.TRANSPARENT_INDEX] = True
+
+    @classmethod
+    def from_lmp(cls, lmp_filepath, **kwargs):
+        """Loads a palette.lmp (768 bytes of RGB triplets), loose or inside a PAK."""
+        file_system = QuakeFileSystem()
+        try:
+            data = file_system.read(lmp_filepath)[:cls.LMP_SIZE]
+        finally:
+            file_system.close()
+        if len(data) != cls.LMP_SIZE:
+            raise ValueError(f"'{lmp_filepath}' is not a palette.lmp ({len(data)} bytes, expected {cls.LMP_SIZE}).")
+        return cls(np.frombuffer(data, dtype=np.uint8), source=lmp_filepath, **kwargs)
+
+    @property
+    def flattened(self):
+        """The palette as a flat [r, g, b, ...] list for PIL's putpalette."""
+        return self.rgb.reshape(-1).tolist()
+
+    @property
+    def key(self):
+        """Hash of everything that affects expanded pixels, for build manifests."""
+        return hashlib.sha1(self.lut.tobytes() + bytes([self.fullbright_start, self.fullbright_alpha])).hexdigest()
+
+    def indices(self, pixel_data, width, height):
+        """Views a miptex index buffer as a (height, width) uint8 array without copying."""
+        return np.frombuffer(pixel_data, dtype=np.uint8, count=width * height).reshape(height, width)
+
+    def expand(self, pixel_data, width, height, transparent=False):
+        """
+        Converts a miptex index buffer into an (height, width, 4) uint8 RGBA array.
+        With transparent (for '{' textures) index 255 is fully transparent; otherwise alpha
+        is opaque, or the fullbright mask if fullbright_alpha is set.
+        """
+        if transparent:
+            lut = self.transparent_lut
+        elif self.fullbright_alpha:
+            lut = self.fullbright_lut
+        else:
+            lut = self.lut
+        return np.take(lut, self.indices(pixel_data, width, height), axis=0)
+
+    def has_fullbrights(self, pixel_data, width, height):
+        """True if any pixel uses a fullbright palette index."""
+        return bool(self.is_fullbright[self.indices(pixel_data, width, height)].any())
+
+
+DEFAULT_PALETTE = Palette()
+
+
+def find_palette_lmp(search_dirs):
+    """
+    Returns the first palette.lmp found in search_dirs or their gfx/ subfolders, or None.
+    Search folders may be PAK files (see QuakeFileSystem), e.g. 'id1/pak0.pak'.
+    """
+    file_system = QuakeFileSystem()
+    try:
+        for search_dir in search_dirs:
+            for candidate in (os.path.join(search_dir, "palette.lmp"), os.path.join(search_dir, "gfx", "palette.lmp")):
+                if not os.path.isdir(candidate) and file_system.exists(candidate):
+                    return candidate
+    finally:
+        file_system.close()
+    return None
+
+
+def palette_search_dirs(wad_files_paths):
+    """
+    Folders searched for palette.lmp by default: the PAK files and game folders among the
+    texture sources (and the PAKs inside them), then those holding the WAD files and their parents.
+    """
+    search_dirs = []
+    for source_path in wad_files_paths:
+        if source_path.lower().endswith('.pak'):
+            search_dirs.append(source_path)
+        elif os.path.isdir(source_path):
+            search_dirs.append(source_path)
+            search_dirs.extend(os.path.join(source_path, entry) for entry in sorted(os.listdir(source_path), reverse=True)
+                               if entry.lower().endswith('.pak'))
+    wad_dirs = [os.path.dirname(os.path.abspath(wad_path)) for wad_path in wad_files_paths]
+    return search_dirs + wad_dirs + [os.path.dirname(wad_dir) for wad_dir in wad_dirs]
+
+
+def load_palette(palette_path=None, search_dirs=(), fullbright_alpha=False):
+    """
+    Loads the palette used to expand textures: palette_path (a palette.lmp or a folder
+    containing one), else the first palette.lmp found in search_dirs (e.g. the game or WAD
+    folders), else the built-in Quake palette. Unreadable files are reported and skipped.
+    """
+    if palette_path and os.path.isdir(palette_path):
+        palette_path = find_palette_lmp([palette_path])
+    elif not palette_path:
+        palette_path = find_palette_lmp(search_dirs)
+    if palette_path:
+        try:
+            return Palette.from_lmp(palette_path, fullbright_alpha=fullbright_alpha)
+        except (OSError, ValueError) as e:
+            print(f"  [WARNING] Could not load palette '{palette_path}': {e}. Using the built-in Quake palette.")
+    return Palette(fullbright_alpha=fullbright_alpha)
+
+
+# Token positions of the nine plane point coordinates in a whitespace-split plane line:
+# ( x1 y1 z1 ) ( x2 y2 z2 ) ( x3 y3 z3 ) TEXTURE_NAME ...
+_PLANE_POINT_TOKENS = operator.itemgetter(1, 2, 3, 6, 7, 8, 11, 12, 13)
+_PLANE_TEXTURE_TOKEN = 15
+# Valve220 suffix: [ ux uy uz offsetX ] [ vx vy vz offsetY ] rotation scaleX scaleY
+_VALVE220_AXIS_TOKENS = operator.itemgetter(17, 18, 19, 20, 23, 24, 25, 26, 28, 29, 30)
+# Fallback for plane lines that do not separate brackets with whitespace, e.g. "(0 0 0)"
+_PLANE_BRACKET_RE = re.compile(r'([()\[\]])')
+# Turns the bracket punctuation of a plane line into plain number separators
+_BRACKETS_TO_SPACES = str.maketrans('()[]', '    ')
+# Texture name of a plane line: the token after the ')' that closes the third point (the
+# other two are followed by '('). Splitting a batch on it leaves only number text in between.
+_PLANE_TEXTURE_RE = re.compile(r'\)[ \t]+([^\s(]\S*)')
+
+
+def _parse_plane_tokens(tokens):
+    """
+    Converts the whitespace-split tokens of one brush plane line into a
+    (coords, texture_name, uv, axes) tuple: the nine plane point coordinates, the lowercase
+    texture name, (xoff, yoff, rotation, sx, sy) and the six Valve220 u/v axis components
+    (None for the standard format).
+    Returns None if the tokens are not a plane definition.
+    """
+    if len(tokens) < 16 or tokens[4] != ')' or tokens[9] != ')' or tokens[14] != ')':
+        return None
+    try:
+        coords = list(map(float, _PLANE_POINT_TOKENS(tokens)))
+        if len(tokens) >= 31 and tokens[16] == '[' and tokens[21] == ']' and tokens[22] == '[':
+            # Valve220: explicit texture axes with their offsets
+            ux, uy, uz, xoff, vx, vy, vz, yoff, rotation, sx, sy = map(float, _VALVE220_AXIS_TOKENS(tokens))
+            axes = (ux, uy, uz, vx, vy, vz)
+        else:
+            # Standard: xoff yoff rotation scaleX scaleY (missing values keep Quake's defaults)
+            xoff, yoff, rotation, sx, sy = map(float, (tokens[16:21] + ['0', '0', '0', '1', '1'][len(tokens) - 16:])[:5])
+            axes = None
+    except ValueError:
+        return None
+    texture_name = tokens[_PLANE_TEXTURE_TOKEN].strip('"').lower() # Get texture name and convert to lowercase
+    return coords, texture_name, (xoff, yoff, rotation, sx, sy), axes
+
+
+def _bulk_floats(row_texts, values_per_row, table=None):
+    """
+    Converts whitespace-separated rows of numbers in one C-level pass (np.loadtxt, which
+    rejects rows whose value count differs from the first row's).
+    table is an optional str.translate table applied to the rows first.
+    Returns a (rows, values_per_row) float64 array, or None if any row does not hold exactly
+    values_per_row numbers (the caller then falls back to per-line parsing).
+    """
+    rows = len(row_texts)
+    if not rows:
+        return np.empty((0, values_per_row))
+    if table is not None:
+        row_texts = '\n'.join(row_texts).translate(table).split('\n')
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning) # Rows without any numbers only warn
+            values = np.loadtxt(row_texts, comments=None, ndmin=2)
+    except ValueError:
+        return None
+    if values.shape != (rows, values_per_row): # Blank rows are skipped rather than rejected
+        return None
+    return values
+
+
+def _convert_plane_lines(plane_lines):
+    """
+    Converts a batch of raw plane lines into face arrays.
+    The texture names are split out of the whole batch with one regular expression, which
+    leaves a row of numbers per line; all numbers are then converted in bulk, with every
+    row's value count checked, and texture names are normalised once per distinct name.
+    If the bulk pass does not line up (malformed or unusual lines, trailing comments) the
+    batch is re-parsed line by line.
+    Returns (points (n, 9), texture names, texture_rows (n,) indices into the texture names,
+    uv (n, 5), axes (n, 6), has_axes (n,), valid (n,)).
+    """
+    row_count = len(plane_lines)
+    # [points, name, suffix + next line's points, name, ..., last suffix]
+    pieces = _PLANE_TEXTURE_RE.split('\n'.join(plane_lines))
+    raw_names = pieces[1::2]
+    numbers = ' '.join(pieces[0::2]) if len(raw_names) == row_count else ''
+    number_rows = numbers.split('\n') if numbers else []
+
+    axes = np.zeros((row_count, 6))
+    has_axes = np.zeros(row_count, dtype=bool)
+    values = None
+    valve220_rows = [row for row, number_row in enumerate(number_rows) if '[' in number_row] if '[' in numbers else []
+    if number_rows and not valve220_rows:
+        # Common case: every face uses the standard suffix (9 point coordinates, then 5 values)
+        values = _bulk_floats(number_rows, 14, _BRACKETS_TO_SPACES)
+    elif number_rows:
+        valve220_values = _bulk_floats([number_rows[row] for row in valve220_rows], 20, _BRACKETS_TO_SPACES)
+        standard_rows = np.setdiff1d(np.arange(row_count), valve220_rows)
+        standard_values = _bulk_floats([number_rows[row] for row in standard_rows], 14, _BRACKETS_TO_SPACES)
+        if valve220_values is not None and standard_values is not None:
+            values = np.empty((row_count, 14))
+            values[standard_rows] = standard_values
+            # points, [ ux uy uz xoff ] [ vx vy vz yoff ] rotation sx sy
+            values[valve220_rows] = valve220_values[:, [0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 17, 18, 19]]
+            axes[valve220_rows] = valve220_values[:, [9, 10, 11, 13, 14, 15]]
+            has_axes[valve220_rows] = True
+
+    valid = np.ones(row_count, dtype=bool)
+    if values is not None and all(raw_name.strip('"') for raw_name in set(raw_names)):
+        points, uv = values[:, :9], values[:, 9:]
+    else:
+        # Something did not line up: parse this batch line by line
+        points, uv, raw_names = np.zeros((row_count, 9)), np.zeros((row_count, 5)), [''] * row_count
+        for row, line in enumerate(plane_lines):
+            parsed = _parse_plane_tokens(_PLANE_BRACKET_RE.sub(r' \1 ', line.split('//', 1)[0]).split())
+            valid[row] = parsed is not None
+            if parsed is not None:
+                points[row], raw_names[row], uv[row], row_axes = parsed
+                if row_axes is not None:
+                    axes[row], has_axes[row] = row_axes, True
+
+    # Number the distinct raw names in first-use order, then normalise each one once
+    name_rows = dict.fromkeys(raw_names)
+    for name_row, raw_name in enumerate(name_rows):
+        name_rows[raw_name] = name_row
+    texture_rows = np.fromiter(map(name_rows.__getitem__, raw_names), dtype=np.int32, count=row_count)
+    textures = [raw_name.strip('"').lower() for raw_name in name_rows] # Lowercase texture names
+    return points, textures, texture_rows, uv, axes, has_axes, valid
+
+
+class MapGeometry:
+    """
+    Compact, array-backed brush storage for one parsed map.
+    Faces are rows of parallel NumPy arrays instead of per-plane dicts, which keeps a large
+    map to a few dozen bytes per face and lets coordinate transforms run on whole arrays:
+      points         float64 (N, 9)  the three plane points (x1 y1 z1 x2 y2 z2 x3 y3 z3)
+      texture_index  int32 (N,)      index into the interned `textures` table
+      uv             float64 (N, 5)  xoff, yoff, rotation, scaleX, scaleY
+      axes           float64 (N, 6)  Valve220 u and v texture axes (zero for standard faces;
+                                     a shared read-only zero row when the map has no Valve220 faces)
+      has_axes       bool (N,)       True for faces that carry Valve220 axes
+      brush_offsets  int64 (B + 1,)  faces of brush b are rows brush_offsets[b]:brush_offsets[b + 1]
+      brush_entity   int32 (B,)      index into `entities` of the entity owning each brush
+    entities is the list of MapEntity objects in file order (worldspawn first in a regular map).
+    """
+    def __init__(self, points, texture_index, textures, uv, axes, has_axes, brush_offsets, brush_entity=None, entities=None):
+        self.points = points
+        self.texture_index = texture_index
+        self.textures = textures
+        self.uv = uv
+        self.axes = axes
+        self.has_axes = has_axes
+        self.brush_offsets = brush_offsets
+        self.brush_entity = brush_entity if brush_entity is not None else np.zeros(len(brush_offsets) - 1, dtype=np.int32)
+        self.entities = entities if entities is not None else []
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros((0, 9)), np.zeros(0, dtype=np.int32), [], np.zeros((0, 5)),
+                   np.zeros((0, 6)), np.zeros(0, dtype=bool), np.zeros(1, dtype=np.int64))
+
+    def subset(self, face_rows, brush_sizes, brush_entity, texture_index=None, textures=None):
+        """
+        A MapGeometry built from the faces face_rows of this one, grouped into consecutive
+        brushes of brush_sizes faces owned by brush_entity. texture_index and textures, if
+        given, replace the texture columns of the selected faces; entities are shared.
+        """
+        axes = self.axes[face_rows] if self.axes.strides[0] else np.broadcast_to(self.axes[:1], (len(face_rows), 6))
+        brush_offsets = np.concatenate(([0], np.cumsum(brush_sizes))).astype(np.int64)
+        return MapGeometry(self.points[face_rows], self.texture_index[face_rows] if texture_index is None else texture_index,
+                           self.textures if textures is None else textures, self.uv[face_rows], axes, self.has_axes[face_rows],
+                           brush_offsets, np.asarray(brush_entity, dtype=np.int32), self.entities)
+
+    @property
+    def world_entity_index(self):
+        """Index of the worldspawn entity (the first entity if the map has none)."""
+        for entity_index, entity in enumerate(self.entities):
+            if entity.quake_classname == 'worldspawn':
+                return entity_index
+        return 0
+
+    def entity_brushes(self, entity_index):
+        """Indices of the brushes owned by an entity, in file order."""
+        return np.flatnonzero(self.brush_entity == entity_index)
+
+    def __len__(self):
+        """Number of brushes."""
+        return len(self.brush_offsets) - 1
+
+    @property
+    def face_count(self):
+        return len(self.points)
+
+    @property
+    def face_textures(self):
+        """Texture name of every face, in face order."""
+        return [self.textures[index] for index in self.texture_index.tolist()]
+
+    def brush_faces(self, brush_index):
+        """Returns the (start, end) face rows of a brush."""
+        return int(self.brush_offsets[brush_index]), int(self.brush_offsets[brush_index + 1])
+
+    def planes(self):
+        """
+        The plane of every face as (unit normals (N, 3), distances (N,)), with the brush inside
+        on the back side (dot(normal, p) <= distance), as qbsp derives them from the three
+        points. Faces whose points are collinear get a zero normal.
+        """
+        points = self.points.reshape(-1, 3, 3)
+        normals = np.cross(points[:, 0] - points[:, 1], points[:, 2] - points[:, 1])
+        lengths = np.linalg.norm(normals, axis=1)
+        normals = np.divide(normals, lengths[:, None], out=np.zeros_like(normals), where=lengths[:, None] > 0.0)
+        return normals, np.einsum('ij,ij->i', normals, points[:, 1])
+
+    @property
+    def nbytes(self):
+        """Memory held by the face and brush arrays."""
+        columns = (self.points, self.texture_index, self.uv, self.axes, self.has_axes, self.brush_offsets, self.brush_entity)
+        return sum(column.nbytes for column in columns if column.strides[0]) # Skip broadcast (stride 0) columns
+
+
+class MapTransform:
+    """
+    Affine transform from Quake map space to output space, applied to whole face arrays at once.
+    A point p maps to linear @ p + translation, where linear combines a yaw rotation (degrees
+    about Quake's Z axis), a uniform scale and an axis convention remap, and translation is
+    the origin offset in output units.
+      'y-up': (x, y, z) -> (x, z, -y), the converter's historical Z-up to Y-up mapping
+      'z-up': (x, y, z) -> (x, y, z), for targets that keep Quake's (and Hammer's) Z-up axes
+    """
+    AXIS_CONVENTIONS = {
+        'y-up': ((1.0, 0.0, 0.0), (0.0, 0.0, 1.0), (0.0, -1.0, 0.0)),
+        'z-up': ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0)),
+    }
+
+    def __init__(self, scale=0.75, axis_convention='y-up', origin_offset=(0.0, 0.0, 0.0), yaw=0.0):
+        if axis_convention not in self.AXIS_CONVENTIONS:
+            raise ValueError(f"Unknown axis convention '{axis_convention}'. Expected one of: {', '.join(self.AXIS_CONVENTIONS)}.")
+        self.scale = float(scale)
+        self.axis_convention = axis_convention
+        self.origin_offset = tuple(float(c) for c in origin_offset)
+        self.yaw = float(yaw)
+
+        yaw_radians = np.radians(self.yaw)
+        rotation = np.array([[np.cos(yaw_radians), -np.sin(yaw_radians), 0.0],
+                             [np.sin(yaw_radians), np.cos(yaw_radians), 0.0],
+                             [0.0, 0.0, 1.0]])
+        self.linear = np.array(self.AXIS_CONVENTIONS[axis_convention]) @ (self.scale * rotation)
+        self.translation = np.array(self.origin_offset)
+
+    def __repr__(self):
+        return (f"MapTransform(scale={self.scale}, axis_convention='{self.axis_convention}', "
+                f"origin_offset={self.origin_offset}, yaw={self.yaw})")
+
+    def apply_points(self, points):
+        """Transforms an (..., 3k) array of packed xyz points (e.g. MapGeometry.points) in one operation."""
+        points = np.asarray(points, dtype=np.float64)
+        transformed = points.reshape(-1, 3) @ self.linear.T + self.translation
+        return transformed.reshape(points.shape) + 0.0 # + 0.0 folds -0.0 into 0.0
+
+    def apply_texture_axes(self, axes, scales, offsets):
+        """
+        Carries Quake texture projections into output space.
+        Texture coordinates are u = dot(p, axis) / scale + offset in map space; for the transformed
+        point p' the same u is produced by the returned (unit axes (N, 3), scales (N,), offsets (N,)),
+        i.e. the axis follows the inverse transpose of the linear part and the offset absorbs the
+        translation.
+        """
+        axes = np.asarray(axes, dtype=np.float64).reshape(-1, 3)
+        scales = np.asarray(scales, dtype=np.float64)
+        offsets = np.asarray(offsets, dtype=np.float64)
+        gradients = (axes @ np.linalg.inv(self.linear)) / scales[:, None] # d(u)/d(p') for every face
+        lengths = np.linalg.norm(gradients, axis=1)
+        lengths[lengths == 0.0] = 1.0 # Degenerate axes stay zero instead of dividing by zero
+        return gradients / lengths[:, None] + 0.0, 1.0 / lengths, offsets - gradients @ self.translation + 0.0
+
+
+# The converter's historical output space: Z-up -> Y-up and 0.75 scale for the final Alyx map size
+DEFAULT_MAP_TRANSFORM = MapTransform()
+
+
+# Quake's texture projection planes (TextureAxisFromPlane in qbsp): for each of the six
+# axis-aligned directions, the normal a face is tested against and the u and v axes it gets
+QUAKE_TEXTURE_BASE_AXES = np.array([
+    ((0, 0, 1), (1, 0, 0), (0, -1, 0)),  # floor
+    ((0, 0, -1), (1, 0, 0), (0, -1, 0)), # ceiling
+    ((1, 0, 0), (0, 1, 0), (0, 0, -1)),  # west wall
+    ((-1, 0, 0), (0, 1, 0), (0, 0, -1)), # east wall
+    ((0, 1, 0), (1, 0, 0), (0, 0, -1)),  # south wall
+    ((0, -1, 0), (1, 0, 0), (0, 0, -1)), # north wall
+], dtype=np.float64)
+
+
+def quake_texture_axes(points, uv):
+    """
+    Solves the texture axes of standard-format Quake faces for a whole batch at once, the way
+    qbsp does per face: the face normal picks the closest QUAKE_TEXTURE_BASE_AXES plane, whose
+    u and v axes are then turned by the face's rotation within the plane of the two
+    components they use. points is (N, 9) plane points, uv is (N, 5) (xoff, yoff, rotation,
+    sx, sy). Returns unit u and v axes in map space as an (N, 6) array, so that the texel
+    coordinates are u = dot(p, u axis) / sx + xoff, as in the Valve220 format.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3, 3)
+    normals = np.cross(points[:, 0] - points[:, 1], points[:, 2] - points[:, 1])
+    # argmax keeps the first of equally close planes, like qbsp's strict comparison
+    base_axes = QUAKE_TEXTURE_BASE_AXES[np.argmax(normals @ QUAKE_TEXTURE_BASE_AXES[:, 0].T, axis=1)]
+
+    rotation = np.asarray(uv, dtype=np.float64)[:, 2]
+    radians = np.radians(rotation)
+    sin, cos = np.sin(radians), np.cos(radians)
+    # Right angles are exact in qbsp; keep them free of rounding noise
+    right_angles = np.mod(rotation, 90.0) == 0.0
+    quadrants = (np.mod(rotation[right_angles], 360.0) // 90.0).astype(np.intp)
+    sin[right_angles] = np.array([0.0, 1.0, 0.0, -1.0])[quadrants]
+    cos[right_angles] = np.array([1.0, 0.0, -1.0, 0.0])[quadrants]
+
+    rows = np.arange(len(points))
+    s_components = np.argmax(base_axes[:, 1] != 0.0, axis=1) # First non-zero component of the u axis
+    t_components = np.argmax(base_axes[:, 2] != 0.0, axis=1) # ... and of the v axis
+    axes = np.empty((len(points), 6))
+    for column, base_axis in ((0, base_axes[:, 1]), (3, base_axes[:, 2])):
+        s_values, t_values = base_axis[rows, s_components], base_axis[rows, t_components]
+        rotated = base_axis.copy()
+        rotated[rows, s_components] = cos * s_values - sin * t_values
+        rotated[rows, t_components] = sin * s_values + cos * t_values
+        axes[:, column:column + 3] = rotated
+    return axes
+
+
+# Quake classname -> Source classname. Classes that are not listed keep their Quake name (and
+# show up as unknown entities in Hammer) so that nothing in the map is dropped silently.
+ENTITY_CLASSNAMES = {
+    # Player spawns and markers
+    'info_player_start': 'info_player_start',
+    'info_player_deathmatch': 'info_player_deathmatch',
+    'info_player_coop': 'info_player_deathmatch',
+    'info_player_start2': 'info_player_deathmatch',
+    'info_teleport_destination': 'info_teleport_destination',
+    'info_intermission': 'info_target',
+    'info_null': 'info_null',
+    'info_notnull': 'info_target',
+    'path_corner': 'path_corner',
+    # Lights
+    'light': 'light',
+    'light_fluoro': 'light',
+    'light_fluorospark': 'light',
+    'light_globe': 'light',
+    'light_torch_small_walltorch': 'light',
+    'light_flame_large_yellow': 'light',
+    'light_flame_small_yellow': 'light',
+    'light_flame_small_white': 'light',
+    # Brush entities
+    'func_door': 'func_door',
+    'func_door_secret': 'func_door',
+    'func_plat': 'func_door',
+    'func_button': 'func_button',
+    'func_train': 'func_tracktrain',
+    'func_wall': 'func_brush',
+    'func_episodegate': 'func_brush',
+    'func_bossgate': 'func_brush',
+    'func_illusionary': 'func_illusionary',
+    'trigger_once': 'trigger_once',
+    'trigger_multiple': 'trigger_multiple',
+    'trigger_secret': 'trigger_once',
+    'trigger_onlyregistered': 'trigger_once',
+    'trigger_setskill': 'trigger_once',
+    'trigger_teleport': 'trigger_teleport',
+    'trigger_changelevel': 'trigger_changelevel',
+    'trigger_hurt': 'trigger_hurt',
+    'trigger_push': 'trigger_push',
+    'trigger_monsterjump': 'trigger_push',
+    # Point logic
+    'trigger_relay': 'logic_relay',
+    'trigger_counter': 'math_counter',
+    # Sounds
+    'ambient_comp_hum': 'ambient_generic',
+    'ambient_drip': 'ambient_generic',
+    'ambient_drone': 'ambient_generic',
+    'ambient_flouro_buzz': 'ambient_generic',
+    'ambient_light_buzz': 'ambient_generic',
+    'ambient_suck_wind': 'ambient_generic',
+    'ambient_swamp1': 'ambient_generic',
+    'ambient_swamp2': 'ambient_generic',
+    'ambient_thunder': 'ambient_generic',
+}
+
+
+def _convert_angle_key(value):
+    """Quake "angle" (yaw in degrees; -1 is up, -2 is down) -> Source "angles" (pitch yaw roll)."""
+    try:
+        yaw = float(value)
+    except ValueError:
+        return 'angles', "0 0 0"
+    if yaw == -1:
+        return 'angles', "-90 0 0"
+    if yaw == -2:
+        return 'angles', "90 0 0"
+    return 'angles', f"0 {yaw:g} 0"
+
+
+def _convert_light_key(value):
+    """Quake "light" (brightness) -> Source "_light" (r g b brightness)."""
+    try:
+        brightness = float(value)
+    except ValueError:
+        brightness = 300.0 # Quake's default
+    return '_light', f"255 255 255 {brightness:g}"
+
+
+# Quake key -> function(value) returning the (Source key, Source value) it becomes.
+# Keys in ENTITY_DROPPED_KEYS are removed and every other key is copied unchanged.
+ENTITY_KEY_CONVERTERS = {
+    'angle': _convert_angle_key,
+    'light': _convert_light_key,
+}
+ENTITY_DROPPED_KEYS = {'classname', 'wad'}
+# Source classname -> {converted key: key that class reads instead}, e.g. doors move along
+# "movedir" where Quake reused "angle"
+ENTITY_CLASS_KEY_RENAMES = {
+    'func_door': {'angles': 'movedir'},
+    'func_button': {'angles': 'movedir'},
+    'trigger_push': {'angles': 'pushdir'},
+}
+# Keys holding "pitch yaw roll" directions, turned with the map transform's rotation and axis remap
+ENTITY_DIRECTION_KEYS = ('angles', 'movedir', 'pushdir')
+
+
+def map_entity_keyvalues(keyvalues):
+    """
+    Maps the key-values of a Quake entity to Source with the ENTITY_CLASSNAMES,
+    ENTITY_KEY_CONVERTERS and ENTITY_CLASS_KEY_RENAMES tables.
+    Returns (Source classname, Source key-values). Positional keys ('origin' and the
+    ENTITY_DIRECTION_KEYS) stay in Quake space; the map transform is applied when the VMF
+    is written.
+    """
+    quake_classname = keyvalues.get('classname', '')
+    classname = ENTITY_CLASSNAMES.get(quake_classname, quake_classname)
+    key_renames = ENTITY_CLASS_KEY_RENAMES.get(classname, {})
+    source_keyvalues = {}
+    for key, value in keyvalues.items():
+        if key in ENTITY_DROPPED_KEYS:
+            continue
+        converter = ENTITY_KEY_CONVERTERS.get(key)
+        if converter is not None:
+            key, value = converter(value)
+        source_keyvalues[key_renames.get(key, key)] = value
+    return classname, source_keyvalues
+
+
+class MapEntity:
+    """
+    One entity of a parsed map: its Quake key-values in file order and the Source classname
+    and key-values they map to (see map_entity_keyvalues). The brushes an entity owns are
+    recorded in MapGeometry.brush_entity.
+    """
+    def __init__(self, keyvalues):
+        self.keyvalues = keyvalues
+        self.classname, self.source_keyvalues = map_entity_keyvalues(keyvalues)
+
+    @property
+    def quake_classname(self):
+        return self.keyvalues.get('classname', '')
+
+    def __repr__(self):
+        return f"MapEntity({self.quake_classname!r} -> {self.classname!r})"
+
+
+# Entity key-value line: "key" "value"
+_KEYVALUE_RE = re.compile(r'"([^"]*)"\s+"([^"]*)"')
+
+# Plane lines are converted in batches of this many, so the raw text never accumulates for a whole map
+_PLANE_BATCH_SIZE = 1024
+
+
+class _MapGeometryBuilder:
+    """
+    Accumulates converted plane batches in growable typed buffers (array.array / bytearray)
+    and interns texture names as they arrive, so building a MapGeometry holds little more
+    than the final arrays plus one batch of raw text.
+    """
+    def __init__(self):
+        self.points = array.array('d')
+        self.uv = array.array('d')
+        self.axes = array.array('d') # Only filled once a Valve220 face shows up
+        self.has_axes = bytearray()
+        self.valid = bytearray()
+        self.texture_index = array.array('i')
+        self.texture_table = {} # texture name -> index, in order of first use
+        self.face_count = 0
+
+    def add_plane_lines(self, plane_lines):
+        points, textures, texture_rows, uv, axes, has_axes, valid = _convert_plane_lines(plane_lines)
+        self.points.frombytes(points.tobytes())
+        self.uv.frombytes(uv.tobytes())
+        if has_axes.any() or self.axes:
+            self.axes.extend([0.0] * (self.face_count * 6 - len(self.axes))) # Zero rows for earlier standard faces
+            self.axes.frombytes(axes.tobytes())
+        self.has_axes += has_axes.tobytes()
+        self.valid += valid.tobytes()
+        texture_table = self.texture_table
+        batch_index = np.array([texture_table.setdefault(texture_name, len(texture_table)) for texture_name in textures], dtype=np.int32)
+        self.texture_index.frombytes(batch_index[texture_rows].tobytes())
+        self.face_count += len(plane_lines)
+
+    def build(self, brush_ranges, brush_entities=None, entities=None):
+        """
+        Wraps the buffers as NumPy arrays (without copying) and returns
+        (MapGeometry, number of malformed planes dropped).
+        brush_entities gives the index into entities (a list of MapEntity) of each brush range.
+        Malformed planes, and brushes left without any planes, are dropped.
+        """
+        face_count = self.face_count
+        points = np.frombuffer(self.points, dtype=np.float64).reshape(face_count, 9)
+        uv = np.frombuffer(self.uv, dtype=np.float64).reshape(face_count, 5)
+        has_axes = np.frombuffer(self.has_axes, dtype=bool)
+        if self.axes:
+            axes = np.frombuffer(self.axes, dtype=np.float64).reshape(face_count, 6)
+        else:
+            # Maps without Valve220 faces share one read-only zero row instead of storing N of them
+            axes = np.broadcast_to(np.zeros(6), (face_count, 6))
+        texture_index = np.frombuffer(self.texture_index, dtype=np.int32)
+        textures = list(self.texture_table)
+        valid = np.frombuffer(self.valid, dtype=bool)
+
+        # Re-derive the brush offsets over the faces that are kept
+        brush_ranges = np.array(brush_ranges, dtype=np.int64).reshape(-1, 2)
+        valid_before = np.concatenate(([0], np.cumsum(valid)))
+        brush_sizes = valid_before[brush_ranges[:, 1]] - valid_before[brush_ranges[:, 0]]
+        brush_ranges = brush_ranges[brush_sizes > 0]
+        brush_entity = np.array(brush_entities if brush_entities is not None else np.zeros(len(brush_sizes)), dtype=np.int32)[brush_sizes > 0]
+        brush_offsets = np.concatenate(([0], np.cumsum(brush_sizes[brush_sizes > 0]))).astype(np.int64)
+
+        # Faces inside a brush range (ranges ascend and never overlap): +1 at each start, -1 at each end
+        range_edges = np.bincount(brush_ranges.ravel(), weights=np.tile([1, -1], len(brush_ranges)), minlength=face_count + 1)
+        face_rows = np.flatnonzero((np.cumsum(range_edges[:face_count]) > 0) & valid)
+        dropped_planes = face_count - len(face_rows)
+        if dropped_planes:
+            points, uv, axes, has_axes, texture_index = (column[face_rows] for column in (points, uv, axes, has_axes, texture_index))
+            # Rebuild the texture table from the faces that are left, keeping first-use order
+            used_indices, first_use = np.unique(texture_index, return_index=True)
+            used_indices = used_indices[np.argsort(first_use)]
+            remap = np.zeros(max(len(textures), 1), dtype=np.int32)
+            remap[used_indices] = np.arange(len(used_indices), dtype=np.int32)
+            texture_index = remap[texture_index]
+            textures = [textures[index] for index in used_indices.tolist()]
+
+        return MapGeometry(points, texture_index, textures, uv, axes, has_axes, brush_offsets, brush_entity, entities), dropped_planes
+
+
+def scan_map_textures(map_filepath):
+    """
+    Cheap pre-pass over a .map file: returns the set of (lowercase) texture names on its plane
+    lines without building any geometry. Unreadable files yield an empty set.
+    """
+    textures = set()
+    try:
+        with open(map_filepath, 'r', errors='replace') as f:
+            for line in f:
+                stripped_line = line.lstrip()
+                if stripped_line.startswith('('):
+                    # With the brackets removed the texture follows the nine point coordinates
+                    tokens = stripped_line.translate(_BRACKETS_TO_SPACES).split(None, 10)
+                    if len(tokens) > 9:
+                        textures.add(tokens[9].strip('"').lower())
+    except OSError:
+        pass
+    return textures
+
+
+def scan_map_wads(map_filepath):
+    """
+    Returns the WAD file names listed in the worldspawn "wad" key of a .map file, e.g.
+    ['START.WAD', 'BASE.WAD'] for "E:\\QuakeDev\\id1\\START.WAD;E:\\QuakeDev\\id1\\BASE.WAD".
+    Only the worldspawn key-values (up to its first brush) are read.
+    """
+    try:
+        with open(map_filepath, 'r', errors='replace') as f:
+            brace_count = 0
+            for line in f:
+                stripped_line = line.strip()
+                if stripped_line.startswith('{'):
+                    brace_count += 1
+                    if brace_count == 2:
+                        break # First brush: the worldspawn keys are behind us
+                elif stripped_line.startswith('}'):
+                    break
+                elif stripped_line.lower().startswith('"wad"'):
+                    value = stripped_line[5:].strip().strip('"')
+                    return [entry.replace('\\', '/').rsplit('/', 1)[-1] for entry in value.split(';') if entry.strip()]
+    except OSError:
+        pass
+    return []
+
+
+def parse_quake_map(map_filepath):
+    """
+    Parses a Quake .map file to extract brush geometry (planes) and their original texture names.
+    The file is streamed line by line and classified by its first character: brace and
+    key-value lines cost a single comparison and plane lines are collected and converted
+    in bulk batches (see _convert_plane_lines) straight into a MapGeometry.
+    Both the standard (xoff yoff rot sx sy) and Valve220 ([ u ] [ v ] rot sx sy) face formats
+    are understood. Entity key-values are kept in the same pass, and each brush records the
+    entity that owns it (see MapEntity and MapGeometry.brush_entity). A block of key-values
+    nested inside an entity, as some generators write point entities inside worldspawn, is
+    read as a separate entity instead of an empty brush.
+    Returns (MapGeometry, list of unique texture names).
+    """
+    builder = _MapGeometryBuilder()
+    plane_lines = [] # Raw plane lines of the batch currently being collected
+    plane_count = 0 # Plane lines seen so far, across all batches
+    brush_ranges = [] # (first, end) plane line indices for each brush
+    brush_entities = [] # Index of the owning entity for each brush range
+    entity_keyvalues = [] # Key-values of every entity, in the order the entities open
+    entity_index = -1 # Entity whose block is open at depth 1
+    nested_entity_index = None # Entity read from a key-value block at depth 2, if inside one
+    nested_entity_count = 0
+    brush_start = 0
+    brace_depth = 0 # 1 inside an entity, 2 inside one of its brushes
+
+    try:
+        with open(map_filepath, 'r', errors='replace') as f:
+            print(f"  Attempting to parse map file: {map_filepath}")
+            for line in f:
+                stripped_line = line.strip()
+
+                # Skip empty lines; comments fall through to the ignored case below
+                if not stripped_line:
+                    continue
+
+                first_char = stripped_line[0]
+                if first_char == '(':
+                    if brace_depth == 2:
+                        plane_lines.append(stripped_line)
+                        plane_count += 1
+                        if len(plane_lines) == _PLANE_BATCH_SIZE:
+                            builder.add_plane_lines(plane_lines)
+                            plane_lines = []
+                elif first_char == '"':
+                    keyvalue = _KEYVALUE_RE.match(stripped_line)
+                    if keyvalue is None or brace_depth == 0:
+                        continue
+                    if brace_depth == 2 and nested_entity_index is None and plane_count == brush_start:
+                        # Key-values where a brush should be: a point entity nested in this one
+                        nested_entity_index = len(entity_keyvalues)
+                        entity_keyvalues.append({})
+                        nested_entity_count += 1
+                    if brace_depth == 1:
+                        entity_keyvalues[entity_index][keyvalue.group(1)] = keyvalue.group(2)
+                    elif nested_entity_index is not None:
+                        entity_keyvalues[nested_entity_index][keyvalue.group(1)] = keyvalue.group(2)
+                elif first_char == '{':
+                    brace_depth += 1
+                    if brace_depth == 1:
+                        entity_index = len(entity_keyvalues) # Beginning of an entity
+                        entity_keyvalues.append({})
+                    elif brace_depth == 2:
+                        brush_start = plane_count # Beginning of a brush block within an entity
+                elif first_char == '}':
+                    if brace_depth == 2 and nested_entity_index is not None:
+                        nested_entity_index = None # End of a nested point entity
+                    elif brace_depth == 2 and plane_count > brush_start:
+                        brush_ranges.append((brush_start, plane_count)) # A completed brush
+                        brush_entities.append(entity_index)
+                    brace_depth = max(0, brace_depth - 1)
+                # Anything else (comments, patch data) is ignored
+
+        # Add any remaining brush planes if the file ends abruptly without a closing brace
+        if brace_depth == 2 and nested_entity_index is None and plane_count > brush_start:
+            brush_ranges.append((brush_start, plane_count))
+            brush_entities.append(entity_index)
+        if plane_lines:
+            builder.add_plane_lines(plane_lines)
+
+        entities = [MapEntity(keyvalues) for keyvalues in entity_keyvalues]
+        geometry, skipped_planes = builder.build(brush_ranges, brush_entities, entities)
+        if skipped_planes:
+            print(f"  [WARNING] Skipped {skipped_planes} malformed plane definition(s) in {map_filepath}.")
+        if nested_entity_count:
+            print(f"  [WARNING] {nested_entity_count} entity block(s) nested inside another entity in {map_filepath}; read as separate entities.")
+        print(f"  Finished parsing {map_filepath}. Found {len(geometry)} brushes, {len(entities)} entities and {len(geometry.textures)} unique textures.")
+        return geometry, list(geometry.textures)
+    except FileNotFoundError:
+        print(f"[ERROR] Map file not found: {map_filepath}")
+        return MapGeometry.empty(), []
+    except Exception as e:
+        print(f"[ERROR] An error occurred while parsing {map_filepath}: {e}")
+        return MapGeometry.empty(), []
+
+
+# Distance within which a point counts as lying on a plane while clipping windings (qbsp's
+# ON_EPSILON); points closer than this are kept rather than split off
+WINDING_EPSILON = 0.1
+# Half-size of the initial square winding on every plane, comfortably beyond Quake's +-4096 world
+WINDING_RANGE = 65536.0
+# Faces clipped per batch (and per process pool job) by clip_brush_windings
+WINDING_FACES_PER_BATCH = 8192
+
+
+def _base_windings(normals, distances):
+    """
+    Huge square windings (F, 4, 3) on every plane, as qbsp's BaseWindingForPlane: the square is
+    aligned to the axis the normal is closest to and wound clockwise seen from the front.
+    """
+    major_axes = np.argmax(np.abs(normals), axis=1)
+    up = np.zeros_like(normals)
+    up[major_axes == 2, 0] = 1.0 # Floors and ceilings use +x as 'up'; walls use +z
+    up[major_axes != 2, 2] = 1.0
+    up -= normals * np.einsum('ij,ij->i', up, normals)[:, None]
+    up /= np.maximum(np.linalg.norm(up, axis=1), 1e-12)[:, None]
+    right = np.cross(up, normals)
+    up *= WINDING_RANGE
+    right *= WINDING_RANGE
+    origins = normals * distances[:, None]
+    return np.stack((origins - right + up, origins + right + up, origins + right - up, origins - right - up), axis=1)
+
+
+def _clip_windings(windings, counts, normals, distances, epsilon):
+    """
+    Clips every winding i (windings (F, M, 3) holding counts[i] points) against the plane
+    (normals[i], distances[i]) in one batch, keeping the back side. Points within epsilon of
+    the plane are kept as they are; edges crossing from front to back get a split point.
+    Rows with a zero normal are left unchanged. Returns the new (windings, counts).
+    """
+    face_count, max_points = windings.shape[:2]
+    point_index = np.arange(max_points)
+    valid = point_index[None, :] < counts[:, None]
+    point_distances = np.einsum('fmk,fk->fm', windings, normals) - distances[:, None]
+    point_distances[~valid] = 0.0
+    front = point_distances > epsilon
+    back = point_distances < -epsilon
+    active = np.any(normals != 0.0, axis=1)
+    front &= active[:, None]
+    back &= active[:, None]
+
+    # Each point i is followed by point i + 1 of the same winding (wrapping at its count)
+    next_index = np.where(point_index[None, :] + 1 < counts[:, None], point_index[None, :] + 1, 0)
+    rows = np.arange(face_count)[:, None]
+    next_points = windings[rows, next_index]
+    next_distances = point_distances[rows, next_index]
+    crosses = valid & ((front & back[rows, next_index]) | (back & front[rows, next_index]))
+    fraction = np.divide(point_distances, point_distances - next_distances,
+                         out=np.zeros_like(point_distances), where=crosses)
+    split_points = windings + (next_points - windings) * fraction[..., None]
+
+    # Interleave kept points and split points, then pack them to the front of every row
+    candidates = np.stack((windings, split_points), axis=2).reshape(face_count, 2 * max_points, 3)
+    keep = np.stack((valid & ~front, crosses), axis=2).reshape(face_count, 2 * max_points)
+    new_counts = keep.sum(axis=1)
+    order = np.argsort(~keep, axis=1, kind='stable')[:, :max(int(new_counts.max(initial=0)), 1)]
+    return candidates[rows, order], new_counts
+
+
+def _clip_face_windings(face_normals, face_distances, brush_normals, brush_distances, epsilon):
+    """
+    Batch kernel of clip_brush_windings: starts a base winding on every face plane and clips
+    it by each plane of its brush in turn. brush_normals (F, K, 3) and brush_distances (F, K)
+    hold, for every face, the planes of its brush (zero-normal padding clips nothing and the
+    face's own plane is skipped). Returns (windings (F, M, 3), counts (F,)).
+    """
+    windings = _base_windings(face_normals, face_distances)
+    counts = np.full(len(face_normals), 4, dtype=np.int64)
+    counts[~np.any(face_normals != 0.0, axis=1)] = 0 # Degenerate planes get no winding
+    for plane_index in range(brush_normals.shape[1]):
+        normals = brush_normals[:, plane_index]
+        # A face's own plane (or an exact duplicate of it) would only shave off rounding noise
+        same_plane = np.all(normals == face_normals, axis=1) & (brush_distances[:, plane_index] == face_distances)
+        normals = np.where(same_plane[:, None], 0.0, normals)
+        windings, counts = _clip_windings(windings, counts, normals, brush_distances[:, plane_index], epsilon)
+    return windings, counts
+
+
+class BrushWindings:
+    """
+    Convex face polygons of a map's brushes, as computed by clip_brush_windings.
+      windings       float64 (F, M, 3)  winding points of every face, padded to the largest winding
+      counts         int64 (F,)         points in each winding; below 3 for faces clipped away
+                                        entirely (redundant, outward or degenerate planes)
+      brush_offsets  int64 (B + 1,)     faces of brush b are rows brush_offsets[b]:brush_offsets[b + 1]
+      mins, maxs     float64 (B, 3)     per-brush bounds (+inf / -inf for brushes without volume)
+    Faces and brushes are in MapGeometry order, so face i here is face i there.
+    """
+    def __init__(self, windings, counts, brush_offsets):
+        self.windings = windings
+        self.counts = counts
+        self.brush_offsets = brush_offsets
+        face_valid = np.arange(windings.shape[1])[None, :] < counts[:, None]
+        face_mins = np.where(face_valid[..., None], windings, np.inf).min(axis=1, initial=np.inf)
+        face_maxs = np.where(face_valid[..., None], windings, -np.inf).max(axis=1, initial=-np.inf)
+        brush_count = len(brush_offsets) - 1
+        self.mins = np.full((brush_count, 3), np.inf)
+        self.maxs = np.full((brush_count, 3), -np.inf)
+        non_empty = brush_offsets[1:] > brush_offsets[:-1]
+        if len(face_mins) and non_empty.any():
+            starts = brush_offsets[:-1][non_empty]
+            self.mins[non_empty] = np.minimum.reduceat(face_mins, starts, axis=0)
+            self.maxs[non_empty] = np.maximum.reduceat(face_maxs, starts, axis=0)
+
+    def __len__(self):
+        """Number of brushes."""
+        return len(self.brush_offsets) - 1
+
+    def face_winding(self, face_index):
+        """The (n, 3) points of one face's winding."""
+        return self.windings[face_index, :self.counts[face_index]]
+
+    @property
+    def face_valid(self):
+        """True for faces that kept a polygon (at least 3 points)."""
+        return self.counts >= 3
+
+    @property
+    def valid_brushes(self):
+        """True for brushes that enclose a volume: at least four faces with polygons and a non-flat bounding box."""
+        face_counts = np.add.reduceat(self.face_valid.astype(np.int64), self.brush_offsets[:-1], axis=0) if len(self.counts) else np.zeros(len(self), dtype=np.int64)
+        face_counts[self.brush_offsets[1:] == self.brush_offsets[:-1]] = 0
+        return (face_counts >= 4) & np.all(self.maxs - self.mins > WINDING_EPSILON, axis=1)
+
+
+def _brush_plane_table(brush_offsets, normals, distances, face_start, face_end):
+    """
+    For faces face_start:face_end, the planes of the brush each face belongs to, padded with
+    zero normals to the largest brush of the range: ((F, K, 3) normals, (F, K) distances).
+    """
+    face_brushes = np.searchsorted(brush_offsets, np.arange(face_start, face_end), side='right') - 1
+    brush_starts = brush_offsets[face_brushes]
+    brush_sizes = brush_offsets[face_brushes + 1] - brush_starts
+    max_planes = int(brush_sizes.max(initial=0))
+    plane_rows = brush_starts[:, None] + np.arange(max_planes)[None, :]
+    padding = np.arange(max_planes)[None, :] >= brush_sizes[:, None]
+    plane_rows[padding] = 0
+    brush_normals = normals[plane_rows]
+    brush_normals[padding] = 0.0
+    brush_distances = np.where(padding, 0.0, distances[plane_rows])
+    return brush_normals, brush_distances
+
+
+def clip_brush_windings(map_data, epsilon=WINDING_EPSILON, workers=1):
+    """
+    Turns every brush of map_data (a MapGeometry) into convex face polygons by half-space
+    clipping: each face starts as a huge square on its plane and is clipped by every other
+    plane of its brush. All faces of a batch are clipped against their brushes' k-th plane
+    in one NumPy pass, so a whole map takes a couple of dozen vectorised passes per batch.
+    epsilon is the on-plane tolerance (see WINDING_EPSILON). Batches of
+    WINDING_FACES_PER_BATCH faces (split at brush boundaries) run on a process pool when
+    workers > 1. Returns a BrushWindings with the windings and per-brush bounds.
+    """
+    normals, distances = map_data.planes()
+    brush_offsets = map_data.brush_offsets
+    # Batch boundaries fall on brush boundaries so every batch holds whole brushes
+    batch_bounds = [0]
+    for offset in brush_offsets.tolist()[1:]:
+        if offset - batch_bounds[-1] >= WINDING_FACES_PER_BATCH:
+            batch_bounds.append(offset)
+    if batch_bounds[-1] != map_data.face_count:
+        batch_bounds.append(map_data.face_count)
+    jobs = [(normals[start:end], distances[start:end]) + _brush_plane_table(brush_offsets, normals, distances, start, end) + (epsilon,)
+            for start, end in zip(batch_bounds[:-1], batch_bounds[1:])]
+
+    if workers > 1 and len(jobs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            results = list(executor.map(_clip_face_windings, *zip(*jobs)))
+    else:
+        results = [_clip_face_windings(*job) for job in jobs]
+
+    max_points = max([windings.shape[1] for windings, _ in results] + [1])
+    windings = np.zeros((map_data.face_count, max_points, 3))
+    counts = np.zeros(map_data.face_count, dtype=np.int64)
+    for start, (batch_windings, batch_counts) in zip(batch_bounds, results):
+        windings[start:start + len(batch_counts), :batch_windings.shape[1]] = batch_windings
+        counts[start:start + len(batch_counts)] = batch_counts
+    return BrushWindings(windings, counts, brush_offsets)
+
+
+def _expand_ranges(starts, counts):
+    """
+    Concatenates the index ranges starts[i]:starts[i] + counts[i] in one operation.
+    Returns (owner i of every index, the indices).
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    owners = np.repeat(np.arange(len(counts)), counts)
+    positions = np.arange(len(owners)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owners, np.asarray(starts, dtype=np.int64)[owners] + positions
+
+
+class BrushGrid:
+    """
+    Uniform grid over the bounding boxes of a map's brushes (e.g. BrushWindings.mins/maxs),
+    built once per map so that spatial queries are binary searches over the cells instead of
+    tests of every brush against every other. Every brush is listed in each cell its box
+    overlaps; the cells are kept as a sorted table of linear cell ids with the brushes of each
+    in one array (a CSR layout). Brushes without volume (infinite bounds) are left out.
+    cell_size defaults to the median brush extent, so a typical brush spans a few cells.
+    All queries take whole batches and return (query index, brush index) pairs sorted by
+    query, then brush.
+    """
+    def __init__(self, mins, maxs, cell_size=None):
+        self.mins = np.asarray(mins, dtype=np.float64).reshape(-1, 3)
+        self.maxs = np.asarray(maxs, dtype=np.float64).reshape(-1, 3)
+        brushes = np.flatnonzero(np.all(np.isfinite(self.mins) & np.isfinite(self.maxs), axis=1))
+        if cell_size is None:
+            extents = (self.maxs[brushes] - self.mins[brushes]).max(axis=1)
+            cell_size = max(float(np.median(extents)) if len(extents) else 1.0, 1.0)
+        self.cell_size = float(cell_size)
+        self.origin = self.mins[brushes].min(axis=0) if len(brushes) else np.zeros(3)
+        self.shape = np.ones(3, dtype=np.int64)
+        if len(brushes):
+            self.shape = np.floor((self.maxs[brushes].max(axis=0) - self.origin) / self.cell_size).astype(np.int64) + 1
+
+        owners, cells = self._box_cells(self.mins[brushes], self.maxs[brushes])
+        cell_brushes = brushes[owners]
+        order = np.lexsort((cell_brushes, cells))
+        self.cell_ids, cell_starts = np.unique(cells[order], return_index=True)
+        self.cell_starts = np.append(cell_starts, len(order)).astype(np.int64)
+        self.cell_brushes = cell_brushes[order]
+
+    def __len__(self):
+        """Number of brushes the grid was built from."""
+        return len(self.mins)
+
+    def _box_cells(self, mins, maxs):
+        """Every grid cell overlapped by each box, as (box index, linear cell id) pairs; parts outside the grid are dropped."""
+        low = np.maximum(np.floor((mins - self.origin) / self.cell_size), 0)
+        high = np.minimum(np.floor((maxs - self.origin) / self.cell_size), self.shape - 1)
+        low, high = low.astype(np.int64), high.astype(np.int64)
+        dims = np.maximum(high - low + 1, 0)
+        owners, positions = _expand_ranges(np.zeros(len(dims), dtype=np.int64), dims.prod(axis=1))
+        # Unravel each box-local position into x, y, z steps from the box's low cell
+        x = low[owners, 0] + positions % dims[owners, 0]
+        y = low[owners, 1] + positions // dims[owners, 0] % dims[owners, 1]
+        z = low[owners, 2] + positions // (dims[owners, 0] * dims[owners, 1])
+        return owners, x + self.shape[0] * (y + self.shape[1] * z)
+
+    def query_boxes(self, mins, maxs, epsilon=0.0):
+        """
+        The brushes whose bounding box overlaps (or lies within epsilon of) each query box.
+        mins and maxs are (N, 3). Returns (box indices, brush indices) of the overlapping pairs.
+        """
+        mins = np.asarray(mins, dtype=np.float64).reshape(-1, 3)
+        maxs = np.asarray(maxs, dtype=np.float64).reshape(-1, 3)
+        owners, cells = self._box_cells(mins - epsilon, maxs + epsilon)
+        cell_positions = np.minimum(np.searchsorted(self.cell_ids, cells), max(len(self.cell_ids) - 1, 0))
+        found = self.cell_ids[cell_positions] == cells if len(self.cell_ids) else np.zeros(len(cells), dtype=bool)
+        owners, cell_positions = owners[found], cell_positions[found]
+        starts = self.cell_starts[cell_positions]
+        candidate_owners, rows = _expand_ranges(starts, self.cell_starts[cell_positions + 1] - starts)
+        boxes, brushes = owners[candidate_owners], self.cell_brushes[rows]
+
+        overlapping = np.all((self.mins[brushes] <= maxs[boxes] + epsilon) & (self.maxs[brushes] >= mins[boxes] - epsilon), axis=1)
+        # A pair found through several shared cells is reported once
+        pair_keys = np.unique(boxes[overlapping] * len(self) + brushes[overlapping])
+        return pair_keys // max(len(self), 1), pair_keys % max(len(self), 1)
+
+    def query_points(self, points, epsilon=0.0):
+        """The brushes whose bounding box contains (within epsilon) each of the (N, 3) points, as (point indices, brush indices)."""
+        return self.query_boxes(points, points, epsilon)
+
+    def touching_pairs(self, epsilon=WINDING_EPSILON):
+        """Pairs (i, j), i < j, of brushes whose bounding boxes overlap or touch within epsilon, as two index arrays."""
+        brushes = np.flatnonzero(np.all(np.isfinite(self.mins) & np.isfinite(self.maxs), axis=1))
+        query, others = self.query_boxes(self.mins[brushes], self.maxs[brushes], epsilon)
+        first = brushes[query]
+        keep = first < others
+        return first[keep], others[keep]
+
+
+def brushes_containing_points(map_data, grid, points, brush_mask=None, epsilon=WINDING_EPSILON):
+    """
+    Exact point-in-brush test for a batch of points (N, 3) in map space: the (point indices,
+    brush indices) pairs where the point lies inside a brush of map_data, at least epsilon
+    behind every one of its planes (so points resting on a surface do not count). Candidates
+    come from grid (a BrushGrid over the same map); brush_mask, a boolean array over the
+    brushes, restricts the brushes considered.
+    """
+    point_indices, brushes = grid.query_points(points)
+    if brush_mask is not None:
+        keep = brush_mask[brushes]
+        point_indices, brushes = point_indices[keep], brushes[keep]
+    if not len(brushes):
+        return point_indices, brushes
+    normals, distances = map_data.planes()
+    starts = map_data.brush_offsets[brushes]
+    pair_owners, rows = _expand_ranges(starts, map_data.brush_offsets[brushes + 1] - starts)
+    behind = np.einsum('ij,ij->i', normals[rows], np.asarray(points, dtype=np.float64)[point_indices[pair_owners]]) < distances[rows] - epsilon
+    # Every candidate brush has faces (it has finite bounds), so each pair owns a non-empty run of rows
+    inside = np.logical_and.reduceat(behind, np.cumsum(map_data.brush_offsets[brushes + 1] - starts) - (map_data.brush_offsets[brushes + 1] - starts))
+    return point_indices[inside], brushes[inside]
+
+
+def entity_origins(map_data):
+    """
+    The map-space origins of map_data's point entities (those owning no brushes and carrying a
+    valid "origin" key), as (entity indices, (N, 3) origins).
+    """
+    brush_owners = set(np.unique(map_data.brush_entity).tolist())
+    entity_indices, origins = [], []
+    for entity_index, entity in enumerate(map_data.entities):
+        if entity_index in brush_owners:
+            continue
+        try:
+            origin = [float(c) for c in entity.keyvalues.get('origin', '').split()]
+        except ValueError:
+            continue
+        if len(origin) == 3:
+            entity_indices.append(entity_index)
+            origins.append(origin)
+    return np.array(entity_indices, dtype=np.int64), np.array(origins, dtype=np.float64).reshape(-1, 3)
+
+
+# Quake classname prefixes of entities that spawn as solid objects and get stuck when placed in a wall
+# (lights, path corners and the like are routinely tucked inside fixtures)
+SPAWNED_ENTITY_PREFIXES = ('info_player', 'monster_', 'item_', 'weapon_')
+
+
+def embedded_entities(map_data, grid):
+    """
+    Entity containment: indices of the point entities whose origin lies inside a solid world
+    brush (see brushes_containing_points). Liquid brushes (textured "*...") are not solid.
+    """
+    entity_indices, origins = entity_origins(map_data)
+    liquid_textures = np.array([texture_name.startswith('*') for texture_name in map_data.textures], dtype=bool)
+    solid_brushes = (map_data.brush_entity == map_data.world_entity_index) & (map_data.brush_offsets[1:] > map_data.brush_offsets[:-1])
+    solid_brushes[solid_brushes] = ~liquid_textures[map_data.texture_index[map_data.brush_offsets[:-1][solid_brushes]]]
+    point_indices, _ = brushes_containing_points(map_data, grid, origins, solid_brushes)
+    return entity_indices[np.unique(point_indices)]
+
+
+def entities_in_triggers(map_data, grid):
+    """
+    Trigger-volume lookup: for every brush entity whose Quake classname starts with "trigger_",
+    the point entities whose origin lies inside one of its brushes.
+    Returns {trigger entity index: [point entity indices]} for the triggers containing any.
+    """
+    entity_indices, origins = entity_origins(map_data)
+    brush_entity = map_data.brush_entity
+    trigger_entities = [entity_index for entity_index, entity in enumerate(map_data.entities) if entity.quake_classname.startswith('trigger_')]
+    point_indices, brushes = brushes_containing_points(map_data, grid, origins, np.isin(brush_entity, trigger_entities))
+    contents = {}
+    for trigger, entity_index in sorted(set(zip(brush_entity[brushes].tolist(), entity_indices[point_indices].tolist()))):
+        contents.setdefault(trigger, []).append(entity_index)
+    return contents
+
+
+# Quake tool textures and the Source tool materials they are emitted as; faces using them are
+# never drawn (player clips, trigger volumes and the faces hidden by find_hidden_faces)
+TOOL_TEXTURE_MATERIALS = {'clip': 'TOOLS/TOOLSPLAYERCLIP', 'trigger': 'TOOLS/TOOLSTRIGGER', 'skip': 'TOOLS/TOOLSSKIP',
+                          'hint': 'TOOLS/TOOLSHINT', 'nodraw': 'TOOLS/TOOLSNODRAW'}
+# Material of Quake's sky textures ('sky1', 'sky4', ...), drawn as the skybox
+SKY_MATERIAL = 'TOOLS/TOOLSSKYBOX'
+# Texture given to faces found hidden by the optimisation pass
+NODRAW_TEXTURE = 'nodraw'
+
+
+def tool_material(texture_name):
+    """The Source tool material a Quake texture is emitted as (see TOOL_TEXTURE_MATERIALS and SKY_MATERIAL), or None for regular textures."""
+    texture_name = texture_name.lower()
+    if texture_name.startswith('sky'):
+        return SKY_MATERIAL
+    return TOOL_TEXTURE_MATERIALS.get(texture_name)
+
+
+# Identity transform, for texture projections compared in map space
+_MAP_SPACE_TRANSFORM = MapTransform(scale=1.0, axis_convention='z-up')
+
+
+def _face_projection_keys(map_data, face_rows):
+    """
+    An integer per face of face_rows that is equal exactly for faces with the same texture and
+    map-space texture projection (axes, scales and offsets), i.e. faces that texture a shared
+    plane identically.
+    """
+    u_axes, u_scales, u_offsets, v_axes, v_scales, v_offsets = _face_texture_projection(map_data, _MAP_SPACE_TRANSFORM, face_rows)
+    keys = np.column_stack([map_data.texture_index[face_rows], np.round(u_axes * 1e4), np.round(u_scales * 1e4), np.round(u_offsets * 1e2),
+                            np.round(v_axes * 1e4), np.round(v_scales * 1e4), np.round(v_offsets * 1e2)])
+    return np.unique(keys, axis=0, return_inverse=True)[1].reshape(-1) if len(face_rows) else np.zeros(0, dtype=np.int64)
+
+
+def _box_brushes(map_data, normals, distances):
+    """
+    Finds the axis-aligned box brushes of map_data: six faces whose normals are the six axis
+    directions -x, +x, -y, +y, -z, +z (direction d is axis d // 2, positive for odd d).
+    Returns (box mask (B,), face row of every direction (B, 6), mins (B, 3), maxs (B, 3));
+    rows and bounds are only meaningful where the mask is set.
+    """
+    brush_offsets = map_data.brush_offsets
+    brush_count = len(map_data)
+    six_faces = np.flatnonzero(brush_offsets[1:] - brush_offsets[:-1] == 6)
+    rows = brush_offsets[six_faces][:, None] + np.arange(6)[None, :]
+    face_normals = normals[rows]
+    axis = np.argmax(np.abs(face_normals), axis=2)
+    axial = np.take_along_axis(np.abs(face_normals), axis[..., None], axis=2)[..., 0] == 1.0
+    directions = axis * 2 + (np.take_along_axis(face_normals, axis[..., None], axis=2)[..., 0] > 0)
+    is_box = np.all(axial, axis=1) & np.all(np.sort(directions, axis=1) == np.arange(6)[None, :], axis=1)
+
+    box = np.zeros(brush_count, dtype=bool)
+    face_of_direction = np.zeros((brush_count, 6), dtype=np.int64)
+    box_brushes = six_faces[is_box]
+    box[box_brushes] = True
+    face_of_direction[box_brushes[:, None], directions[is_box]] = rows[is_box]
+    mins = np.zeros((brush_count, 3))
+    maxs = np.zeros((brush_count, 3))
+    # The -axis face has normal -e and distance -min, the +axis face normal +e and distance max
+    mins[box_brushes] = -distances[face_of_direction[box_brushes][:, 0::2]]
+    maxs[box_brushes] = distances[face_of_direction[box_brushes][:, 1::2]]
+    box &= np.all(maxs > mins, axis=1)
+    return box, face_of_direction, mins, maxs
+
+
+def merge_box_brushes(map_data, epsilon=WINDING_EPSILON):
+    """
+    Merges adjacent axis-aligned box brushes of the same entity into larger boxes, the common
+    case of a wall or floor built from many small brushes. Two boxes merge when they meet
+    face to face over the whole face (equal extents on the other two axes) and their four side
+    faces carry the same textures with the same alignment, so the merged box renders exactly
+    as the pair did; the faces between them disappear. Candidates come from the touching pairs
+    of a BrushGrid, and passes repeat until nothing merges.
+    Returns (merged MapGeometry, number of brushes merged away).
+    """
+    normals, distances = map_data.planes()
+    box, face_of_direction, mins, maxs = _box_brushes(map_data, normals, distances)
+    face_keys = _face_projection_keys(map_data, np.arange(map_data.face_count))
+    original_face_of_direction = face_of_direction.copy()
+    alive = np.ones(len(map_data), dtype=bool)
+    merged_count = 0
+
+    merged_any = True
+    while merged_any:
+        merged_any = False
+        candidates = box & alive
+        grid = BrushGrid(np.where(candidates[:, None], mins, np.inf), np.where(candidates[:, None], maxs, -np.inf))
+        first, second = grid.touching_pairs(epsilon)
+        same_entity = map_data.brush_entity[first] == map_data.brush_entity[second]
+        first, second = first[same_entity], second[same_entity]
+        # Every pair is tested along all three axes at once; the merges are then picked greedily
+        merges = []
+        for axis in range(3):
+            sides = [direction for direction in range(6) if direction // 2 != axis]
+            side_axes = sorted({direction // 2 for direction in sides})
+            mergeable = (np.all(np.abs(mins[first][:, side_axes] - mins[second][:, side_axes]) <= epsilon, axis=1)
+                         & np.all(np.abs(maxs[first][:, side_axes] - maxs[second][:, side_axes]) <= epsilon, axis=1)
+                         & np.all(face_keys[face_of_direction[first][:, sides]] == face_keys[face_of_direction[second][:, sides]], axis=1))
+            first_below = mergeable & (np.abs(maxs[first, axis] - mins[second, axis]) <= epsilon)
+            second_below = mergeable & ~first_below & (np.abs(maxs[second, axis] - mins[first, axis]) <= epsilon)
+            merges.extend((low, high, axis) for low, high in zip(first[first_below].tolist(), second[first_below].tolist()))
+            merges.extend((low, high, axis) for low, high in zip(second[second_below].tolist(), first[second_below].tolist()))
+
+        used = set()
+        for low, high, axis in sorted(merges):
+            if low in used or high in used:
+                continue
+            # The lower box grows to the far end of the higher one, taking over its far face
+            face_of_direction[low, axis * 2 + 1] = face_of_direction[high, axis * 2 + 1]
+            maxs[low, axis] = maxs[high, axis]
+            alive[high] = False
+            used.update((low, high))
+            merged_count += 1
+            merged_any = True
+
+    if not merged_count:
+        return map_data, 0
+    # Merged boxes keep their original face order, with the grown direction taking the far box's row
+    row_table = np.arange(map_data.face_count)
+    merged_boxes = box & alive
+    row_table[original_face_of_direction[merged_boxes].ravel()] = face_of_direction[merged_boxes].ravel()
+    kept = np.flatnonzero(alive)
+    starts = map_data.brush_offsets[kept]
+    brush_sizes = map_data.brush_offsets[kept + 1] - starts
+    _, rows = _expand_ranges(starts, brush_sizes)
+    return map_data.subset(row_table[rows], brush_sizes, map_data.brush_entity[kept]), merged_count
+
+
+def find_hidden_faces(map_data, windings, grid, epsilon=WINDING_EPSILON):
+    """
+    Finds the faces of world brushes that can never be seen: their whole winding lies inside
+    another solid world brush, or flush against one of its faces pointing the other way.
+    Faces lying on an outer face of the other brush (coplanar and facing the same way) stay
+    visible. Only single covering brushes are considered, not unions of several, and only
+    solid brushes cover: liquids, tool brushes and entity brushes (which may move) do not.
+    windings and grid are the map's clipped windings and BrushGrid over their bounds.
+    Returns a boolean mask over the faces.
+    """
+    normals, distances = map_data.planes()
+    brush_offsets = map_data.brush_offsets
+    face_brushes = np.repeat(np.arange(len(map_data)), brush_offsets[1:] - brush_offsets[:-1])
+    world_brushes = map_data.brush_entity == map_data.world_entity_index
+    see_through_textures = np.array([texture_name.startswith('*') or (tool_material(texture_name) not in (None, SKY_MATERIAL))
+                                     for texture_name in map_data.textures], dtype=bool)
+    see_through_faces = see_through_textures[map_data.texture_index] if map_data.face_count else np.zeros(0, dtype=bool)
+    # A brush with any see-through face does not count as solid
+    see_through_brushes = np.zeros(len(map_data), dtype=bool)
+    non_empty = brush_offsets[1:] > brush_offsets[:-1]
+    if non_empty.any():
+        see_through_brushes[non_empty] = np.logical_or.reduceat(see_through_faces, brush_offsets[:-1][non_empty])
+    solid_brushes = world_brushes & windings.valid_brushes & ~see_through_brushes
+
+    candidate_faces = np.flatnonzero(world_brushes[face_brushes] & windings.face_valid & ~see_through_faces)
+    hidden = np.zeros(map_data.face_count, dtype=bool)
+    if not len(candidate_faces):
+        return hidden
+    face_windings = windings.windings[candidate_faces]
+    point_valid = np.arange(face_windings.shape[1])[None, :] < windings.counts[candidate_faces][:, None]
+    face_mins = np.where(point_valid[..., None], face_windings, np.inf).min(axis=1)
+    face_maxs = np.where(point_valid[..., None], face_windings, -np.inf).max(axis=1)
+    pair_faces, pair_brushes = grid.query_boxes(face_mins, face_maxs, epsilon)
+    keep = solid_brushes[pair_brushes] & (pair_brushes != face_brushes[candidate_faces[pair_faces]])
+    pair_faces, pair_brushes = pair_faces[keep], pair_brushes[keep]
+    if not len(pair_faces):
+        return hidden
+
+    # Every face point against every plane of the covering brush, one row per (pair, plane)
+    plane_counts = brush_offsets[pair_brushes + 1] - brush_offsets[pair_brushes]
+    row_pairs, plane_rows = _expand_ranges(brush_offsets[pair_brushes], plane_counts)
+    sides = np.einsum('rmk,rk->rm', face_windings[pair_faces[row_pairs]], normals[plane_rows]) - distances[plane_rows][:, None]
+    valid = point_valid[pair_faces[row_pairs]]
+    behind = np.all((sides <= epsilon) | ~valid, axis=1)
+    flush_same_way = np.all((np.abs(sides) <= epsilon) | ~valid, axis=1) & (np.einsum('rk,rk->r', normals[plane_rows], normals[candidate_faces[pair_faces[row_pairs]]]) > 0.0)
+    pair_starts = np.cumsum(plane_counts) - plane_counts
+    covered = np.logical_and.reduceat(behind, pair_starts) & ~np.logical_or.reduceat(flush_same_way, pair_starts)
+    hidden[candidate_faces[pair_faces[covered]]] = True
+    return hidden
+
+
+def optimize_map_geometry(map_data, windings=None, epsilon=WINDING_EPSILON):
+    """
+    Optimisation pass run before emission: merges adjacent box brushes (see merge_box_brushes),
+    then gives every face found hidden (see find_hidden_faces) the NODRAW_TEXTURE, which is
+    emitted as the Source nodraw tool material and left out of exported meshes. Hidden faces
+    keep their sides, as every plane is still needed to close its brush.
+    windings, the clipped windings of map_data, are reused when nothing merges.
+    Returns (optimised MapGeometry, its BrushWindings, brushes merged away, faces hidden).
+    """
+    merged, merged_count = merge_box_brushes(map_data, epsilon)
+    if merged_count or windings is None:
+        windings = clip_brush_windings(merged)
+    hidden = find_hidden_faces(merged, windings, BrushGrid(windings.mins, windings.maxs), epsilon)
+    if not hidden.any():
+        return merged, windings, merged_count, 0
+    textures = list(merged.textures)
+    if NODRAW_TEXTURE not in textures:
+        textures.append(NODRAW_TEXTURE)
+    texture_index = np.where(hidden, textures.index(NODRAW_TEXTURE), merged.texture_index).astype(np.int32)
+    optimized = merged.subset(np.arange(merged.face_count), merged.brush_offsets[1:] - merged.brush_offsets[:-1], merged.brush_entity, texture_index, textures)
+    return optimized, windings, merged_count, int(hidden.sum())
+
+
+class WadArchive:
+    """
+    Indexed, memory-mapped reader for a Quake 1 (WAD2) texture archive.
+    The lump directory is read once when the archive is opened and kept as a
+    name -> (offset, size, type) dict, so every texture lookup afterwards is O(1)
+    and never rescans the file. Lump data is served as memoryview slices of the
+    mapping, so reading a texture never copies more than the decoder asks for.
+    """
+    HEADER_FORMAT = '<4sII'          # magic, number of lumps, directory offset
+    LUMP_ENTRY_FORMAT = '<IIIBBH16s' # filepos, disksize, size, type, compression, padding, name
+    MIPTEX_HEADER_FORMAT = '<16sII4I' # name, width, height, four mip offsets
+    MIPTEX_LUMP_TYPE = 0x44
+    KIND = "WAD"
+
+    def __init__(self, wad_file_path, data=None):
+        """
+        Maps wad_file_path, or reads the archive from data (a memoryview, e.g. a file inside a
+        PakFile) which the archive then owns and releases on close.
+        """
+        self.path = wad_file_path
+        self.lumps = {} # lowercase lump name -> (offset, size, type)
+        if data is None:
+            with open(wad_file_path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < struct.calcsize(self.HEADER_FORMAT):
+                    raise ValueError(f"'{self.path}' is too small to be a {self.KIND} file.")
+                # The mapping stays valid after the file object is closed
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            data = memoryview(self._mmap)
+        else:
+            self._mmap = None
+        self._view = data
+        try:
+            self._read_directory()
+        except Exception:
+            self.close()
+            raise
+
+    def _read_directory(self):
+        """Parses the WAD header and the whole lump directory straight from the mapping."""
+        magic, num_lumps, directory_offset = struct.unpack_from(self.HEADER_FORMAT, self._view, 0)
+        if magic != b'WAD2':
+            raise ValueError(f"'{self.path}' is not a WAD2 file (magic: {magic}).")
+
+        entry_size = struct.calcsize(self.LUMP_ENTRY_FORMAT)
+        available_lumps = max(0, len(self._view) - directory_offset) // entry_size
+        if available_lumps < num_lumps:
+            print(f"  [WARNING] Truncated WAD directory in {self.path}.")
+            num_lumps = available_lumps
+
+        directory = self._view[directory_offset:directory_offset + num_lumps * entry_size]
+        for lump_offset, lump_disk_size, _, lump_type, _, _, lump_name_raw in \
+                struct.iter_unpack(self.LUMP_ENTRY_FORMAT, directory):
+            lump_name = lump_name_raw.split(b'\0', 1)[0].decode('ascii', errors='replace').lower()
+            # Keep the first occurrence, matching the original first-match directory scan
+            self.lumps.setdefault(lump_name, (lump_offset, lump_disk_size, lump_type))
+        directory.release()
+
+    def __contains__(self, name):
+        return name in self.lumps
+
+    def __len__(self):
+        return len(self.lumps)
+
+    def read_lump(self, name):
+        """Returns the named lump as a zero-copy memoryview into the mapped file."""
+        offset, size, _ = self.lumps[name]
+        if offset + size > len(self._view):
+            raise ValueError(f"Truncated lump '{name}' in {self.path}.")
+        return self._view[offset:offset + size]
+
+    def read_miptex(self, name):
+        """
+        Reads a miptex lump and returns (width, height, pixel_data) for its largest mip level.
+        pixel_data is a memoryview holding one palette index per pixel; it is only valid
+        while the archive is open.
+        """
+        lump_offset, _, _ = self.lumps[name]
+        if lump_offset + struct.calcsize(self.MIPTEX_HEADER_FORMAT) > len(self._view):
+            raise ValueError(f"Truncated MIPTEX header for '{name}' in {self.path}.")
+        _, tex_width, tex_height, mip_offset0, _, _, _ = \
+            struct.unpack_from(self.MIPTEX_HEADER_FORMAT, self._view, lump_offset)
+
+        # We only need the first (largest) mipmap
+        pixel_data_start = lump_offset + mip_offset0
+        pixel_data_end = pixel_data_start + tex_width * tex_height
+        if pixel_data_end > len(self._view):
+            raise ValueError(f"Truncated pixel data for '{name}' in {self.path}.")
+        return tex_width, tex_height, self._view[pixel_data_start:pixel_data_end]
+
+    def miptex_dimensions(self, name):
+        """Returns (width, height) from a miptex lump's header without touching its pixels."""
+        lump_offset, _, _ = self.lumps[name]
+        if lump_offset + struct.calcsize(self.MIPTEX_HEADER_FORMAT) > len(self._view):
+            raise ValueError(f"Truncated MIPTEX header for '{name}' in {self.path}.")
+        _, tex_width, tex_height, *_ = struct.unpack_from(self.MIPTEX_HEADER_FORMAT, self._view, lump_offset)
+        return tex_width, tex_height
+
+    def read_miptex_mips(self, name):
+        """
+        Reads all four pre-filtered mip levels of a miptex lump.
+        Returns (width, height, levels) where levels[i] is a memoryview of palette indices for
+        the (width >> i) x (height >> i) level. Levels that are missing or truncated end the
+        list early, so it always starts with the full-size level. Views are only valid while
+        the archive is open.
+        """
+        lump_offset, lump_size, _ = self.lumps[name]
+        if lump_offset + struct.calcsize(self.MIPTEX_HEADER_FORMAT) > len(self._view):
+            raise ValueError(f"Truncated MIPTEX header for '{name}' in {self.path}.")
+        _, tex_width, tex_height, *mip_offsets = struct.unpack_from(self.MIPTEX_HEADER_FORMAT, self._view, lump_offset)
+
+        levels = []
+        for level, mip_offset in enumerate(mip_offsets):
+            level_width, level_height = tex_width >> level, tex_height >> level
+            level_start = lump_offset + mip_offset
+            level_end = level_start + level_width * level_height
+            if level_width < 1 or level_height < 1 or mip_offset == 0 or level_end > len(self._view):
+                break
+            levels.append(self._view[level_start:level_end])
+        if not levels:
+            raise ValueError(f"Truncated pixel data for '{name}' in {self.path}.")
+        return tex_width, tex_height, levels
+
+    def close(self):
+        """Releases the mapping. Views handed out by read_lump/read_miptex must be released first."""
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+            try:
+                if self._mmap is not None:
+                    self._mmap.close()
+            except BufferError:
+                pass # A caller still holds a view; the mapping is freed once it is dropped
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class BspArchive(WadArchive):
+    """
+    The miptex lump of a compiled Quake (BSP29/BSP2) or Half-Life (BSP30) map, read as a
+    texture archive: the textures embedded in the map are indexed by name exactly like WAD
+    lumps, so they can be looked up and decoded with the WadArchive methods.
+    Textures stored without pixels (Half-Life maps referencing external WADs) are skipped.
+    """
+    HEADER_FORMAT = '<4s30I' # version (or BSP2 magic), then offset and length of the 15 lumps
+    TEXTURES_LUMP = 2
+    VERSIONS = (struct.pack('<I', 29), struct.pack('<I', 30), b'BSP2')
+    KIND = "BSP"
+
+    def _read_directory(self):
+        """Indexes the miptex entries of the BSP textures lump."""
+        version, *lumps = struct.unpack_from(self.HEADER_FORMAT, self._view, 0)
+        if version not in self.VERSIONS:
+            raise ValueError(f"'{self.path}' is not a Quake BSP file (version: {version}).")
+        textures_offset, textures_size = lumps[2 * self.TEXTURES_LUMP:2 * self.TEXTURES_LUMP + 2]
+        textures_end = min(textures_offset + textures_size, len(self._view))
+        if textures_size < 4 or textures_offset + 4 > textures_end:
+            return # A map without textures
+        num_miptex, = struct.unpack_from('<i', self._view, textures_offset)
+        num_miptex = max(0, min(num_miptex, (textures_end - textures_offset - 4) // 4))
+        header_size = struct.calcsize(self.MIPTEX_HEADER_FORMAT)
+        for miptex_offset in struct.unpack_from(f'<{num_miptex}i', self._view, textures_offset + 4):
+            lump_offset = textures_offset + miptex_offset
+            if miptex_offset < 0 or lump_offset + header_size > textures_end:
+                continue # -1 marks a missing texture
+            name_raw, tex_width, tex_height, mip_offset0, *_ = struct.unpack_from(self.MIPTEX_HEADER_FORMAT, self._view, lump_offset)
+            if mip_offset0 == 0:
+                continue # Pixels live in an external WAD
+            lump_size = min(header_size + tex_width * tex_height * 85 // 64, textures_end - lump_offset)
+            lump_name = name_raw.split(b'\0', 1)[0].decode('ascii', errors='replace').lower()
+            self.lumps.setdefault(lump_name, (lump_offset, lump_size, self.MIPTEX_LUMP_TYPE))
+
+
+class PakFile:
+    """
+    Indexed, memory-mapped reader for a Quake PACK (.pak) archive. The directory is read
+    once into a lowercase name -> (offset, size) dict and files are served as memoryview
+    slices of the mapping, so nothing is ever unpacked to disk.
+    """
+    HEADER_FORMAT = '<4sII' # magic, directory offset, directory size
+    ENTRY_FORMAT = '<56sII' # name, filepos, filelen
+
+    def __init__(self, pak_file_path):
+        self.path = pak_file_path
+        self.files = {} # lowercase name ('gfx/palette.lmp') -> (offset, size)
+        with open(pak_file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < struct.calcsize(self.HEADER_FORMAT):
+                raise ValueError(f"'{self.path}' is too small to be a PAK file.")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        magic, directory_offset, directory_size = struct.unpack_from(self.HEADER_FORMAT, self._view, 0)
+        if magic != b'PACK':
+            self.close()
+            raise ValueError(f"'{self.path}' is not a PACK file (magic: {magic}).")
+        entry_size = struct.calcsize(self.ENTRY_FORMAT)
+        directory_end = min(directory_offset + directory_size, len(self._view))
+        num_entries = max(0, directory_end - directory_offset) // entry_size
+        directory = self._view[directory_offset:directory_offset + num_entries * entry_size]
+        for name_raw, file_offset, file_size in struct.iter_unpack(self.ENTRY_FORMAT, directory):
+            name = name_raw.split(b'\0', 1)[0].decode('ascii', errors='replace').replace('\\', '/').lower()
+            if file_offset + file_size <= len(self._view):
+                self.files.setdefault(name, (file_offset, file_size))
+        directory.release()
+
+    def __contains__(self, name):
+        return name in self.files
+
+    def __len__(self):
+        return len(self.files)
+
+    def read_file(self, name):
+        """Returns the named file as a zero-copy memoryview into the mapped archive."""
+        offset, size = self.files[name]
+        return self._view[offset:offset + size]
+
+    def close(self):
+        """Releases the mapping once every view handed out by read_file has been released."""
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass # Archives opened from this PAK still hold views; freed once they close
+
+
+def split_pak_path(path):
+    """
+    Splits a virtual path that goes through a PAK file as if it were a folder into
+    (pak file, name inside it), e.g. 'id1/pak0.pak/gfx/palette.lmp' -> ('id1/pak0.pak',
+    'gfx/palette.lmp'). Paths that do not go through an existing PAK return (path, None).
+    """
+    normalized = path.replace('\\', '/').lower()
+    index = normalized.find('.pak/')
+    while index != -1:
+        if os.path.isfile(path[:index + 4]):
+            return path[:index + 4], normalized[index + 5:]
+        index = normalized.find('.pak/', index + 1)
+    return path, None
+
+
+# Files inside PAKs and game folders that can hold textures
+TEXTURE_SOURCE_EXTENSIONS = ('.wad', '.bsp')
+
+
+class QuakeFileSystem:
+    """
+    Virtual file system over loose files and Quake PAK archives. A path may go through a
+    PAK as if it were a folder (see split_pak_path). Each PAK is mapped and its directory
+    indexed once, on first use, and files inside are read straight from the mapping.
+    Texture sources (see open_texture_archives) are .wad files, .bsp files (their embedded
+    miptex), .pak files (every WAD and BSP inside) and game folders (their PAKs and WADs).
+    """
+    def __init__(self):
+        self.paks = {} # pak file path -> PakFile, or None if it could not be read
+
+    def pak(self, pak_file_path):
+        """Returns the indexed PakFile for pak_file_path (None if unreadable; reported once)."""
+        if pak_file_path not in self.paks:
+            try:
+                self.paks[pak_file_path] = PakFile(pak_file_path)
+            except (OSError, ValueError) as e:
+                print(f"  [WARNING] Could not index PAK file '{pak_file_path}': {e}. Skipping.")
+                self.paks[pak_file_path] = None
+        return self.paks[pak_file_path]
+
+    def exists(self, path):
+        """True if path is a file, a folder, or a file inside a PAK."""
+        pak_file_path, name = split_pak_path(path)
+        if name is None:
+            return os.path.exists(path)
+        pak_file = self.pak(pak_file_path)
+        return pak_file is not None and name in pak_file
+
+    def read(self, path):
+        """Returns the bytes of a loose file or a file inside a PAK."""
+        pak_file_path, name = split_pak_path(path)
+        if name is None:
+            with open(path, 'rb') as f:
+                return f.read()
+        pak_file = self.pak(pak_file_path)
+        if pak_file is None or name not in pak_file:
+            raise FileNotFoundError(f"'{name}' not found in '{pak_file_path}'.")
+        with pak_file.read_file(name) as data:
+            return bytes(data)
+
+    def texture_source_paths(self, path):
+        """Expands a texture source into the virtual paths of the WAD and BSP files it holds."""
+        if os.path.isdir(path):
+            entries = sorted(os.listdir(path))
+            # Like Quake, higher-numbered PAKs override lower ones
+            paks = sorted((entry for entry in entries if entry.lower().endswith('.pak')), reverse=True)
+            wads = [entry for entry in entries if entry.lower().endswith('.wad')]
+            return [source_path for entry in paks + wads for source_path in self.texture_source_paths(os.path.join(path, entry))]
+        if path.lower().endswith('.pak') and os.path.isfile(path):
+            pak_file = self.pak(path)
+            if pak_file is None:
+                return []
+            return [os.path.join(path, name) for name in sorted(pak_file.files) if name.endswith(TEXTURE_SOURCE_EXTENSIONS)]
+        return [path]
+
+    def open_texture_archive(self, path):
+        """Opens one .wad or .bsp file (loose or inside a PAK) as a WadArchive/BspArchive."""
+        archive_class = BspArchive if path.lower().endswith('.bsp') else WadArchive
+        pak_file_path, name = split_pak_path(path)
+        if name is None:
+            return archive_class(path)
+        pak_file = self.pak(pak_file_path)
+        if pak_file is None or name not in pak_file:
+            raise FileNotFoundError(f"'{name}' not found in '{pak_file_path}'.")
+        return archive_class(path, pak_file.read_file(name))
+
+    def find(self, file_name, search_paths):
+        """
+        Returns the virtual path of the first file named file_name (case-insensitive) directly
+        in one of search_paths (folders, or PAKs searched by file name at any depth), or None.
+        """
+        file_name = file_name.lower()
+        for search_path in search_paths:
+            if os.path.isdir(search_path):
+                for entry in sorted(os.listdir(search_path)):
+                    if entry.lower() == file_name and os.path.isfile(os.path.join(search_path, entry)):
+                        return os.path.join(search_path, entry)
+            elif search_path.lower().endswith('.pak') and os.path.isfile(search_path):
+                pak_file = self.pak(search_path)
+                for name in sorted(pak_file.files) if pak_file is not None else ():
+                    if name.rsplit('/', 1)[-1] == file_name:
+                        return os.path.join(search_path, name)
+        return None
+
+    def close(self):
+        """Closes the PAK files; their mappings are freed once archives opened from them are closed."""
+        for pak_file in self.paks.values():
+            if pak_file is not None:
+                pak_file.close()
+        self.paks = {}
+
+
+def open_wad_archives(wad_files_paths, log=print):
+    """
+    Opens and indexes every texture source in wad_files_paths (a path or a list of paths):
+    WAD files, BSP files, PAK files and game folders (see QuakeFileSystem), with paths that go
+    through a PAK read straight from it. Missing or invalid sources are reported through log
+    (one message per call) and skipped.
+    Returns the list of open archives in search order; the caller is responsible for closing them.
+    """
+    if isinstance(wad_files_paths, str):
+        wad_files_paths = [wad_files_paths]
+
+    file_system = QuakeFileSystem()
+    wad_archives = []
+    try:
+        for source_path in wad_files_paths:
+            if not file_system.exists(source_path):
+                log(f"  [WARNING] WAD file not found: {source_path}")
+                continue
+            for wad_file_path in file_system.texture_source_paths(source_path):
+                try:
+                    wad_archives.append(file_system.open_texture_archive(wad_file_path))
+                except Exception as e:
+                    log(f"  [WARNING] Could not index texture source '{wad_file_path}': {e}. Skipping.")
+    finally:
+        file_system.close()
+    return wad_archives
+
+
+def find_texture_archive(texture_name, wad_archives):
+    """Returns the first WadArchive containing texture_name, or None."""
+    for wad_archive in wad_archives:
+        if texture_name in wad_archive:
+            return wad_archive
+    return None
+
+
+# Quake animated textures: '+<frame><name>', with frames '+0'..'+9' and an alternate
+# (toggled) sequence '+a'..'+j'
+ANIMATION_FRAMES = '0123456789'
+ALTERNATE_ANIMATION_FRAMES = 'abcdefghij'
+
+
+def texture_family_name(texture_name):
+    """
+    Returns the name an animated texture frame is converted under: the first frame of its
+    sequence ('+1shoot' -> '+0shoot', '+cbutn' -> '+abutn'). Other names are returned unchanged.
+    """
+    if len(texture_name) > 2 and texture_name[0] == '+':
+        frame = texture_name[1].lower()
+        if frame in ANIMATION_FRAMES:
+            return '+0' + texture_name[2:]
+        if frame in ALTERNATE_ANIMATION_FRAMES:
+            return ('+a' if texture_name[1].islower() else '+A') + texture_name[2:]
+    return texture_name
+
+
+def texture_animation_frames(texture_name, wad_archives):
+    """
+    Lists the WAD textures making up texture_name's animation sequence in frame order, starting
+    with the first frame present and ending at the first gap, as Quake does. A texture that is
+    not animated is its own single frame; an empty list means nothing was found.
+    """
+    family_name = texture_family_name(texture_name)
+    if family_name == texture_name and not texture_name.startswith('+'):
+        return [texture_name] if find_texture_archive(texture_name, wad_archives) else []
+    frame_chars = ANIMATION_FRAMES if family_name[1] == '0' else ALTERNATE_ANIMATION_FRAMES
+    if family_name[1] == 'A':
+        frame_chars = frame_chars.upper()
+    frames = []
+    for frame_char in frame_chars:
+        frame_name = f"+{frame_char}{family_name[2:]}"
+        if find_texture_archive(frame_name, wad_archives) is not None:
+            frames.append(frame_name)
+        elif frames:
+            break
+    return frames
+
+
+def group_texture_families(texture_names, wad_archives):
+    """
+    Groups texture names by animation family (see texture_family_name).
+    Returns a dict mapping each family name, in sorted order, to its frame names in the WADs.
+    """
+    families = {}
+    for texture_name in sorted(texture_names):
+        families.setdefault(texture_family_name(texture_name), None)
+    for family_name in families:
+        families[family_name] = texture_animation_frames(family_name, wad_archives)
+    return families
+
+
+def extract_and_save_texture_png(texture_name, output_dir, wad_archives=None, palette=None, frames=None):
+    """
+    Extracts the texture data from Quake .wad files and saves it as a PNG image.
+    This implementation assumes Quake 1 (WAD2) format and uses palette (a Palette;
+    the built-in Quake palette if None).
+    wad_archives is a list of already opened WadArchive objects (see open_wad_archives);
+    plain WAD paths are still accepted and are indexed for this call only.
+    With several frames (see texture_animation_frames) the frames are laid out left to right
+    as a single sprite-sheet PNG.
+    """
+    if not wad_archives:
+        print(f"  [ERROR] No WAD files provided. Cannot extract texture '{texture_name}'.")
+        return False
+
+    if isinstance(wad_archives, str) or not isinstance(wad_archives[0], WadArchive):
+        opened_archives = open_wad_archives(wad_archives)
+        try:
+            return extract_and_save_texture_png(texture_name, output_dir, opened_archives, palette, frames) if opened_archives else False
+        finally:
+            for wad_archive in opened_archives:
+                wad_archive.close()
+
+    png_filepath = os.path.join(output_dir, f"{texture_name}.png")
+    os.makedirs(os.path.dirname(png_filepath), exist_ok=True)
+
+    if os.path.exists(png_filepath):
+        print(f"  Texture '{texture_name}.png' already exists. Skipping extraction.")
+        return True # Assume it's already extracted
+
+    frames = frames or [texture_name]
+    wad_archive = find_texture_archive(frames[0], wad_archives)
+    if wad_archive is None:
+        print(f"  [WARNING] Texture '{texture_name}' not found in any provided WAD files.")
+        print(f"  Please ensure you manually provide '{texture_name}.png' at '{png_filepath}' if it's missing.")
+        return False # Indicate texture not found
+
+    print(f"  Found texture '{texture_name}' in '{wad_archive.path}'.")
+    try:
+        tex_width, tex_height, pixel_data = wad_archive.read_miptex(frames[0])
+
+        # Wrap the mapped index buffer directly; no per-pixel Python iteration or copies
+        img = Image.frombuffer('P', (tex_width, tex_height), pixel_data, 'raw', 'P', 0, 1)
+        if len(frames) > 1:
+            # Animated texture: one sprite sheet with every frame of the sequence
+            sheet = Image.new('P', (tex_width * len(frames), tex_height))
+            sheet.paste(img, (0, 0))
+            del img
+            pixel_data.release()
+            for frame_index, frame_name in enumerate(frames[1:], 1):
+                frame_width, frame_height, pixel_data = find_texture_archive(frame_name, wad_archives).read_miptex(frame_name)
+                if (frame_width, frame_height) == (tex_width, tex_height):
+                    sheet.paste(Image.frombuffer('P', (frame_width, frame_height), pixel_data, 'raw', 'P', 0, 1), (frame_index * tex_width, 0))
+                else:
+                    print(f"  [WARNING] Frame '{frame_name}' of '{texture_name}' differs in size from the first frame; left blank.")
+                pixel_data.release()
+            img = sheet
+            print(f"  Combined {len(frames)} animation frames of '{texture_name}' into one sprite sheet.")
+        img.putpalette((palette or DEFAULT_PALETTE).flattened)
+
+        # If texture name starts with '{', make color 255 transparent
+        if texture_name.startswith('{'):
+            img.info['transparency'] = 255 # Set index 255 as transparent
+            print(f"  Marked '{texture_name}' (palette index 255) as transparent.")
+
+        img.save(png_filepath)
+        del img # Drop the image before the view it borrows from
+        pixel_data.release()
+    except Exception as e:
+        print(f"  [ERROR] Could not extract texture '{texture_name}' from WAD file '{wad_archive.path}': {e}")
+        return False
+
+    print(f"  Successfully extracted and saved '{png_filepath}'.")
+    return True # Indicate successful extraction
+
+
+def sort_textures_by_wad_position(texture_names, wad_archives):
+    """
+    Orders texture_names by (archive, lump offset) so that extracting them in that order
+    reads each WAD in a single forward pass. Textures missing from every WAD come first.
+    """
+    def wad_position(texture_name):
+        for archive_index, wad_archive in enumerate(wad_archives):
+            if texture_name in wad_archive:
+                return (archive_index, wad_archive.lumps[texture_name][0], texture_name)
+        return (-1, 0, texture_name)
+    return sorted(texture_names, key=wad_position)
+
+
+def extract_textures_png(texture_names, output_dir, wad_archives):
+    """
+    Batch version of extract_and_save_texture_png.
+    Resolves every texture against the WAD indexes first and then extracts them in
+    (archive, lump offset) order, so each WAD is read in a single forward pass.
+    Returns a dict mapping each texture name to True (PNG available) or False.
+    """
+    results = {}
+    for texture_name in sort_textures_by_wad_position(texture_names, wad_archives):
+        results[texture_name] = extract_and_save_texture_png(texture_name, output_dir, wad_archives)
+    return results
+
+
+def convert_png_to_vtf(png_filepath, vtf_output_dir, vtex_path, s1_game_content_root, log=print):
+    """
+    Converts a PNG image to a Source 1 VTF file using vtex.exe.
+    Progress and errors are reported through log, which receives one message per call.
+    """
+    vtf_name = os.path.splitext(os.path.basename(png_filepath))[0]
+    vtf_filepath = os.path.join(vtf_output_dir, f"{vtf_name}.vtf")
+
+    # vtex.exe requires VPROJECT to be set to the game's content root (e.g., tf, hl2)
+    # and often expects to be run from its own bin directory.
+    
+    # Ensure output directory exists for vtex
+    os.makedirs(vtf_output_dir, exist_ok=True)
+
+    # Command to run vtex.exe
+    # -shader UnlitGeneric: A common simple shader for basic textures
+    # -format DXT1: A common compressed format for diffuse textures
+    # -alpha: Include alpha channel if present (for transparent textures)
+    # -nocompress: If you want uncompressed textures (larger file size)
+    # -file <input_png_path>
+    
+    command = [
+        vtex_path,
+        "-quiet", # Suppress most vtex output
+        "-mkdir", # Create output directories if they don't exist
+        "-shader", "UnlitGeneric", # Basic shader
+        "-format", "DXT1", # Common compressed format for diffuse
+        # "-alpha", # Only add if the image actually has transparency
+        png_filepath
+    ]
+
+    # Check if the PNG has transparency to decide on -alpha flag
+    try:
+        with Image.open(png_filepath) as img:
+            if img.mode == 'RGBA' or (img.mode == 'P' and 'transparency' in img.info):
+                command.insert(2, "-alpha") # Insert -alpha flag after -quiet
+                log(f"  [VTEX] Detected transparency for '{vtf_name}', adding -alpha flag.")
+    except Exception as e:
+        log(f"  [VTEX_WARNING] Could not check transparency for '{png_filepath}': {e}")
+
+    env = os.environ.copy()
+    env['VPROJECT'] = s1_game_content_root
+    
+    # vtex.exe usually expects its CWD to be its own bin directory
+    vtex_bin_dir = os.path.dirname(vtex_path)
+
+    log(f"  [VTEX] Converting '{os.path.basename(png_filepath)}' to VTF...")
+    log(f"  [VTEX] VPROJECT set to: '{env['VPROJECT']}'")
+    log(f"  [VTEX] CWD for vtex.exe: '{vtex_bin_dir}'")
+    log(f"  [VTEX] Command: {' '.join(command)}")
+
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8', errors='replace', env=env, cwd=vtex_bin_dir)
+        stdout, stderr = process.communicate()
+
+        if stdout:
+            log(f"  [VTEX_STDOUT] {stdout}")
+        if stderr:
+            log(f"  [VTEX_STDERR] {stderr}")
+
+        if process.returncode != 0:
+            log(f"  [ERROR] vtex.exe exited with code {process.returncode} for '{vtf_name}'.")
+            return False
+        else:
+            # vtex outputs VTF to the VPROJECT's materials/ folder by default,
+            # but we want it in our addon's materials folder.
+            # We need to move it from the VPROJECT's materials folder to our output_dir.
+            # vtex will output to <VPROJECT>/materials/<texture_name>.vtf
+            # So we need to construct that path.
+            expected_vtf_in_vproject = os.path.join(s1_game_content_root, "materials", f"{vtf_name}.vtf")
+            
+            if os.path.exists(expected_vtf_in_vproject):
+                shutil.move(expected_vtf_in_vproject, vtf_filepath)
+                log(f"  Successfully converted and moved '{vtf_name}.vtf' to '{vtf_filepath}'.")
+                return True
+            else:
+                log(f"  [ERROR] vtex.exe did not produce VTF at expected location: '{expected_vtf_in_vproject}'.")
+                return False
+
+    except FileNotFoundError:
+        log(f"[ERROR] vtex.exe not found at '{vtex_path}'. Please check the path.")
+        return False
+    except Exception as e:
+        log(f"[ERROR] An unexpected error occurred while running vtex.exe for '{vtf_name}': {e}")
+        return False
+
+
+def replace_with_temp_file(temp_filepath, filepath):
+    """Renames a finished tempfile.mkstemp() file over filepath, with the permissions a plain open() would have given it."""
+    # mkstemp creates the file private to the user
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(temp_filepath, 0o666 & ~umask)
+    os.replace(temp_filepath, filepath)
+
+
+# --- Native VTF (Valve Texture Format) encoder ---
+VTF_HEADER_FORMAT = '<4s2IIHHIHH4x3f4xfIBIBBH' # VTF 7.2 header fields, padded to VTF_HEADER_SIZE
+VTF_HEADER_SIZE = 80
+VTF_IMAGE_FORMAT_NONE = 0xFFFFFFFF
+VTF_IMAGE_FORMAT_DXT1 = 13
+VTF_IMAGE_FORMAT_DXT5 = 15
+VTF_FLAG_EIGHTBITALPHA = 0x2000
+
+# Compressed block layouts: an RGB565 endpoint pair plus 16 2-bit indices, preceded in
+# DXT5 by two alpha endpoints and 16 3-bit alpha indices
+_DXT1_BLOCK = np.dtype([('color0', '<u2'), ('color1', '<u2'), ('indices', '<u4')])
+_DXT5_BLOCK = np.dtype([('alpha0', 'u1'), ('alpha1', 'u1'), ('alpha_indices', 'u1', 6),
+                        ('color0', '<u2'), ('color1', '<u2'), ('indices', '<u4')])
+
+def generate_mipmaps(rgba):
+    """Returns the full mip chain of rgba, largest first, down to 1x1, using a 2x2 box filter."""
+    return complete_mip_chain([rgba])
+
+
+def complete_mip_chain(levels):
+    """
+    Extends a list of existing mip levels (largest first, each half the size of the previous)
+    down to 1x1 by box-filtering from the smallest one. The given levels are used as they are.
+    """
+    mipmaps = list(levels)
+    level = mipmaps[-1].astype(np.float32)
+    while level.shape[0] > 1 or level.shape[1] > 1:
+        height, width = level.shape[:2]
+        if height > 1:
+            level = (level[0:height - 1:2] + level[1:height:2]) * 0.5
+        if width > 1:
+            level = (level[:, 0:width - 1:2] + level[:, 1:width:2]) * 0.5
+        mipmaps.append(np.rint(level).astype(np.uint8))
+    return mipmaps
+
+
+def _image_to_blocks(rgba):
+    """Splits an RGBA image into (blocks, 16, 4) float32 4x4 blocks in row-major block order, padding edges by replication."""
+    height, width = rgba.shape[:2]
+    padded_height, padded_width = (height + 3) // 4 * 4, (width + 3) // 4 * 4
+    if (padded_height, padded_width) != (height, width):
+        rgba = np.pad(rgba, ((0, padded_height - height), (0, padded_width - width), (0, 0)), mode='edge')
+    blocks = rgba.reshape(padded_height // 4, 4, padded_width // 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    return blocks.reshape(-1, 16, 4).astype(np.float32)
+
+
+def _pack_indices(indices, bits):
+    """Packs (blocks, 16) indices of `bits` bits each into one little-endian integer per block, pixel 0 lowest."""
+    shifts = np.arange(16, dtype=np.uint64) * np.uint64(bits)
+    return np.bitwise_or.reduce(indices.astype(np.uint64) << shifts, axis=1)
+
+
+def _compress_color_blocks(colors):
+    """
+    Vectorized DXT colour compression of (blocks, 16, 3) float RGB.
+    Endpoints are the block's extreme pixels along its principal colour axis, stored as RGB565
+    with color0 > color1 (four-colour mode). Returns (color0, color1, packed 2-bit indices).
+    """
+    mean = colors.mean(axis=1, keepdims=True)
+    centered = colors - mean
+    covariance = np.einsum('nki,nkj->nij', centered, centered)
+    # A few power iterations are enough to find the dominant axis of a 16-pixel block
+    axis = np.ones((len(colors), 3), dtype=np.float32)
+    for _ in range(4):
+        axis = np.einsum('nij,nj->ni', covariance, axis)
+        axis /= np.maximum(np.abs(axis).max(axis=1, keepdims=True), 1e-12)
+    projection = np.einsum('nki,ni->nk', centered, axis)
+    rows = np.arange(len(colors))
+    endpoint0 = colors[rows, projection.argmax(axis=1)]
+    endpoint1 = colors[rows, projection.argmin(axis=1)]
+
+    def to_rgb565(color):
+        r = np.rint(color[:, 0] * (31 / 255)).astype(np.uint16)
+        g = np.rint(color[:, 1] * (63 / 255)).astype(np.uint16)
+        b = np.rint(color[:, 2] * (31 / 255)).astype(np.uint16)
+        return (r << 11) | (g << 5) | b
+
+    def from_rgb565(packed):
+        r, g, b = (packed >> 11) & 31, (packed >> 5) & 63, packed & 31
+        return np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=1).astype(np.float32)
+
+    def nearest_indices(color0, color1):
+        decoded0, decoded1 = from_rgb565(color0), from_rgb565(color1)
+        palette = np.stack([decoded0, decoded1, (2 * decoded0 + decoded1) / 3, (decoded0 + 2 * decoded1) / 3], axis=1)
+        distances = ((colors[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(axis=3)
+        return distances.argmin(axis=2)
+
+    def ordered(color0, color1):
+        swap = color0 < color1
+        return np.where(swap, color1, color0), np.where(swap, color0, color1)
+
+    color0, color1 = ordered(to_rgb565(endpoint0), to_rgb565(endpoint1))
+    indices = nearest_indices(color0, color1)
+
+    # One least-squares pass: refit both endpoints to the chosen interpolation weights
+    weight0 = np.array([1, 0, 2 / 3, 1 / 3], dtype=np.float32)[indices]
+    weight1 = 1 - weight0
+    a, b, c = (weight0 * weight0).sum(axis=1), (weight1 * weight1).sum(axis=1), (weight0 * weight1).sum(axis=1)
+    x0 = np.einsum('nk,nki->ni', weight0, colors)
+    x1 = np.einsum('nk,nki->ni', weight1, colors)
+    determinant = a * b - c * c
+    solvable = np.abs(determinant) > 1e-6
+    safe_determinant = np.where(solvable, determinant, 1)[:, None]
+    refit0 = np.clip((b[:, None] * x0 - c[:, None] * x1) / safe_determinant, 0, 255)
+    refit1 = np.clip((a[:, None] * x1 - c[:, None] * x0) / safe_determinant, 0, 255)
+    refit_color0, refit_color1 = ordered(to_rgb565(refit0), to_rgb565(refit1))
+    refit_indices = nearest_indices(refit_color0, refit_color1)
+
+    # Keep whichever fit reconstructs each block better
+    def block_error(color0, color1, indices):
+        decoded0, decoded1 = from_rgb565(color0), from_rgb565(color1)
+        palette = np.stack([decoded0, decoded1, (2 * decoded0 + decoded1) / 3, (decoded0 + 2 * decoded1) / 3], axis=1)
+        return ((colors - np.take_along_axis(palette, indices[:, :, None], axis=1)) ** 2).sum(axis=(1, 2))
+    use_refit = solvable & (block_error(refit_color0, refit_color1, refit_indices) < block_error(color0, color1, indices))
+    color0 = np.where(use_refit, refit_color0, color0)
+    color1 = np.where(use_refit, refit_color1, color1)
+    indices = np.where(use_refit[:, None], refit_indices, indices)
+    # Equal endpoints select three-colour mode, where index 3 is transparent; use index 0 only
+    indices[color0 == color1] = 0
+    return color0, color1, _pack_indices(indices, 2).astype(np.uint32)
+
+
+def _compress_alpha_blocks(alphas):
+    """Vectorized DXT5 alpha compression of (blocks, 16) float alpha. Returns (alpha0, alpha1, (blocks, 6) index bytes)."""
+    alpha0 = alphas.max(axis=1).astype(np.uint8)
+    alpha1 = alphas.min(axis=1).astype(np.uint8)
+    # Eight-alpha mode (alpha0 > alpha1): alpha0, alpha1 and six interpolated steps
+    weights = np.array([7, 0, 6, 5, 4, 3, 2, 1], dtype=np.float32) / 7
+    palette = alpha0[:, None] * weights + alpha1[:, None] * (1 - weights)
+    indices = np.abs(alphas[:, :, None] - palette[:, None, :]).argmin(axis=2)
+    indices[alpha0 == alpha1] = 0
+    packed = _pack_indices(indices, 3)
+    index_bytes = (packed[:, None] >> (np.arange(6, dtype=np.uint64) * np.uint64(8))) & np.uint64(0xFF)
+    return alpha0, alpha1, index_bytes.astype(np.uint8)
+
+
+def compress_dxt_blocks(blocks, alpha=False):
+    """Compresses (blocks, 16, 4) RGBA blocks (see _image_to_blocks) to DXT1 bytes, or DXT5 bytes with alpha."""
+    color0, color1, indices = _compress_color_blocks(blocks[:, :, :3])
+    if not alpha:
+        compressed = np.empty(len(blocks), dtype=_DXT1_BLOCK)
+    else:
+        compressed = np.empty(len(blocks), dtype=_DXT5_BLOCK)
+        compressed['alpha0'], compressed['alpha1'], compressed['alpha_indices'] = _compress_alpha_blocks(blocks[:, :, 3])
+    compressed['color0'], compressed['color1'], compressed['indices'] = color0, color1, indices
+    return compressed.tobytes()
+
+
+def compress_dxt(rgba, alpha=False):
+    """Compresses an (height, width, 4) uint8 RGBA image to DXT1 bytes, or DXT5 bytes with alpha."""
+    return compress_dxt_blocks(_image_to_blocks(rgba), alpha)
+
+
+def encode_vtf(rgba, alpha=False, mip_levels=()):
+    """
+    Encodes an (height, width, 4) uint8 RGBA image as a single-frame VTF 7.2 file with a full
+    mip chain, DXT1-compressed (DXT5 with 8-bit alpha if alpha). Returns the file bytes.
+    mip_levels are already filtered levels following rgba (e.g. the WAD's own mips); they are
+    embedded as they are and only the smaller levels are generated.
+    """
+    return encode_vtf_frames([[rgba, *mip_levels]], alpha)
+
+
+def encode_vtf_frames(frames, alpha=False):
+    """
+    Multi-frame version of encode_vtf (for animated textures): frames is a list with, per frame,
+    its leading mip levels (at least the full-size image; all frames the same size).
+    """
+    height, width = frames[0][0].shape[:2]
+    frame_mipmaps = [complete_mip_chain(levels) for levels in frames]
+    mip_count = len(frame_mipmaps[0])
+    # Reflectivity is the average linear colour of the texture
+    reflectivity = ((frames[0][0][..., :3].reshape(-1, 3) / 255.0) ** 2.2).mean(axis=0)
+    header = struct.pack(VTF_HEADER_FORMAT, b'VTF\0', 7, 2, VTF_HEADER_SIZE, width, height,
+                         VTF_FLAG_EIGHTBITALPHA if alpha else 0, len(frames), 0, *reflectivity, 1.0,
+                         VTF_IMAGE_FORMAT_DXT5 if alpha else VTF_IMAGE_FORMAT_DXT1, mip_count,
+                         VTF_IMAGE_FORMAT_NONE, 0, 0, 1)
+    # No low-resolution thumbnail; mip levels are stored smallest first with every frame of a
+    # level side by side, so the blocks of the whole file are compressed in one batch in file order
+    blocks = np.concatenate([_image_to_blocks(mipmaps[level])
+                             for level in reversed(range(mip_count)) for mipmaps in frame_mipmaps])
+    return header.ljust(VTF_HEADER_SIZE, b'\0') + compress_dxt_blocks(blocks, alpha)
+
+
+def write_vtf_from_miptex(texture_name, vtf_output_dir, wad_archives, log=print, palette=None, frames=None):
+    """
+    Decodes texture_name straight from the WAD palette indices (expanded through palette,
+    the built-in Quake palette if None) and writes <vtf_output_dir>/<texture_name>.vtf with
+    the native encoder, without a PNG or vtex.exe. The four mip levels stored in the WAD are
+    embedded directly; only levels below 1/8 size are generated.
+    Textures named '{...}' use palette index 255 as transparency and are stored as DXT5, as are
+    textures with fullbright pixels when the palette writes the fullbright mask to alpha.
+    frames lists the WAD textures stored as the frames of an animated texture (see
+    texture_animation_frames); by default the texture is its only frame.
+    The file is written to a temporary name and renamed into place.
+    """
+    if palette is None:
+        palette = DEFAULT_PALETTE
+    vtf_filepath = os.path.join(vtf_output_dir, f"{texture_name}.vtf")
+    if find_texture_archive((frames or [texture_name])[0], wad_archives) is None:
+        log(f"  [WARNING] Texture '{texture_name}' not found in any provided WAD files.")
+        return False
+
+    frame_levels = []
+    alpha = transparent = texture_name.startswith('{')
+    for frame_name in frames or [texture_name]:
+        wad_archive = find_texture_archive(frame_name, wad_archives)
+        try:
+            tex_width, tex_height, mip_data = wad_archive.read_miptex_mips(frame_name)
+            if frame_levels and frame_levels[0][0].shape[:2] != (tex_height, tex_width):
+                log(f"  [WARNING] Skipping frame '{frame_name}' of '{texture_name}': its size differs from the first frame.")
+                continue
+            frame_levels.append([palette.expand(pixel_data, tex_width >> level, tex_height >> level, transparent)
+                                 for level, pixel_data in enumerate(mip_data)])
+            alpha = alpha or (palette.fullbright_alpha and palette.has_fullbrights(mip_data[0], tex_width, tex_height))
+            for pixel_data in mip_data:
+                pixel_data.release()
+        except Exception as e:
+            log(f"  [ERROR] Could not decode texture '{frame_name}' from WAD file '{wad_archive.path}': {e}")
+            return False
+
+    try:
+        # Every frame needs the same number of WAD mip levels; extra ones are regenerated
+        shared_levels = min(len(levels) for levels in frame_levels)
+        vtf_data = encode_vtf_frames([levels[:shared_levels] for levels in frame_levels], alpha)
+    except Exception as e:
+        log(f"  [ERROR] Could not encode texture '{texture_name}': {e}")
+        return False
+
+    os.makedirs(vtf_output_dir, exist_ok=True)
+    fd, temp_filepath = tempfile.mkstemp(prefix=".", suffix=".vtf.tmp", dir=vtf_output_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(vtf_data)
+        replace_with_temp_file(temp_filepath, vtf_filepath)
+    except OSError as e:
+        try:
+            os.remove(temp_filepath)
+        except OSError:
+            pass
+        log(f"  [ERROR] Could not write VTF file '{vtf_filepath}': {e}")
+        return False
+
+    frame_count = f", {len(frame_levels)} frames" if len(frame_levels) > 1 else ""
+    tex_height, tex_width = frame_levels[0][0].shape[:2]
+    log(f"  Encoded '{texture_name}' ({tex_width}x{tex_height}, {'DXT5' if alpha else 'DXT1'}{frame_count}) to '{vtf_filepath}'.")
+    return True
+
+
+class TextureAtlas:
+    """
+    Packing of several small textures into shared power-of-two sheets.
+    rects maps each packed texture name to (sheet index, x, y, width, height) in texels, and
+    sheet_sizes lists each sheet's (width, height). Every texture is surrounded by `padding`
+    texels of wrapped border so filtering at its edges samples its own tiling.
+    Faces keep their texel scale and are moved onto the sheet by offsetting their texture axes,
+    so a texture is only atlased in a map whose faces all stay within a single repeat of it
+    (see fit_texture_atlas).
+    """
+    def __init__(self, sheet_sizes, rects, padding, name_prefix="atlas"):
+        self.sheet_sizes = sheet_sizes
+        self.rects = rects
+        self.padding = padding
+        self.name_prefix = name_prefix
+
+    def __contains__(self, texture_name):
+        return texture_name in self.rects
+
+    def __len__(self):
+        return len(self.sheet_sizes)
+
+    def sheet_name(self, sheet_index):
+        return f"{self.name_prefix}_{sheet_index}"
+
+    def material(self, texture_name):
+        """Name of the sheet (material) holding texture_name."""
+        return self.sheet_name(self.rects[texture_name][0])
+
+    def subset(self, texture_names):
+        """The same sheets with only the rects of texture_names (the rest use their own material)."""
+        return TextureAtlas(self.sheet_sizes, {texture_name: self.rects[texture_name] for texture_name in texture_names if texture_name in self.rects},
+                            self.padding, self.name_prefix)
+
+    def uv_rect(self, texture_name):
+        """texture_name's area on its sheet in normalized coordinates: (u0, v0, u1, v1)."""
+        sheet_index, x, y, width, height = self.rects[texture_name]
+        sheet_width, sheet_height = self.sheet_sizes[sheet_index]
+        return (x / sheet_width, y / sheet_height, (x + width) / sheet_width, (y + height) / sheet_height)
+
+    def uv_table(self):
+        """The name -> UV-rect table as a JSON-serialisable dict."""
+        return {texture_name: {'material': self.material(texture_name), 'rect': list(self.rects[texture_name][1:]),
+                               'uv': list(self.uv_rect(texture_name))}
+                for texture_name in sorted(self.rects)}
+
+    @property
+    def key(self):
+        """Hash of the layout, for build manifests."""
+        return hashlib.sha1(json.dumps([self.sheet_sizes, self.rects, self.padding, self.name_prefix], sort_keys=True).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def pack(cls, texture_sizes, max_sheet_size=1024, padding=2):
+        """
+        Shelf-packs texture_sizes (name -> (width, height)) tallest first into as few sheets of
+        at most max_sheet_size square as needed, then shrinks each sheet to the smallest
+        power-of-two size that holds its contents. Textures that do not fit a sheet are left out.
+        """
+        rects = {}
+        sheets = [] # per sheet: list of shelves [y, height, used width]
+        for texture_name, (width, height) in sorted(texture_sizes.items(), key=lambda item: (-item[1][1], -item[1][0], item[0])):
+            padded_width, padded_height = width + 2 * padding, height + 2 * padding
+            if padded_width > max_sheet_size or padded_height > max_sheet_size:
+                continue
+            for sheet_index, shelves in enumerate(sheets):
+                shelf = next((shelf for shelf in shelves if shelf[1] >= padded_height and shelf[2] + padded_width <= max_sheet_size), None)
+                if shelf is None and shelves[-1][0] + shelves[-1][1] + padded_height <= max_sheet_size:
+                    shelf = [shelves[-1][0] + shelves[-1][1], padded_height, 0]
+                    shelves.append(shelf)
+                if shelf is not None:
+                    break
+            else:
+                sheet_index, shelf = len(sheets), [0, padded_height, 0]
+                sheets.append([shelf])
+            rects[texture_name] = (sheet_index, shelf[2] + padding, shelf[0] + padding, width, height)
+            shelf[2] += padded_width
+
+        def power_of_two(size):
+            return 1 << max(0, int(size) - 1).bit_length()
+        sheet_sizes = [(power_of_two(max(shelf[2] for shelf in shelves)), power_of_two(shelves[-1][0] + shelves[-1][1]))
+                       for shelves in sheets]
+        return cls(sheet_sizes, rects, padding)
+
+
+def atlas_candidate(texture_name, frames):
+    """
+    True for textures that can share an atlas sheet: single-frame, opaque and static.
+    Animated ('+'), transparent ('{'), liquid/warping ('*') and sky textures keep their own material.
+    """
+    return len(frames) == 1 and texture_name[0] not in '+{*' and not texture_name.lower().startswith('sky')
+
+
+def build_texture_atlas(texture_names, wad_archives, max_texture_size=64, max_sheet_size=1024, padding=2):
+    """
+    Packs the atlas candidates among texture_names that are at most max_texture_size texels
+    on each side into a TextureAtlas. Returns None if fewer than two textures qualify.
+    """
+    texture_sizes = {}
+    for texture_name in sorted(set(texture_names)):
+        frames = texture_animation_frames(texture_name, wad_archives)
+        if not frames or not atlas_candidate(texture_name, frames):
+            continue
+        width, height = find_texture_archive(frames[0], wad_archives).miptex_dimensions(frames[0])
+        if width <= max_texture_size and height <= max_texture_size:
+            texture_sizes[texture_name] = (width, height)
+    if len(texture_sizes) < 2:
+        return None
+    return TextureAtlas.pack(texture_sizes, max_sheet_size, padding)
+
+
+# Texels a face may overhang a single texture repeat by and still be atlased (float noise on aligned faces)
+ATLAS_FIT_EPSILON = 1.0 / 64
+
+
+def fit_texture_atlas(map_data, atlas, transform=None, texture_sizes=None, windings=None, epsilon=ATLAS_FIT_EPSILON):
+    """
+    Decides which of atlas's textures map_data can take from the sheets. Source brush UVs tile
+    across the whole sheet, so a texture is only atlased if every face using it spans at most one
+    repeat of it: the texel extents of each face's winding (see clip_brush_windings; computed if
+    not given), projected the way iter_vmf_chunks writes the face (offsets wrapped through
+    texture_sizes), must lie within a single [k * size, (k + 1) * size] span on both axes.
+    Returns (atlas restricted to those textures, (faces, 2) texel offsets that move each of their
+    faces from its repeat k onto the texture's rect, zero for all other faces), or (None, None)
+    if no texture of the map qualifies.
+    """
+    if transform is None:
+        transform = DEFAULT_MAP_TRANSFORM
+    family_names = [texture_family_name(texture_name) for texture_name in map_data.textures]
+    candidates = np.array([family_name in atlas and tool_material(texture_name) is None
+                           for texture_name, family_name in zip(map_data.textures, family_names)], dtype=bool).reshape(-1)
+    face_rows = np.flatnonzero(candidates[map_data.texture_index]) if len(candidates) else np.zeros(0, dtype=np.int64)
+    if not len(face_rows):
+        return None, None
+    if windings is None:
+        windings = clip_brush_windings(map_data)
+    # Per texture: x, y, width and height of its rect on the sheet
+    rects = np.array([atlas.rects[family_name][1:5] if candidate else (0, 0, 1, 1)
+                      for family_name, candidate in zip(family_names, candidates.tolist())], dtype=np.float64)
+    face_rects = rects[map_data.texture_index[face_rows]]
+
+    u_axes, u_scales, u_offsets, v_axes, v_scales, v_offsets = _face_texture_projection(map_data, transform, face_rows)
+    if texture_sizes is not None:
+        sizes = np.array([texture_sizes.get(texture_name, (0, 0)) for texture_name in map_data.textures], dtype=np.float64).reshape(-1, 2)
+        face_sizes = sizes[map_data.texture_index[face_rows]]
+        u_offsets = np.where(face_sizes[:, 0] > 0, np.mod(u_offsets, np.maximum(face_sizes[:, 0], 1)), u_offsets)
+        v_offsets = np.where(face_sizes[:, 1] > 0, np.mod(v_offsets, np.maximum(face_sizes[:, 1], 1)), v_offsets)
+
+    # Texel extents of every face that kept a polygon; faces clipped away are never drawn
+    repeats = np.zeros((len(face_rows), 2))
+    fits = np.ones(len(face_rows), dtype=bool)
+    drawn = np.flatnonzero(windings.face_valid[face_rows])
+    if len(drawn):
+        counts = windings.counts[face_rows[drawn]]
+        corner_faces = np.repeat(drawn, counts)
+        corner_slots = np.arange(len(corner_faces)) - np.repeat(np.cumsum(counts) - counts, counts)
+        corner_points = transform.apply_points(windings.windings[face_rows[corner_faces], corner_slots])
+        corner_texels = np.column_stack([
+            np.einsum('ij,ij->i', corner_points, u_axes[corner_faces]) / u_scales[corner_faces] + u_offsets[corner_faces],
+            np.einsum('ij,ij->i', corner_points, v_axes[corner_faces]) / v_scales[corner_faces] + v_offsets[corner_faces]])
+        starts = np.cumsum(counts) - counts
+        texel_mins = np.minimum.reduceat(corner_texels, starts, axis=0)
+        texel_maxs = np.maximum.reduceat(corner_texels, starts, axis=0)
+        sizes = face_rects[drawn, 2:4]
+        repeats[drawn] = np.floor((texel_mins + epsilon) / sizes)
+        fits[drawn] = np.all(texel_maxs - epsilon <= (repeats[drawn] + 1.0) * sizes, axis=1)
+
+    # A texture is atlased only if all of its faces fit
+    texture_fits = candidates & (np.bincount(map_data.texture_index[face_rows][~fits], minlength=len(candidates)) == 0)
+    if not texture_fits.any():
+        return None, None
+    atlased = texture_fits[map_data.texture_index[face_rows]]
+    texel_offsets = np.zeros((map_data.face_count, 2))
+    texel_offsets[face_rows[atlased]] = face_rects[atlased, 0:2] - repeats[atlased] * face_rects[atlased, 2:4]
+    return atlas.subset(family_name for family_name, fit in zip(family_names, texture_fits.tolist()) if fit), texel_offsets
+
+
+def write_atlas_sheet(atlas, sheet_index, vtf_output_dir, wad_archives, palette=None, log=print):
+    """
+    Composes sheet sheet_index of atlas from the WAD textures (expanded through palette) with
+    wrapped padding and writes it as <vtf_output_dir>/<sheet name>.vtf with the native encoder.
+    """
+    if palette is None:
+        palette = DEFAULT_PALETTE
+    sheet_width, sheet_height = atlas.sheet_sizes[sheet_index]
+    sheet = np.zeros((sheet_height, sheet_width, 4), dtype=np.uint8)
+    padding = atlas.padding
+    for texture_name, (rect_sheet, x, y, width, height) in atlas.rects.items():
+        if rect_sheet != sheet_index:
+            continue
+        wad_archive = find_texture_archive(texture_name, wad_archives)
+        tex_width, tex_height, pixel_data = wad_archive.read_miptex(texture_name)
+        rgba = palette.expand(pixel_data, tex_width, tex_height)
+        sheet[y - padding:y + height + padding, x - padding:x + width + padding] = np.pad(rgba, ((padding, padding), (padding, padding), (0, 0)), mode='wrap')
+        del rgba
+        pixel_data.release()
+
+    sheet_name = atlas.sheet_name(sheet_index)
+    vtf_filepath = os.path.join(vtf_output_dir, f"{sheet_name}.vtf")
+    os.makedirs(vtf_output_dir, exist_ok=True)
+    fd, temp_filepath = tempfile.mkstemp(prefix=".", suffix=".vtf.tmp", dir=vtf_output_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(encode_vtf(sheet))
+        replace_with_temp_file(temp_filepath, vtf_filepath)
+    except OSError as e:
+        try:
+            os.remove(temp_filepath)
+        except OSError:
+            pass
+        log(f"  [ERROR] Could not write atlas sheet '{vtf_filepath}': {e}")
+        return False
+    log(f"  Packed {sum(1 for rect in atlas.rects.values() if rect[0] == sheet_index)} textures into '{vtf_filepath}' ({sheet_width}x{sheet_height}).")
+    return True
+
+
+# WAD indexes and palette owned by a texture worker process (set up by _init_texture_worker)
+_worker_wad_archives = None
+_worker_palette = None
+
+
+def _init_texture_worker(wad_files_paths, palette=None):
+    """Process pool initializer: indexes the WAD files once per worker process."""
+    global _worker_wad_archives, _worker_palette
+    _worker_wad_archives = open_wad_archives(wad_files_paths, lambda message: None)
+    _worker_palette = palette
+
+
+# Texture conversion backends: the built-in VTF encoder, or PNG export plus vtex.exe
+TEXTURE_BACKENDS = ('native', 'vtex')
+
+
+def convert_texture(texture_name, materials_output_dir, vtex_path, s1_game_content_root, wad_archives=None, backend='native', palette=None, frames=None):
+    """
+    Runs the whole pipeline for one texture. The 'native' backend encodes the VTF in-process
+    straight from the WAD (see write_vtf_from_miptex); the 'vtex' backend does WAD decode,
+    PNG encode, vtex.exe conversion and removal of the temporary PNG.
+    Both expand the indices through palette (a Palette; the built-in one if None).
+    An animated texture is converted once for its whole sequence of frames (looked up with
+    texture_animation_frames if None): a multi-frame VTF natively, a sprite sheet with vtex.
+    Console output is captured instead of printed so that concurrent jobs do not interleave.
+    Returns a result dict with 'texture', 'status' ('converted', 'not_extracted',
+    'encode_failed' or 'vtex_failed') and the captured 'messages'.
+    """
+    if wad_archives is None:
+        wad_archives = _worker_wad_archives
+        palette = _worker_palette
+    messages = []
+    if frames is None:
+        frames = texture_animation_frames(texture_name, wad_archives)
+
+    if backend == 'native':
+        if not frames:
+            messages.append(f"  [WARNING] Texture '{texture_name}' not found in any provided WAD files.")
+            return {'texture': texture_name, 'status': 'not_extracted', 'frames': frames, 'messages': messages}
+        converted = write_vtf_from_miptex(texture_name, materials_output_dir, wad_archives, messages.append, palette, frames)
+        return {'texture': texture_name, 'status': 'converted' if converted else 'encode_failed', 'frames': frames, 'messages': messages}
+
+    png_temp_filepath = os.path.join(materials_output_dir, f"{texture_name}.png")
+
+    # 1. Extract to PNG
+    captured_output = io.StringIO()
+    with contextlib.redirect_stdout(captured_output):
+        extracted = extract_and_save_texture_png(texture_name, materials_output_dir, wad_archives, palette, frames)
+    messages.extend(captured_output.getvalue().splitlines())
+    if not extracted:
+        messages.append(f"  Skipping VTF conversion for '{texture_name}' due to failed PNG extraction.")
+        return {'texture': texture_name, 'status': 'not_extracted', 'frames': frames, 'messages': messages}
+
+    # 2. Convert PNG to VTF
+    converted = convert_png_to_vtf(png_temp_filepath, materials_output_dir, vtex_path, s1_game_content_root, messages.append)
+
+    # Remove the temporary PNG after VTF conversion
+    try:
+        os.remove(png_temp_filepath)
+        messages.append(f"  Removed temporary PNG: {os.path.basename(png_temp_filepath)}")
+    except Exception as e:
+        messages.append(f"  [WARNING] Could not remove temporary PNG '{os.path.basename(png_temp_filepath)}': {e}")
+
+    return {'texture': texture_name, 'status': 'converted' if converted else 'vtex_failed', 'frames': frames, 'messages': messages}
+
+
+def convert_textures(texture_names, materials_output_dir, wad_files_paths, vtex_path, s1_game_content_root, workers=None, progress=None, backend='native', palette=None):
+    """
+    Converts many textures concurrently on a bounded process pool of `workers` processes
+    (defaults to the CPU count). Each worker indexes the WADs once and then decodes and
+    encodes its textures with the given backend (see convert_texture), so the encoder,
+    or the slow external vtex.exe, runs in parallel.
+    Animation frames are grouped by family first (see group_texture_families), so every
+    animated texture is read in one pass and converted by a single job under its family name.
+    With workers=1 everything runs in the calling process.
+    progress, if given, is called as progress(done, total) after each texture.
+    Returns the per-texture result dicts (see convert_texture), sorted by texture name.
+    """
+    wad_archives = open_wad_archives(wad_files_paths)
+    try:
+        families = group_texture_families(texture_names, wad_archives)
+        # Dispatch in WAD order so every worker walks its archives forwards
+        texture_names = sort_textures_by_wad_position(families, wad_archives)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, min(workers, len(texture_names)))
+
+        if workers == 1:
+            results = []
+            for texture_name in texture_names:
+                results.append(convert_texture(texture_name, materials_output_dir, vtex_path, s1_game_content_root, wad_archives, backend, palette,
+                                               families[texture_name]))
+                if progress:
+                    progress(len(results), len(texture_names))
+        else:
+            results = []
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_texture_worker,
+                                                        initargs=(wad_files_paths, palette)) as executor:
+                futures = {executor.submit(convert_texture, texture_name, materials_output_dir, vtex_path, s1_game_content_root, None, backend,
+                                           None, families[texture_name]): texture_name
+                           for texture_name in texture_names}
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        results.append({'texture': futures[future], 'status': 'encode_failed' if backend == 'native' else 'vtex_failed',
+                                        'frames': families[futures[future]], 'messages': [f"  [ERROR] Texture worker failed for '{futures[future]}': {e}"]})
+                    if progress:
+                        progress(len(results), len(texture_names))
+    finally:
+        for wad_archive in wad_archives:
+            wad_archive.close()
+
+    return sorted(results, key=lambda result: result['texture'])
+
+
+# Distinct coordinate values a CoordinateFormatter keeps formatted strings for
+COORDINATE_CACHE_SIZE = 65536
+
+
+class CoordinateFormatter:
+    """
+    Formats VMF coordinates (and texture axis values), caching the string of every distinct value.
+    Values are snapped to multiples of grid (if given), rounded to `decimals` places and
+    written in the shortest fixed-point form that reads back as the rounded value ('-72'
+    rather than '-72.000000', '10.5' rather than '10.500000'). Quake coordinates are mostly
+    integers, so a map uses few distinct values and almost every lookup is a cache hit.
+    The cache keeps at most max_entries values, dropping the oldest when full.
+    """
+    def __init__(self, grid=None, decimals=6, max_entries=COORDINATE_CACHE_SIZE):
+        if grid is not None and grid <= 0:
+            raise ValueError(f"Coordinate grid must be positive, got {grid}.")
+        self.grid = grid
+        self.decimals = decimals
+        self.max_entries = max_entries
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def quantize(self, values, decimals=None, snap=True):
+        """Snaps values to the grid (if any and snap is set) and rounds them to decimals (default `decimals`) places."""
+        values = np.asarray(values, dtype=np.float64)
+        if snap and self.grid is not None:
+            values = np.round(values / self.grid) * self.grid
+        return np.round(values, self.decimals if decimals is None else min(decimals, self.decimals)) + 0.0 # + 0.0 folds -0.0 into 0.0
+
+    def format_value(self, value):
+        """The string for one quantized value, from the cache when seen before."""
+        text = self.cache.get(value)
+        if text is not None:
+            self.hits += 1
+            return text
+        self.misses += 1
+        text = f"{value:.{self.decimals}f}".rstrip('0').rstrip('.')
+        if len(self.cache) >= self.max_entries:
+            del self.cache[next(iter(self.cache))] # Dicts keep insertion order, so this is the oldest entry
+        self.cache[value] = text
+        return text
+
+    def format_array(self, values, decimals=None, snap=True):
+        """
+        Formats a whole array of values (quantized as by quantize); returns the strings
+        flattened in row-major order. Values rounded to fewer decimals share the cache, as
+        their trailing zeros are stripped either way.
+        """
+        # Each distinct value of the block is formatted (or looked up) once
+        unique_values, inverse = np.unique(self.quantize(values, decimals, snap).ravel(), return_inverse=True)
+        strings = [self.format_value(value) for value in unique_values.tolist()]
+        return [strings[index] for index in inverse.ravel().tolist()]
+
+
+def _face_texture_projection(map_data, transform, face_rows):
+    """
+    The output-space texture projection of the faces face_rows (an index array) of map_data:
+    Valve220 faces carry their axes, standard faces get them from quake_texture_axes, and both
+    are carried through the transform together.
+    Returns (u axes (N, 3), u scales, u offsets, v axes (N, 3), v scales, v offsets).
+    """
+    face_uv = map_data.uv[face_rows]
+    face_axes = np.array(map_data.axes[face_rows])
+    standard_positions = np.flatnonzero(~map_data.has_axes[face_rows])
+    if len(standard_positions):
+        face_axes[standard_positions] = quake_texture_axes(map_data.points[face_rows[standard_positions]], face_uv[standard_positions])
+    # Like Quake, a zero scale means 1
+    u_scales = np.where(face_uv[:, 3] == 0.0, 1.0, face_uv[:, 3])
+    v_scales = np.where(face_uv[:, 4] == 0.0, 1.0, face_uv[:, 4])
+    u_axes, u_scales, u_offsets = transform.apply_texture_axes(face_axes[:, 0:3], u_scales, face_uv[:, 0])
+    v_axes, v_scales, v_offsets = transform.apply_texture_axes(face_axes[:, 3:6], v_scales, face_uv[:, 1])
+    return u_axes, u_scales, u_offsets, v_axes, v_scales, v_offsets
+
+
+def _transform_face_block(map_data, transform, face_rows, texel_offsets=None, texture_sizes=None, formatter=None):
+    """
+    Maps the faces face_rows (an index array) of map_data into output space, with the texture
+    axes of every face (see _face_texture_projection). The plane points are written through
+    formatter (a CoordinateFormatter; a fresh default one if None).
+    texture_sizes, if given, is a (textures, 2) array of texture (width, height) in texels
+    (zero where unknown) used to wrap the offsets into a single texture repeat.
+    texel_offsets, if given, is a (map faces, 2) array of (u, v) texels added to the texture
+    offsets of each face (used to move faces onto atlas sheets; see fit_texture_atlas).
+    Returns (VMF "plane" strings, [(uaxis, vaxis, rotation) strings per face]).
+    """
+    if formatter is None:
+        formatter = CoordinateFormatter()
+    # The axis remap, scale and any offset are applied to the whole block in one matrix operation
+    coordinates = formatter.format_array(transform.apply_points(map_data.points[face_rows]))
+    face_planes = ["({} {} {}) ({} {} {}) ({} {} {})".format(*coordinates[start:start + 9]) for start in range(0, len(coordinates), 9)]
+
+    u_axes, u_scales, u_offsets, v_axes, v_scales, v_offsets = _face_texture_projection(map_data, transform, face_rows)
+    face_uv = map_data.uv[face_rows]
+    face_texture_index = map_data.texture_index[face_rows]
+    if texture_sizes is not None:
+        face_sizes = texture_sizes[face_texture_index]
+        u_offsets = np.where(face_sizes[:, 0] > 0, np.mod(u_offsets, np.maximum(face_sizes[:, 0], 1)), u_offsets)
+        v_offsets = np.where(face_sizes[:, 1] > 0, np.mod(v_offsets, np.maximum(face_sizes[:, 1], 1)), v_offsets)
+    if texel_offsets is not None:
+        face_texel_offsets = texel_offsets[face_rows]
+        u_offsets = u_offsets + face_texel_offsets[:, 0]
+        v_offsets = v_offsets + face_texel_offsets[:, 1]
+
+    # Texture axes go through the same string cache, unsnapped: axes and scales at 6 decimals, offsets at 4
+    axis_values = formatter.format_array(np.column_stack([u_axes, u_scales, v_axes, v_scales]), snap=False)
+    offset_values = formatter.format_array(np.column_stack([u_offsets, v_offsets]), decimals=4, snap=False)
+    face_uv_axes = [(f"[{axis_values[8 * face]} {axis_values[8 * face + 1]} {axis_values[8 * face + 2]} {offset_values[2 * face]}] {axis_values[8 * face + 3]}",
+                     f"[{axis_values[8 * face + 4]} {axis_values[8 * face + 5]} {axis_values[8 * face + 6]} {offset_values[2 * face + 1]}] {axis_values[8 * face + 7]}",
+                     f"{rotation:g}")
+                    for face, rotation in enumerate(face_uv[:, 2].tolist())]
+    return face_planes, face_uv_axes
+
+
+def _brush_face_rows(map_data, brush_indices):
+    """Face rows of the brushes brush_indices, concatenated in order, as one index array."""
+    starts = map_data.brush_offsets[brush_indices]
+    counts = map_data.brush_offsets[brush_indices + 1] - starts
+    # Each brush's run starts where the previous one ended: shift a single arange per run
+    return np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(int(counts.sum()), dtype=np.int64)
+
+
+def _append_solids(vmf_lines, map_data, brush_indices, transform, materials, texel_offsets, texture_sizes, formatter, current_id):
+    """
+    Appends a VMF solid block for every brush in brush_indices to vmf_lines.
+    Returns the next free id.
+    """
+    texture_index = map_data.texture_index
+    face_rows = _brush_face_rows(map_data, brush_indices)
+    face_planes, face_uv_axes = _transform_face_block(map_data, transform, face_rows, texel_offsets, texture_sizes, formatter)
+    face_texture_indices = texture_index[face_rows].tolist()
+    brush_offsets = map_data.brush_offsets
+    position = 0
+
+    # Iterate through each brush parsed from the Quake map
+    for brush_idx in brush_indices.tolist():
+        vmf_lines.append("    solid")
+        vmf_lines.append("    {")
+        vmf_lines.append(f"        \"id\" \"{current_id}\"")
+        current_id += 1
+
+        # Iterate through each plane (side) of the current brush
+        for _ in range(int(brush_offsets[brush_idx + 1] - brush_offsets[brush_idx])):
+            vmf_lines.append("        side")
+            vmf_lines.append("        {")
+            vmf_lines.append(f"            \"id\" \"{current_id}\"")
+            current_id += 1
+
+            # VMF plane string: "(x1 y1 z1) (x2 y2 z2) (x3 y3 z3)"
+            vmf_lines.append(f"            \"plane\" \"{face_planes[position]}\"")
+
+            # Assign the original Quake texture name.
+            # Source 1 VMFs typically reference materials without the 'materials/' prefix and without '.vtf' extension.
+            # Hammer will look for 'materials/TEXTURE_NAME.vtf' in the game's content.
+            face_texture_index = face_texture_indices[position]
+            vmf_lines.append(f"            \"material\" \"{materials[face_texture_index]}\"")
+
+            # Texture axes solved from the Quake alignment, carried through the map transform
+            uaxis, vaxis, rotation = face_uv_axes[position]
+            vmf_lines.append(f"            \"uaxis\" \"{uaxis}\"")
+            vmf_lines.append(f"            \"vaxis\" \"{vaxis}\"")
+            vmf_lines.append(f"            \"rotation\" \"{rotation}\"")
+            vmf_lines.append("            \"lightmapscale\" \"16\"") # Default lightmap scale for lightmap grid
+            vmf_lines.append("            \"smoothing_groups\" \"0\"")
+            vmf_lines.append("        }") # End side
+            position += 1
+
+        # Editor block for solid (brush) in VMF
+        vmf_lines.append("        \"editor\"")
+        vmf_lines.append("        {")
+        vmf_lines.append("            \"color\" \"255 0 0\"") # Default brush color in Hammer (Red)
+        vmf_lines.append("            \"visgroupshown\" \"1\"") # Brush visible in Hammer
+        vmf_lines.append("            \"visgroupautoshown\" \"1\"") # Brush auto-visible
+        vmf_lines.append("        }")
+        vmf_lines.append("    }") # End solid
+    return current_id
+
+
+def angle_vectors(angles):
+    """
+    Forward and up unit vectors ((N, 3) each) of (N, 3) "pitch yaw roll" angles in degrees, as
+    Quake's and Source's AngleVectors compute them (positive pitch looks down).
+    """
+    pitch, yaw, roll = np.radians(np.asarray(angles, dtype=np.float64).reshape(-1, 3)).T
+    sp, cp, sy, cy, sr, cr = np.sin(pitch), np.cos(pitch), np.sin(yaw), np.cos(yaw), np.sin(roll), np.cos(roll)
+    forward = np.column_stack([cp * cy, cp * sy, -sp])
+    up = np.column_stack([cr * sp * cy + sr * sy, cr * sp * sy - sr * cy, cr * cp])
+    return forward, up
+
+
+def vector_angles(forward, up):
+    """
+    The inverse of angle_vectors: "pitch yaw roll" degrees ((N, 3)) of unit forward and up vectors.
+    Straight up or down the yaw is taken from the up vector and the roll is zero.
+    """
+    forward = np.asarray(forward, dtype=np.float64).reshape(-1, 3)
+    up = np.asarray(up, dtype=np.float64).reshape(-1, 3)
+    pitch = np.arcsin(np.clip(-forward[:, 2], -1.0, 1.0))
+    sp, cp = np.sin(pitch), np.cos(pitch)
+    vertical = cp < 1e-6
+    yaw = np.where(vertical, np.arctan2(up[:, 1] * sp, up[:, 0] * sp), np.arctan2(forward[:, 1], forward[:, 0]))
+    sy, cy = np.sin(yaw), np.cos(yaw)
+    # up = cos(roll) * (sp cy, sp sy, cp) + sin(roll) * (sy, -cy, 0)
+    roll = np.where(vertical, 0.0, np.arctan2(up[:, 0] * sy - up[:, 1] * cy, up[:, 0] * sp * cy + up[:, 1] * sp * sy + up[:, 2] * cp))
+    return np.degrees(np.column_stack([pitch, yaw, roll]))
+
+
+def transform_entity_angles(angles, transform):
+    """
+    Turns (N, 3) "pitch yaw roll" directions with the rotation and axis remap of transform (its
+    linear part without the scale), so that entities face and move the same way relative to
+    their converted brushes. Returns (N, 3) angles with yaw in [0, 360).
+    """
+    rotation = transform.linear / np.cbrt(abs(np.linalg.det(transform.linear)))
+    forward, up = angle_vectors(angles)
+    forward, up = forward @ rotation.T, up @ rotation.T
+    forward /= np.linalg.norm(forward, axis=1)[:, None]
+    up /= np.linalg.norm(up, axis=1)[:, None]
+    turned = vector_angles(forward, up)
+    turned[:, 1] = np.mod(turned[:, 1], 360.0)
+    return turned
+
+
+def _entity_output_keyvalues(entities, transform, formatter=None):
+    """
+    The Source key-values of every MapEntity in entities with the map transform applied:
+    'origin' is mapped into output space and the ENTITY_DIRECTION_KEYS (including those
+    converted from Quake's 'angle') are turned with it (see transform_entity_angles), all
+    entities in one matrix operation each. Both are written through formatter (the brush
+    planes' CoordinateFormatter, so origins snap and round like the brushes they line up
+    with; a default one if None). Returns one dict per entity.
+    """
+    if formatter is None:
+        formatter = CoordinateFormatter()
+    entity_keyvalues = [dict(entity.source_keyvalues) for entity in entities]
+    origin_entities, origins = [], []
+    for entity_index, keyvalues in enumerate(entity_keyvalues):
+        try:
+            origin = [float(c) for c in keyvalues.get('origin', '').split()]
+        except ValueError:
+            continue
+        if len(origin) == 3:
+            origin_entities.append(entity_index)
+            origins.append(origin)
+    if origins:
+        coordinates = formatter.format_array(transform.apply_points(origins))
+        for position, entity_index in enumerate(origin_entities):
+            entity_keyvalues[entity_index]['origin'] = " ".join(coordinates[3 * position:3 * position + 3])
+    # A transform that only scales or translates leaves directions as they are
+    rotation = transform.linear / np.cbrt(abs(np.linalg.det(transform.linear)))
+    if not np.allclose(rotation, np.eye(3)):
+        direction_keys, directions = [], []
+        for keyvalues in entity_keyvalues:
+            for key in ENTITY_DIRECTION_KEYS:
+                try:
+                    direction = [float(c) for c in keyvalues.get(key, '').split()]
+                except ValueError:
+                    continue
+                if len(direction) == 3:
+                    direction_keys.append((keyvalues, key))
+                    directions.append(direction)
+        if directions:
+            angles = formatter.quantize(transform_entity_angles(directions, transform), snap=False)
+            angles[:, 1] = np.mod(angles[:, 1], 360.0) # A yaw just below 360 can round up to it
+            angle_values = formatter.format_array(angles, snap=False)
+            for position, (keyvalues, key) in enumerate(direction_keys):
+                keyvalues[key] = " ".join(angle_values[3 * position:3 * position + 3])
+    return entity_keyvalues
+
+
+# Brushes formatted per chunk by iter_vmf_chunks; bounds the transient strings per write
+VMF_BRUSHES_PER_CHUNK = 256
+
+
+# Source classnames of player spawns; a map without any gets a default info_player_start
+PLAYER_START_CLASSNAMES = ('info_player_start', 'info_player_deathmatch')
+
+
+def iter_vmf_chunks(map_data, transform=None, atlas=None, texture_sizes=None, formatter=None, windings=None):
+    """
+    Generates the content for a Source 1 .vmf file from the parsed Quake map data (a MapGeometry)
+    as a sequence of text chunks, VMF_BRUSHES_PER_CHUNK solids at a time, so that memory use
+    does not grow with the size of the map. Concatenated, the chunks form the complete file.
+    Geometry is mapped into output space by transform (a MapTransform; DEFAULT_MAP_TRANSFORM if None).
+    Brush faces will be assigned their original Quake texture names (for VTF lookup); animated
+    texture frames are assigned the first frame of their sequence, and Quake tool textures (clip,
+    trigger, sky) and hidden faces their Source tool material (see tool_material). Textures packed into atlas
+    (a TextureAtlas) are assigned their sheet, with the texture offsets moved onto their rect, if
+    none of their faces tile past one repeat (see fit_texture_atlas, which uses windings if given).
+    Texture axes are solved from each face's Quake alignment (see _transform_face_block);
+    texture_sizes maps texture names to their (width, height) in the WADs, used to wrap the
+    offsets into one texture repeat. Plane coordinates are written through formatter (a
+    CoordinateFormatter, shared by all the chunks; a default one if None).
+    Worldspawn brushes go into the world block; every other entity is written with its mapped
+    Source classname and key-values (see MapEntity) and the brushes it owns. Maps without a
+    player spawn get a basic info_player_start; an empty hidden block is added for VMF validity.
+    """
+    vmf_lines = []
+    
+    # VMF header information
+    vmf_lines.append("versioninfo")
+    vmf_lines.append("{")
+    vmf_lines.append("    \"mapversion\" \"1\"")
+    vmf_lines.append("    \"editorversion\" \"400\"")
+    vmf_lines.append("    \"editorbuild\" \"8000\"")
+    vmf_lines.append("    \"formatversion\" \"1\"")
+    vmf_lines.append("    \"prefab\" \"0\"")
+    vmf_lines.append("}")
+
+    # Quake uses Z-up, Source (1 and 2) typically Y-up; see MapTransform
+    if transform is None:
+        transform = DEFAULT_MAP_TRANSFORM
+    if formatter is None:
+        formatter = CoordinateFormatter()
+    entity_keyvalues = _entity_output_keyvalues(map_data.entities, transform, formatter)
+    world_entity_index = map_data.world_entity_index
+
+    # Worldspawn entity block
+    vmf_lines.append("world")
+    vmf_lines.append("{")
+    vmf_lines.append("    \"id\" \"1\"") # Worldspawn typically has ID 1
+    vmf_lines.append("    \"mapversion\" \"1\"")
+    vmf_lines.append("    \"classname\" \"worldspawn\"")
+    if world_entity_index < len(entity_keyvalues):
+        for key, value in entity_keyvalues[world_entity_index].items():
+            vmf_lines.append(f"    \"{key}\" \"{value}\"")
+
+    # Unique ID counter for solids (brushes) and sides, starting after worldspawn's ID 1
+    current_id = 2 
+
+    # Material names are upper-cased once per texture
+    # Animation frames all use the material of their sequence (see texture_family_name)
+    # Clip, trigger and sky textures and hidden faces are tagged with Source tool materials (see tool_material)
+    materials = [tool_material(texture_name) or texture_family_name(texture_name).upper() for texture_name in map_data.textures]
+    texel_offsets = None
+    if atlas is not None:
+        atlas, texel_offsets = fit_texture_atlas(map_data, atlas, transform, texture_sizes, windings)
+    if atlas is not None:
+        for index, texture_name in enumerate(map_data.textures):
+            family_name = texture_family_name(texture_name)
+            if family_name in atlas and tool_material(texture_name) is None:
+                materials[index] = atlas.material(family_name).upper()
+    if texture_sizes is not None:
+        texture_sizes = np.array([texture_sizes.get(texture_name, (0, 0)) for texture_name in map_data.textures], dtype=np.float64).reshape(-1, 2)
+
+    world_brushes = map_data.entity_brushes(world_entity_index)
+    for chunk_start in range(0, len(world_brushes), VMF_BRUSHES_PER_CHUNK):
+        current_id = _append_solids(vmf_lines, map_data, world_brushes[chunk_start:chunk_start + VMF_BRUSHES_PER_CHUNK],
+                                    transform, materials, texel_offsets, texture_sizes, formatter, current_id)
+        # Hand the finished chunk to the writer and start a new one
+        yield "\n".join(vmf_lines) + "\n"
+        vmf_lines = []
+
+    # Editor block for worldspawn in VMF
+    vmf_lines.append("    \"editor\"")
+    vmf_lines.append("    {")
+    vmf_lines.append("        \"color\" \"255 0 0\"")
+    vmf_lines.append("        \"visgroupshown\" \"1\"")
+    vmf_lines.append("        \"visgroupautoshown\" \"1\"")
+    vmf_lines.append("        \"logicalpos\" \"[0 0]\"")
+    vmf_lines.append("    }")
+    vmf_lines.append("}") # End world
+
+    # Point and brush entities, with the brushes they own
+    for entity_index, entity in enumerate(map_data.entities):
+        if entity_index == world_entity_index:
+            continue
+        vmf_lines.append("entity")
+        vmf_lines.append("{")
+        vmf_lines.append(f"    \"id\" \"{current_id}\"")
+        current_id += 1
+        vmf_lines.append(f"    \"classname\" \"{entity.classname}\"")
+        for key, value in entity_keyvalues[entity_index].items():
+            vmf_lines.append(f"    \"{key}\" \"{value}\"")
+        entity_brushes = map_data.entity_brushes(entity_index)
+        for chunk_start in range(0, len(entity_brushes), VMF_BRUSHES_PER_CHUNK):
+            current_id = _append_solids(vmf_lines, map_data, entity_brushes[chunk_start:chunk_start + VMF_BRUSHES_PER_CHUNK],
+                                        transform, materials, texel_offsets, texture_sizes, formatter, current_id)
+        vmf_lines.append("    \"editor\"")
+        vmf_lines.append("    {")
+        vmf_lines.append("        \"color\" \"220 30 220\"") # Hammer's default entity color
+        vmf_lines.append("        \"visgroupshown\" \"1\"")
+        vmf_lines.append("        \"visgroupautoshown\" \"1\"")
+        vmf_lines.append("        \"logicalpos\" \"[0 0]\"")
+        vmf_lines.append("    }")
+        vmf_lines.append("}")
+        if len(vmf_lines) > 64 * VMF_BRUSHES_PER_CHUNK:
+            yield "\n".join(vmf_lines) + "\n"
+            vmf_lines = []
+
+    if not any(entity.classname in PLAYER_START_CLASSNAMES for entity in map_data.entities):
+        # Add a minimal info_player_start entity
+        vmf_lines.append("entity")
+        vmf_lines.append("{")
+        vmf_lines.append(f"    \"id\" \"{current_id}\"")
+        current_id += 1
+        vmf_lines.append("    \"classname\" \"info_player_start\"")
+        # Default spawn point and orientation, 64 units above the Quake origin facing +X, mapped like the map's entities
+        spawn_keyvalues = _entity_output_keyvalues([MapEntity({'origin': "0 0 64", 'angles': "0 0 0"})], transform, formatter)[0]
+        vmf_lines.append(f"    \"origin\" \"{spawn_keyvalues['origin']}\"")
+        vmf_lines.append(f"    \"angles\" \"{spawn_keyvalues['angles']}\"")
+        vmf_lines.append("    \"editor\"")
+        vmf_lines.append("    {")
+        vmf_lines.append("        \"color\" \"255 255 0\"") # Yellow for player start
+        vmf_lines.append("        \"visgroupshown\" \"1\"")
+        vmf_lines.append("        \"visgroupautoshown\" \"1\"")
+        vmf_lines.append("        \"logicalpos\" \"[0 0]\"")
+        vmf_lines.append("    }")
+        vmf_lines.append("}")
+
+    # Add an empty hidden block (often present in VMFs)
+    vmf_lines.append("hidden")
+    vmf_lines.append("{")
+    vmf_lines.append("}")
+
+    yield "\n".join(vmf_lines)
+
+
+def generate_vmf_content(map_data, transform=None, atlas=None, texture_sizes=None, formatter=None, windings=None):
+    """
+    Generates the complete .vmf text in memory (see iter_vmf_chunks).
+    write_vmf streams the same content to disk without holding it all at once.
+    """
+    return "".join(iter_vmf_chunks(map_data, transform, atlas, texture_sizes, formatter, windings))
+
+
+def write_vmf(map_data, vmf_filepath, transform=None, atlas=None, texture_sizes=None, formatter=None, windings=None):
+    """
+    Streams the .vmf for map_data into vmf_filepath through a buffered file handle.
+    The content is written to a temporary file in the same directory and renamed over the
+    target once complete, so an interrupted run never leaves a truncated .vmf behind.
+    """
+    fd, temp_filepath = tempfile.mkstemp(prefix=".", suffix=".vmf.tmp", dir=os.path.dirname(vmf_filepath) or ".")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for chunk in iter_vmf_chunks(map_data, transform, atlas, texture_sizes, formatter, windings):
+                f.write(chunk)
+        replace_with_temp_file(temp_filepath, vmf_filepath)
+    except BaseException:
+        try:
+            os.remove(temp_filepath)
+        except OSError:
+            pass
+        raise
+
+
+# Grid size, in output units, of the spatial hash that welds mesh vertices together
+MESH_WELD_EPSILON = 1.0 / 64
+
+
+def weld_points(points, epsilon=MESH_WELD_EPSILON):
+    """
+    Welds an (N, 3) array of points through a spatial hash of epsilon-sized grid cells: all
+    points rounding to the same cell become one vertex (the first of them).
+    Returns (vertices (V, 3), index (N,) of the vertex each point was welded to).
+    """
+    cells = np.floor(np.asarray(points) / epsilon + 0.5).astype(np.int64)
+    _, first, inverse = np.unique(cells, axis=0, return_index=True, return_inverse=True)
+    return points[first], inverse.reshape(-1)
+
+
+def _is_convex_polygon(polygon, vertices, normal):
+    """True if the vertex-index polygon turns the same way (or goes straight) at every corner."""
+    points = vertices[polygon]
+    edges = np.roll(points, -1, axis=0) - points
+    turns = np.cross(edges, np.roll(edges, -1, axis=0)) @ normal
+    # Turns are compared relative to the edge lengths, so collinear joints count as straight
+    tolerance = 1e-6 * np.linalg.norm(edges, axis=1) * np.linalg.norm(np.roll(edges, -1, axis=0), axis=1)
+    return bool(np.all(turns <= tolerance) or np.all(turns >= -tolerance))
+
+
+def _try_merge_polygons(polygon_a, polygon_b, vertices, normal):
+    """
+    Merges two coplanar vertex-index polygons sharing an edge (run in opposite directions, as
+    adjacent faces of the same plane do), like qbsp's TryMergeWinding. Returns the merged
+    polygon, or None if they share no edge or their union is not convex. Vertices at the joint
+    are kept even where they become collinear, so faces meeting them stay watertight.
+    """
+    edges_a = {(polygon_a[i], polygon_a[(i + 1) % len(polygon_a)]): i for i in range(len(polygon_a))}
+    for j in range(len(polygon_b)):
+        i = edges_a.get((polygon_b[(j + 1) % len(polygon_b)], polygon_b[j]))
+        if i is not None:
+            break
+    else:
+        return None
+    # a's edge i runs p -> q and b's edge j runs q -> p: walk a from q round to p, then b from p round to q
+    rotated_b = polygon_b[j + 1:] + polygon_b[:j + 1]
+    merged = polygon_a[i + 1:] + polygon_a[:i + 1] + rotated_b[1:-1]
+    if len(set(merged)) != len(merged) or not _is_convex_polygon(merged, vertices, normal):
+        return None
+    return merged
+
+
+def _merge_coplanar_polygons(polygons, vertices, normal):
+    """Repeatedly merges the polygons of one plane and material until no pair can be merged."""
+    polygons = list(polygons)
+    merged_any = True
+    while merged_any:
+        merged_any = False
+        for a in range(len(polygons)):
+            for b in range(a + 1, len(polygons)):
+                merged = _try_merge_polygons(polygons[a], polygons[b], vertices, normal)
+                if merged is not None:
+                    polygons[a] = merged
+                    del polygons[b]
+                    merged_any = True
+                    break
+            if merged_any:
+                break
+    return polygons
+
+
+class MapMesh:
+    """
+    Render mesh of a map's world brushes, built by build_map_mesh.
+      vertices   float64 (V, 3)  welded positions in output space
+      uvs        float64 (T, 2)  welded texture coordinates, in texture repeats (v pointing up)
+      normals    float64 (K, 3)  unit normals of the merged planes
+      materials  list of str     material of every batch
+      batches    list of lists   per material, its polygons as (vertex, uv, normal) index lists,
+                                 counter-clockwise seen from the front
+      source_faces, source_corners  face and corner counts before merging and welding
+    """
+    def __init__(self, vertices, uvs, normals, materials, batches, source_faces, source_corners):
+        self.vertices = vertices
+        self.uvs = uvs
+        self.normals = normals
+        self.materials = materials
+        self.batches = batches
+        self.source_faces = source_faces
+        self.source_corners = source_corners
+
+    @property
+    def polygon_count(self):
+        """Number of polygons after merging."""
+        return sum(len(batch) for batch in self.batches)
+
+
+def build_map_mesh(map_data, transform=None, texture_sizes=None, windings=None, weld_epsilon=MESH_WELD_EPSILON):
+    """
+    Builds the render mesh (a MapMesh) of map_data's world brushes from their clipped windings
+    (see clip_brush_windings; computed if not given), mapped through transform.
+    Faces on the same plane with the same material and texture alignment are merged into larger
+    convex polygons, vertices are welded through a spatial hash of weld_epsilon cells, and the
+    polygons are batched by material. Entity brushes stay in the .vmf, as do faces emitted as
+    tool materials (see tool_material), such as clips, sky and hidden faces.
+    texture_sizes maps texture names to their (width, height), used to turn texel coordinates
+    into texture repeats (textures of unknown size keep texels).
+    """
+    if transform is None:
+        transform = DEFAULT_MAP_TRANSFORM
+    if windings is None:
+        windings = clip_brush_windings(map_data)
+    materials = [texture_family_name(texture_name).lower() for texture_name in map_data.textures]
+    texture_valid = np.array([tool_material(texture_name) is None for texture_name in map_data.textures], dtype=bool)
+
+    world_brushes = map_data.entity_brushes(map_data.world_entity_index)
+    world_brushes = world_brushes[windings.valid_brushes[world_brushes]]
+    face_rows = _brush_face_rows(map_data, world_brushes)
+    face_rows = face_rows[windings.face_valid[face_rows] & texture_valid[map_data.texture_index[face_rows]]]
+
+    # Plane normals follow the inverse transpose of the linear part; a mirroring transform flips the winding order
+    normals, distances = map_data.planes()
+    normals = normals[face_rows] @ np.linalg.inv(transform.linear)
+    normals /= np.linalg.norm(normals, axis=1)[:, None]
+    distances = np.einsum('ij,ij->i', normals, transform.apply_points(windings.windings[face_rows, 0]))
+    # Quake windings run clockwise seen from the front; OBJ faces run counter-clockwise
+    reverse_order = np.linalg.det(transform.linear) > 0.0
+
+    counts = windings.counts[face_rows]
+    corner_faces = np.repeat(np.arange(len(face_rows)), counts)
+    corner_slots = np.arange(len(corner_faces)) - np.repeat(np.cumsum(counts) - counts, counts)
+    corner_points = transform.apply_points(windings.windings[face_rows[corner_faces], corner_slots])
+    vertices, corner_vertices = weld_points(corner_points, weld_epsilon)
+
+    # Faces merge only within a group sharing material, plane and texture projection
+    u_axes, u_scales, u_offsets, v_axes, v_scales, v_offsets = _face_texture_projection(map_data, transform, face_rows)
+    face_texture_index = map_data.texture_index[face_rows]
+    face_sizes = np.ones((len(face_rows), 2))
+    if texture_sizes is not None:
+        sizes = np.array([texture_sizes.get(texture_name, (0, 0)) for texture_name in map_data.textures], dtype=np.float64).reshape(-1, 2)
+        face_sizes = np.where(sizes[face_texture_index] > 0, sizes[face_texture_index], 1.0)
+    face_materials = np.array([materials[index] for index in face_texture_index.tolist()], dtype=object)
+    material_ids = np.unique(face_materials, return_inverse=True)[1].reshape(-1) if len(face_rows) else np.zeros(0, dtype=np.int64)
+    group_keys = np.column_stack([material_ids, np.round(normals * 1e4), np.round(distances * 1e2),
+                                  np.round(u_axes * 1e4), np.round(u_scales * 1e4), np.round(np.mod(u_offsets, face_sizes[:, 0]) * 1e2),
+                                  np.round(v_axes * 1e4), np.round(v_scales * 1e4), np.round(np.mod(v_offsets, face_sizes[:, 1]) * 1e2)])
+    _, group_first, face_groups = np.unique(group_keys, axis=0, return_index=True, return_inverse=True)
+    face_groups = face_groups.reshape(-1)
+
+    corner_offsets = np.concatenate(([0], np.cumsum(counts))).tolist()
+    corner_vertex_list = corner_vertices.tolist()
+    group_polygons = [[] for _ in range(len(group_first))]
+    for face, group in enumerate(face_groups.tolist()):
+        polygon = corner_vertex_list[corner_offsets[face]:corner_offsets[face + 1]]
+        group_polygons[group].append(polygon[::-1] if reverse_order else polygon)
+
+    # Polygons take their texture coordinates from the projection of the group's first face
+    batch_polygons = {}
+    polygon_groups = []
+    for group, first_face in enumerate(group_first.tolist()):
+        for polygon in _merge_coplanar_polygons(group_polygons[group], vertices, normals[first_face]):
+            # Drop the welded repeats of points closer than the weld epsilon
+            polygon = [vertex for position, vertex in enumerate(polygon) if vertex != polygon[position - 1]]
+            if len(polygon) >= 3:
+                batch_polygons.setdefault(face_materials[first_face], []).append(len(polygon_groups))
+                polygon_groups.append((group, first_face, polygon))
+
+    polygon_corner_vertices = np.array([vertex for _, _, polygon in polygon_groups for vertex in polygon], dtype=np.int64)
+    polygon_corner_faces = np.repeat([first_face for _, first_face, _ in polygon_groups], [len(polygon) for _, _, polygon in polygon_groups]).astype(np.int64)
+    corner_positions = vertices[polygon_corner_vertices]
+    corner_uvs = np.column_stack([
+        (np.einsum('ij,ij->i', corner_positions, u_axes[polygon_corner_faces]) / u_scales[polygon_corner_faces] + u_offsets[polygon_corner_faces]) / face_sizes[polygon_corner_faces, 0],
+        -(np.einsum('ij,ij->i', corner_positions, v_axes[polygon_corner_faces]) / v_scales[polygon_corner_faces] + v_offsets[polygon_corner_faces]) / face_sizes[polygon_corner_faces, 1],
+    ]).reshape(-1, 2)
+    uvs, corner_uv_index = np.unique(np.round(corner_uvs, 6) + 0.0, axis=0, return_inverse=True)
+    mesh_normals, group_normal_index = np.unique(np.round(normals[group_first], 6) + 0.0, axis=0, return_inverse=True)
+    corner_uv_index = corner_uv_index.reshape(-1).tolist()
+    group_normal_index = group_normal_index.reshape(-1).tolist()
+
+    polygon_starts = np.concatenate(([0], np.cumsum([len(polygon) for _, _, polygon in polygon_groups]))).tolist()
+    mesh_materials = sorted(batch_polygons)
+    batches = []
+    for material in mesh_materials:
+        batch = []
+        for polygon_index in batch_polygons[material]:
+            group, _, polygon = polygon_groups[polygon_index]
+            start = polygon_starts[polygon_index]
+            normal_index = group_normal_index[group]
+            batch.append([(vertex, corner_uv_index[start + position], normal_index) for position, vertex in enumerate(polygon)])
+        batches.append(batch)
+    return MapMesh(vertices.reshape(-1, 3), uvs.reshape(-1, 2), mesh_normals.reshape(-1, 3), mesh_materials, batches, len(face_rows), len(corner_points))
+
+
+def write_obj(mesh, obj_filepath):
     """
-    Parses a Quake .map file to extract brush geometry (planes) and their original texture names.
-    It identifies brush blocks within entities and accurately extracts all brush planes,
-    ignoring other entity properties like key-value pairs.
+    Writes a MapMesh as a Wavefront .obj, with a .mtl next to it naming one material per batch,
+    for import into Source 2 Hammer as a mesh. One group with a single usemtl is written per
+    material. Both files are written through temporary files renamed into place.
     """
-    brushes = []          # List to store all parsed brushes, each containing its planes
-    unique_textures = set() # To collect all unique texture names
-    current_brush_planes = [] # List to store planes for the current brush being parsed
-    
-    # State flags to correctly identify entity and brush blocks within the .map file
-    in_entity_block = False
-    
-    try:
-        with open(map_filepath, 'r') as f:
-            print(f"  Attempting to parse map file: {map_filepath}")
-            for line_num, line in enumerate(f, 1):
-                stripped_line = line.strip()
+    mtl_filepath = os.path.splitext(obj_filepath)[0] + ".mtl"
+    obj_lines = [f"mtllib {os.path.basename(mtl_filepath)}"]
+    obj_lines.extend(f"v {x:.6f} {y:.6f} {z:.6f}" for x, y, z in mesh.vertices.tolist())
+    obj_lines.extend(f"vt {u:.6f} {v:.6f}" for u, v in mesh.uvs.tolist())
+    obj_lines.extend(f"vn {x:.6f} {y:.6f} {z:.6f}" for x, y, z in mesh.normals.tolist())
+    mtl_lines = []
+    for material, batch in zip(mesh.materials, mesh.batches):
+        obj_lines.append(f"g {material}")
+        obj_lines.append(f"usemtl {material}")
+        # OBJ indices are 1-based
+        obj_lines.extend("f " + " ".join(f"{vertex + 1}/{uv + 1}/{normal + 1}" for vertex, uv, normal in polygon) for polygon in batch)
+        mtl_lines.extend([f"newmtl {material}", "Kd 1.000000 1.000000 1.000000", ""])
 
-                # Skip comments and empty lines for cleaner parsing
-                if not stripped_line or stripped_line.startswith('//'):
-                    continue
+    for filepath, lines in ((mtl_filepath, mtl_lines), (obj_filepath, obj_lines)):
+        fd, temp_filepath = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=os.path.dirname(filepath) or ".")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write("\n".join(lines) + "\n")
+            replace_with_temp_file(temp_filepath, filepath)
+        except BaseException:
+            try:
+                os.remove(temp_filepath)
+            except OSError:
+                pass
+            raise
 
-                if stripped_line == '{':
-                    if not in_entity_block:
-                        # This marks the beginning of a top-level entity (e.g., worldspawn)
-                        in_entity_block = True
-                        current_brush_planes = [] # Reset for potential new brush
-                    else:
-                        # This marks the beginning of a brush block within an entity
-                        current_brush_planes = [] # Initialize list for planes of this new brush
-                elif stripped_line == '}':
-                    if current_brush_planes:
-                        # If current_brush_planes has planes, it's a completed brush
-                        brushes.append(current_brush_planes)
-                        current_brush_planes = [] # Reset for next brush
-                    elif in_entity_block:
-                        # End of an entity block
-                        in_entity_block = False
-                else:
-                    # If inside an entity block, attempt to parse a plane definition
-                    if in_entity_block:
-                        # Regex to extract three 3D points and the texture name.
-                        # ( x1 y1 z1 ) ( x2 y2 z2 ) ( x3 y3 z3 ) TEXTURE_NAME [ ux uy uz offsetX ] [ vx vy vz offsetY ] rotation scaleX scaleY
-                        plane_match = re.match(r'\(\s*([\d\.\-]+)\s+([\d\.\-]+)\s+([\d\.\-]+)\s*\)\s*\(\s*([\d\.\-]+)\s+([\d\.\-]+)\s+([\d\.\-]+)\s*\)\s*\(\s*([\d\.\-]+)\s+([\d\.\-]+)\s+([\d\.\-]+)\s*\)\s*([^\s]+).*', stripped_line)
-                        if plane_match:
-                            # Extract and convert points to floats
-                            p1 = (float(plane_match.group(1)), float(plane_match.group(2)), float(plane_match.group(3)))
-                            p2 = (float(plane_match.group(4)), float(plane_match.group(5)), float(plane_match.group(6)))
-                            p3 = (float(plane_match.group(7)), float(plane_match.group(8)), float(plane_match.group(9)))
-                            texture_name = plane_match.group(10).lower() # Get texture name and convert to lowercase
-
-                            current_brush_planes.append({
-                                'plane': (p1, p2, p3),
-                                'texture': texture_name # Re-including texture name here
-                            })
-                            unique_textures.add(texture_name) # Add to unique textures set
-                        # Lines not matching a plane within a brush block are ignored (e.g., UV/lightmap data or entity properties)
-        
-        # Add any remaining brush planes if the file ends abruptly without a closing brace
-        if current_brush_planes:
-            brushes.append(current_brush_planes)
 
-        print(f"  Finished parsing {map_filepath}. Found {len(brushes)} brushes and {len(unique_textures)} unique textures.")
-        return brushes, list(unique_textures)
-    except FileNotFoundError:
-        print(f"[ERROR] Map file not found: {map_filepath}")
-        return [], []
-    except Exception as e:
-        print(f"[ERROR] An error occurred while parsing {map_filepath}: {e}")
-        return [], []
+def convert_map(map_filepath, maps_output_dir, transform=None, atlas=None, texture_sizes=None, export_mesh=False, optimize=True, coordinate_grid=None):
+    """
+    Parses a single Quake .map file and writes its Source 1 .vmf into maps_output_dir,
+    mapping the geometry through transform and textures through atlas and texture_sizes
+    (see iter_vmf_chunks). With optimize, adjacent box brushes are merged and hidden faces
+    set to nodraw first (see optimize_map_geometry). Plane coordinates are snapped to
+    multiples of coordinate_grid output units if given (see CoordinateFormatter). With export_mesh, the world brushes are also written as a
+    Source 2 importable .obj/.mtl pair next to it (see build_map_mesh and write_obj).
+    Console output is captured so that maps converted in parallel do not interleave.
+    Returns a result dict with 'map', 'vmf' (None if nothing was written), 'obj' and 'mtl'
+    (None unless a mesh was written), 'brushes', 'textures' (sorted), 'atlas_fallback' (the
+    sorted atlas textures that tile on this map's faces and so need their own material; see
+    fit_texture_atlas) and the captured 'messages'.
+    """
+    map_name = os.path.splitext(os.path.basename(map_filepath))[0]
+    # Construct the .vmf file path within the 'maps' subdirectory
+    vmf_filepath = os.path.join(maps_output_dir, f"{map_name}.vmf")
+    result = {'map': map_filepath, 'vmf': None, 'obj': None, 'mtl': None, 'brushes': 0, 'textures': [], 'atlas_fallback': [], 'messages': []}
+
+    captured_output = io.StringIO()
+    with contextlib.redirect_stdout(captured_output):
+        geometry, unique_textures_in_map = parse_quake_map(map_filepath)
+        result['brushes'] = len(geometry)
+        result['textures'] = sorted(unique_textures_in_map)
+        # Brushes whose planes do not close a volume make Hammer reject the map; report them early
+        windings = clip_brush_windings(geometry)
+        invalid_brushes = np.flatnonzero(~windings.valid_brushes)
+        if len(invalid_brushes):
+            print(f"  [WARNING] {len(invalid_brushes)} brush(es) in {map_filepath} enclose no volume "
+                  f"(brush {', '.join(str(brush) for brush in invalid_brushes[:5].tolist())}{', ...' if len(invalid_brushes) > 5 else ''}).")
+        grid = BrushGrid(windings.mins, windings.maxs)
+        stuck_entities = [entity_index for entity_index in embedded_entities(geometry, grid).tolist()
+                          if geometry.entities[entity_index].quake_classname.startswith(SPAWNED_ENTITY_PREFIXES)]
+        if stuck_entities:
+            print(f"  [WARNING] {len(stuck_entities)} entity(ies) in {map_filepath} start inside solid world brushes "
+                  f"({', '.join(f'{geometry.entities[entity_index].quake_classname} (entity {entity_index})' for entity_index in stuck_entities[:5])}{', ...' if len(stuck_entities) > 5 else ''}).")
+        if optimize and len(geometry):
+            geometry, windings, merged_count, hidden_count = optimize_map_geometry(geometry, windings)
+            print(f"  Merged {merged_count} brush(es) into adjacent brushes and set {hidden_count} hidden face(s) to nodraw.")
+
+        if len(geometry):
+            if atlas is not None:
+                atlas_textures = {texture_family_name(texture_name) for texture_name in geometry.textures if tool_material(texture_name) is None} & set(atlas.rects)
+                atlas, _ = fit_texture_atlas(geometry, atlas, transform, texture_sizes, windings)
+                result['atlas_fallback'] = sorted(atlas_textures - set(atlas.rects if atlas is not None else ()))
+                if result['atlas_fallback']:
+                    print(f"  {len(result['atlas_fallback'])} atlas texture(s) tile across faces in {map_filepath} and keep their own material "
+                          f"({', '.join(result['atlas_fallback'][:5])}{', ...' if len(result['atlas_fallback']) > 5 else ''}).")
+            try:
+                write_vmf(geometry, vmf_filepath, transform, atlas, texture_sizes, CoordinateFormatter(coordinate_grid), windings)
+                result['vmf'] = vmf_filepath
+                print(f"Generated Source 1 .vmf file: {vmf_filepath}")
+            except IOError as e:
+                print(f"[ERROR] Could not write .vmf file '{vmf_filepath}': {e}")
+            except Exception as e:
+                print(f"[ERROR] An unexpected error occurred during VMF generation for {map_name}.vmf: {e}")
+            if export_mesh:
+                obj_filepath = os.path.join(maps_output_dir, f"{map_name}.obj")
+                try:
+                    mesh = build_map_mesh(geometry, transform, texture_sizes, windings)
+                    write_obj(mesh, obj_filepath)
+                    result['obj'] = obj_filepath
+                    result['mtl'] = os.path.splitext(obj_filepath)[0] + ".mtl"
+                    print(f"Generated mesh .obj file: {obj_filepath} ({mesh.source_faces} faces merged into {mesh.polygon_count} polygons, "
+                          f"{mesh.source_corners} corners welded into {len(mesh.vertices)} vertices, {len(mesh.batches)} material batches)")
+                except IOError as e:
+                    print(f"[ERROR] Could not write .obj file '{obj_filepath}': {e}")
+                except Exception as e:
+                    print(f"[ERROR] An unexpected error occurred during mesh export for {map_name}.obj: {e}")
+        else:
+            print(f"No brushes found in {map_filepath}. Skipping .vmf generation.")
+
+    result['messages'] = captured_output.getvalue().splitlines()
+    return result
 
 
-def extract_and_save_texture_png(texture_name, output_dir, wad_files_paths=None):
+def convert_maps(map_filepaths, maps_output_dir, workers=None, transform=None, progress=None, atlas=None, texture_sizes=None, export_mesh=False, optimize=True, coordinate_grid=None):
     """
-    Extracts the texture data from Quake .wad files and saves it as a PNG image.
-    This implementation assumes Quake 1 (WAD2) format and uses a hardcoded palette.
+    Converts many .map files, parsing and emitting them on a process pool of `workers`
+    processes (defaults to the CPU count; workers=1 runs serially in this process).
+    Every map is converted by the same convert_map call in either mode, so the .vmf
+    output is byte-identical to a serial run. Results are returned in input order.
+    progress, if given, is called as progress(done, total) after each map.
     """
-    if not wad_files_paths:
-        print(f"  [ERROR] No WAD file paths provided. Cannot extract texture '{texture_name}'.")
-        return False
+    map_filepaths = list(map_filepaths)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(map_filepaths)))
 
-    png_filepath = os.path.join(output_dir, f"{texture_name}.png")
-    os.makedirs(os.path.dirname(png_filepath), exist_ok=True)
+    results = []
+    if workers == 1:
+        for map_filepath in map_filepaths:
+            results.append(convert_map(map_filepath, maps_output_dir, transform, atlas, texture_sizes, export_mesh, optimize, coordinate_grid))
+            if progress:
+                progress(len(results), len(map_filepaths))
+        return results
 
-    if os.path.exists(png_filepath):
-        print(f"  Texture '{texture_name}.png' already exists. Skipping extraction.")
-        return True # Assume it's already extracted
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        # executor.map yields results in submission order regardless of completion order
+        for result in executor.map(convert_map, map_filepaths, [maps_output_dir] * len(map_filepaths), [transform] * len(map_filepaths),
+                                   [atlas] * len(map_filepaths), [texture_sizes] * len(map_filepaths), [export_mesh] * len(map_filepaths),
+                                   [optimize] * len(map_filepaths), [coordinate_grid] * len(map_filepaths)):
+            results.append(result)
+            if progress:
+                progress(len(results), len(map_filepaths))
+    return results
 
-    # Ensure wad_files_paths is always a list
-    wad_files_to_check = []
-    if isinstance(wad_files_paths, str):
-        wad_files_to_check.append(wad_files_paths)
-    elif isinstance(wad_files_paths, list):
-        wad_files_to_check.extend(wad_files_paths)
-    else:
-        print(f"  [ERROR] Invalid wad_files_paths type: {type(wad_files_paths)}. Must be string or list of strings.")
-        return False
 
-    found_texture_data = False
+class BuildManifest:
+    """
+    Persistent record of what the last conversion produced, used to skip unchanged work.
+    Every entry stores a content key (a hash of the input bytes plus the converter settings
+    that affect the output) and the output files it produced. The manifest is kept as JSON
+    in the addon content folder and is rewritten atomically at the end of each run.
+    """
+    FILENAME = ".quake_build_manifest.json"
+    VERSION = 8 # Bump whenever the VMF/VTF output changes for identical inputs
 
-    for wad_file_path in wad_files_to_check:
-        if not os.path.exists(wad_file_path):
-            print(f"  [WARNING] WAD file not found: {wad_file_path}")
-            continue
+    def __init__(self, manifest_filepath):
+        self.path = manifest_filepath
+        self.maps = {}     # map file path -> {'key', 'vmf', 'obj', 'mtl', 'brushes', 'textures'}
+        self.textures = {} # texture name -> {'key', 'vtf'}
 
+    @classmethod
+    def load(cls, addon_content_dir):
+        """Loads the manifest in addon_content_dir; a missing, unreadable or outdated one yields an empty manifest."""
+        manifest = cls(os.path.join(addon_content_dir, cls.FILENAME))
         try:
-            with open(wad_file_path, 'rb') as f:
-                # Read WAD header
-                header = f.read(12)
-                magic, num_lumps, lump_offset = struct.unpack('<4sII', header) # Little-endian
+            with open(manifest.path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == cls.VERSION:
+                manifest.maps = data.get('maps', {})
+                manifest.textures = data.get('textures', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"  [WARNING] Ignoring unreadable build manifest '{manifest.path}': {e}")
+        return manifest
 
-                if magic != b'WAD2':
-                    print(f"  [WARNING] '{wad_file_path}' is not a WAD2 file (magic: {magic}). Skipping.")
-                    continue
+    def save(self):
+        """Writes the manifest through a temp file and renames it into place."""
+        fd, temp_filepath = tempfile.mkstemp(prefix=".", suffix=".json.tmp", dir=os.path.dirname(self.path) or ".")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': self.VERSION, 'maps': self.maps, 'textures': self.textures}, f, indent=1, sort_keys=True)
+            os.replace(temp_filepath, self.path)
+        except BaseException:
+            try:
+                os.remove(temp_filepath)
+            except OSError:
+                pass
+            raise
 
-                f.seek(lump_offset)
-
-                # Read lump directory
-                for _ in range(num_lumps):
-                    lump_entry = f.read(32)
-                    # Handle potential EOF if num_lumps is wrong or file is truncated
-                    if len(lump_entry) < 32:
-                        print(f"  [WARNING] Truncated WAD directory in {wad_file_path}.")
-                        break
-                    
-                    lump_offset_data, lump_disk_size, lump_size, lump_type, lump_compression, lump_dummy, lump_name_raw = \
-                        struct.unpack('<IIBBH16s', lump_entry)
-                    
-                    lump_name = lump_name_raw.decode('ascii').split('\0')[0].lower()
-
-                    if lump_name == texture_name:
-                        print(f"  Found texture '{texture_name}' in '{wad_file_path}'.")
-                        current_pos = f.tell() # Save current position
-                        f.seek(lump_offset_data)
-
-                        # Read texture header (MIPTEX_HEADER)
-                        tex_header = f.read(40)
-                        if len(tex_header) < 40:
-                            print(f"  [WARNING] Truncated MIPTEX header for '{texture_name}' in {wad_file_path}.")
-                            f.seek(current_pos) # Restore position
-                            continue
-                        
-                        tex_name_raw, tex_width, tex_height, mip_offset0, _, _, _ = \
-                            struct.unpack('<16sIIII', tex_header)
-                        
-                        # We only need the first (largest) mipmap
-                        f.seek(lump_offset_data + mip_offset0)
-                        
-                        # Read pixel data
-                        pixel_data_size = tex_width * tex_height
-                        pixel_data = f.read(pixel_data_size)
-
-                        if len(pixel_data) < pixel_data_size:
-                            print(f"  [WARNING] Truncated pixel data for '{texture_name}' in {wad_file_path}.")
-                            f.seek(current_pos) # Restore position
-                            continue
-                        
-                        img = Image.new('P', (tex_width, tex_height))
-                        img.putpalette(FLATTENED_PALETTE)
-                        img.putdata(pixel_data)
-
-                        # If texture name starts with '{', make color 255 transparent
-                        if texture_name.startswith('{'):
-                            img.info['transparency'] = 255 # Set index 255 as transparent
-                            print(f"  Marked '{texture_name}' (palette index 255) as transparent.")
-
-                        img.save(png_filepath)
-                        print(f"  Successfully extracted and saved '{png_filepath}'.")
-                        found_texture_data = True # Indicate success
-                        f.seek(current_pos) # Restore file position
-                        break # Found texture in this WAD, move to next
-                if found_texture_data:
-                    break # Found texture in one WAD, no need to check others
+    @staticmethod
+    def is_current(entry, key, output_filepath):
+        """True if entry was built from key and its output file is still on disk."""
+        return entry is not None and entry.get('key') == key and output_filepath is not None and os.path.isfile(output_filepath)
 
-        except Exception as e:
-            print(f"  [ERROR] Could not read WAD file '{wad_file_path}' or extract texture '{texture_name}': {e}")
-            # Continue to next WAD file if one fails
-            continue
+    def up_to_date_map(self, map_filepath, key):
+        """Returns the cached convert_map-style result for map_filepath if it is still current, else None."""
+        entry = self.maps.get(map_filepath)
+        if not self.is_current(entry, key, entry and entry.get('vmf')) or (entry.get('obj') and not os.path.isfile(entry['obj'])):
+            return None
+        return {'map': map_filepath, 'vmf': entry['vmf'], 'obj': entry.get('obj'), 'mtl': entry.get('mtl'), 'brushes': entry['brushes'],
+                'textures': entry['textures'], 'atlas_fallback': entry.get('atlas_fallback', []), 'messages': [f"Up to date, skipping: {entry['vmf']}"], 'cached': True}
 
-    if not found_texture_data:
-        print(f"  [WARNING] Texture '{texture_name}' not found in any provided WAD files.")
-        print(f"  Please ensure you manually provide '{texture_name}.png' at '{png_filepath}' if it's missing.")
-        return False # Indicate texture not found
+    def up_to_date_texture(self, texture_name, key):
+        """True if texture_name's VTF was built from key and still exists."""
+        entry = self.textures.get(texture_name)
+        return key is not None and self.is_current(entry, key, entry and entry.get('vtf'))
 
-    return True # Indicate successful extraction
+    def remove_stale(self, current_entries, entries, output_fields, log=print):
+        """
+        Deletes the outputs (the entry fields named in output_fields) of entries whose source
+        is not in current_entries and drops them. Outputs still claimed by a current entry are
+        left alone.
+        """
+        claimed_outputs = {entries[name].get(field) for name in current_entries if name in entries for field in output_fields}
+        for name in [name for name in entries if name not in current_entries]:
+            entry = entries.pop(name)
+            for output_filepath in (entry.get(field) for field in output_fields):
+                if output_filepath and output_filepath not in claimed_outputs and os.path.isfile(output_filepath):
+                    try:
+                        os.remove(output_filepath)
+                        log(f"  Removed stale output: {output_filepath}")
+                    except OSError as e:
+                        log(f"  [WARNING] Could not remove stale output '{output_filepath}': {e}")
 
 
-def convert_png_to_vtf(png_filepath, vtf_output_dir, vtex_path, s1_game_content_root, console_widget):
+def _content_key(settings, *chunks):
+    """Hashes the given byte chunks together with the (JSON-serialisable) converter settings."""
+    digest = hashlib.sha1(json.dumps([BuildManifest.VERSION, settings], sort_keys=True).encode('utf-8'))
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def map_content_key(map_filepath, transform=None, atlas=None, texture_sizes=None, export_mesh=False, optimize=True, coordinate_grid=None):
     """
-    Converts a PNG image to a Source 1 VTF file using vtex.exe.
+    Content key for a .map file: its bytes plus the map transform, texture atlas, texture
+    sizes and coordinate grid applied to it, and whether it is optimised and a mesh is
+    exported for it.
     """
-    vtf_name = os.path.splitext(os.path.basename(png_filepath))[0]
-    vtf_filepath = os.path.join(vtf_output_dir, f"{vtf_name}.vtf")
-
-    # vtex.exe requires VPROJECT to be set to the game's content root (e.g., tf, hl2)
-    # and often expects to be run from its own bin directory.
-    
-    # Ensure output directory exists for vtex
-    os.makedirs(vtf_output_dir, exist_ok=True)
+    if transform is None:
+        transform = DEFAULT_MAP_TRANSFORM
+    settings = {'linear': transform.linear.tolist(), 'translation': transform.translation.tolist(),
+                'atlas': atlas.key if atlas is not None else None,
+                'texture_sizes': sorted((name, list(size)) for name, size in (texture_sizes or {}).items()),
+                'mesh': bool(export_mesh), 'optimize': bool(optimize), 'grid': coordinate_grid}
+    try:
+        with open(map_filepath, 'rb') as f:
+            return _content_key(settings, f.read())
+    except OSError:
+        return None
 
-    # Command to run vtex.exe
-    # -shader UnlitGeneric: A common simple shader for basic textures
-    # -format DXT1: A common compressed format for diffuse textures
-    # -alpha: Include alpha channel if present (for transparent textures)
-    # -nocompress: If you want uncompressed textures (larger file size)
-    # -file <input_png_path>
-    
-    command = [
-        vtex_path,
-        "-quiet", # Suppress most vtex output
-        "-mkdir", # Create output directories if they don't exist
-        "-shader", "UnlitGeneric", # Basic shader
-        "-format", "DXT1", # Common compressed format for diffuse
-        # "-alpha", # Only add if the image actually has transparency
-        png_filepath
-    ]
 
-    # Check if the PNG has transparency to decide on -alpha flag
+def texture_content_keys(texture_names, wad_files_paths, backend, vtex_path=None, palette=None):
+    """
+    Content keys for textures: the bytes of the WAD lumps each name resolves to (every frame
+    of an animated texture, see texture_animation_frames) plus the texture converter settings.
+    Textures not found in any WAD get None (never cached).
+    """
+    keys = {}
+    settings = {'backend': backend, 'palette': (palette or DEFAULT_PALETTE).key}
+    if backend == 'vtex':
+        settings['vtex'] = os.path.basename(vtex_path or "")
+    wad_archives = open_wad_archives(wad_files_paths, lambda message: None)
     try:
-        with Image.open(png_filepath) as img:
-            if img.mode == 'RGBA' or (img.mode == 'P' and 'transparency' in img.info):
-                command.insert(2, "-alpha") # Insert -alpha flag after -quiet
-                console_widget.insert(tk.END, f"  [VTEX] Detected transparency for '{vtf_name}', adding -alpha flag.\n")
-    except Exception as e:
-        console_widget.insert(tk.END, f"  [VTEX_WARNING] Could not check transparency for '{png_filepath}': {e}\n")
-
-    env = os.environ.copy()
-    env['VPROJECT'] = s1_game_content_root
-    
-    # vtex.exe usually expects its CWD to be its own bin directory
-    vtex_bin_dir = os.path.dirname(vtex_path)
+        for texture_name in texture_names:
+            frames = texture_animation_frames(texture_name, wad_archives)
+            try:
+                lumps = [find_texture_archive(frame_name, wad_archives).read_lump(frame_name) for frame_name in frames]
+            except ValueError:
+                keys[texture_name] = None
+                continue
+            # Frame names are hashed too, so a renamed or reordered sequence is rebuilt
+            keys[texture_name] = _content_key(dict(settings, frames=frames), *lumps) if frames else None
+            for lump in lumps:
+                lump.release()
+    finally:
+        for wad_archive in wad_archives:
+            wad_archive.close()
+    return keys
 
-    console_widget.insert(tk.END, f"  [VTEX] Converting '{os.path.basename(png_filepath)}' to VTF...\n")
-    console_widget.insert(tk.END, f"  [VTEX] VPROJECT set to: '{env['VPROJECT']}'\n")
-    console_widget.insert(tk.END, f"  [VTEX] CWD for vtex.exe: '{vtex_bin_dir}'\n")
-    console_widget.insert(tk.END, f"  [VTEX] Command: {' '.join(command)}\n")
-    console_widget.see(tk.END)
 
-    try:
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8', errors='replace', env=env, cwd=vtex_bin_dir)
-        stdout, stderr = process.communicate()
+class ProgressEventBus:
+    """
+    Thread-safe publisher for pipeline events, decoupling the converter from whatever displays it.
+    Events are dicts with a 'type' key:
+      {'type': 'log', 'message': line}                          one console line
+      {'type': 'text', 'text': raw}                             raw text (e.g. redirected stdout)
+      {'type': 'progress', 'stage': name, 'done': n, 'total': m}
+    Subscribers are callables receiving each event on the posting thread, so they must be
+    cheap and must not touch a GUI directly (see EventQueue). Progress events for a stage are
+    rate-limited to one per min_progress_interval seconds; the final one is always delivered.
+    """
+    def __init__(self, min_progress_interval=0.1):
+        self.min_progress_interval = min_progress_interval
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._last_progress = {} # stage -> time.monotonic() of the last delivered progress event
 
-        if stdout:
-            console_widget.insert(tk.END, f"  [VTEX_STDOUT] {stdout}\n")
-        if stderr:
-            console_widget.insert(tk.END, f"  [VTEX_STDERR] {stderr}\n")
+    def subscribe(self, callback):
+        """Registers callback(event) and returns it, so it can be passed to unsubscribe later."""
+        with self._lock:
+            self._subscribers.append(callback)
+        return callback
 
-        if process.returncode != 0:
-            console_widget.insert(tk.END, f"  [ERROR] vtex.exe exited with code {process.returncode} for '{vtf_name}'.\n")
-            return False
-        else:
-            # vtex outputs VTF to the VPROJECT's materials/ folder by default,
-            # but we want it in our addon's materials folder.
-            # We need to move it from the VPROJECT's materials folder to our output_dir.
-            # vtex will output to <VPROJECT>/materials/<texture_name>.vtf
-            # So we need to construct that path.
-            expected_vtf_in_vproject = os.path.join(s1_game_content_root, "materials", f"{vtf_name}.vtf")
-            
-            if os.path.exists(expected_vtf_in_vproject):
-                shutil.move(expected_vtf_in_vproject, vtf_filepath)
-                console_widget.insert(tk.END, f"  Successfully converted and moved '{vtf_name}.vtf' to '{vtf_filepath}'.\n")
-                return True
-            else:
-                console_widget.insert(tk.END, f"  [ERROR] vtex.exe did not produce VTF at expected location: '{expected_vtf_in_vproject}'.\n")
-                return False
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
 
-    except FileNotFoundError:
-        console_widget.insert(tk.END, f"[ERROR] vtex.exe not found at '{vtex_path}'. Please check the path.\n")
-        return False
-    except Exception as e:
-        console_widget.insert(tk.END, f"[ERROR] An unexpected error occurred while running vtex.exe for '{vtf_name}': {e}\n")
-        return False
+    def post(self, event):
+        """Delivers event to every subscriber."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(event)
 
+    def log(self, message):
+        self.post({'type': 'log', 'message': message})
 
-def generate_vmf_content(map_data):
-    """
-    Generates the content for a Source 1 .vmf file from the parsed Quake map data.
-    Brush faces will be assigned their original Quake texture names (for VTF lookup).
-    Includes a basic info_player_start and empty hidden block for VMF validity.
-    """
-    vmf_lines = []
-    
-    # VMF header information
-    vmf_lines.append("versioninfo")
-    vmf_lines.append("{")
-    vmf_lines.append("    \"mapversion\" \"1\"")
-    vmf_lines.append("    \"editorversion\" \"400\"")
-    vmf_lines.append("    \"editorbuild\" \"8000\"")
-    vmf_lines.append("    \"formatversion\" \"1\"")
-    vmf_lines.append("    \"prefab\" \"0\"")
-    vmf_lines.append("}")
+    def text(self, text):
+        self.post({'type': 'text', 'text': text})
 
-    # Worldspawn entity block
-    vmf_lines.append("world")
-    vmf_lines.append("{")
-    vmf_lines.append("    \"id\" \"1\"") # Worldspawn typically has ID 1
-    vmf_lines.append("    \"mapversion\" \"1\"")
-    vmf_lines.append("    \"classname\" \"worldspawn\"")
+    def progress(self, stage, done, total):
+        """Posts a progress event unless one for the same stage went out less than min_progress_interval ago."""
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_progress.get(stage)
+            if done < total and last is not None and now - last < self.min_progress_interval:
+                return
+            self._last_progress[stage] = now
+        self.post({'type': 'progress', 'stage': stage, 'done': done, 'total': total})
 
-    # Define a scaling factor for Quake units to Source units.
-    # The 0.75 scale is intended for the final Alyx map size.
-    SCALE_FACTOR = 0.75 
-    
-    # Unique ID counter for solids (brushes) and sides, starting after worldspawn's ID 1
-    current_id = 2 
 
-    # Iterate through each brush parsed from the Quake map
-    for brush_idx, brush_planes in enumerate(map_data):
-        vmf_lines.append("    solid")
-        vmf_lines.append("    {")
-        vmf_lines.append(f"        \"id\" \"{current_id}\"")
-        current_id += 1
+class EventQueue:
+    """
+    ProgressEventBus subscriber that buffers events for a consumer on another thread.
+    The GUI subscribes one and drains it in batches from a Tk timer, so the conversion
+    thread never waits for the widget to repaint.
+    """
+    def __init__(self):
+        self._events = collections.deque() # append/popleft are atomic, no lock needed
 
-        # Iterate through each plane (side) of the current brush
-        for plane_data in brush_planes:
-            vmf_lines.append("        side")
-            vmf_lines.append("        {")
-            vmf_lines.append(f"            \"id\" \"{current_id}\"")
-            current_id += 1
+    def __call__(self, event):
+        self._events.append(event)
 
-            # Quake uses Z-up, Source (1 and 2) typically Y-up.
-            # Conversion: (x_quake, y_quake, z_quake) -> (x_source, z_source, -y_source)
-            # This is the standard conversion that usually works.
-            p1 = plane_data['plane'][0]
-            p2 = plane_data['plane'][1]
-            p3 = plane_data['plane'][2]
+    def drain(self):
+        """Removes and returns every event queued so far, oldest first."""
+        events = []
+        while self._events:
+            events.append(self._events.popleft())
+        return events
 
-            # Apply Z-up to Y-up conversion and scaling to each point
-            p1_s = (p1[0] * SCALE_FACTOR, p1[2] * SCALE_FACTOR, -p1[1] * SCALE_FACTOR)
-            p2_s = (p2[0] * SCALE_FACTOR, p2[2] * SCALE_FACTOR, -p2[1] * SCALE_FACTOR)
-            p3_s = (p3[0] * SCALE_FACTOR, p3[2] * SCALE_FACTOR, -p3[1] * SCALE_FACTOR)
 
-            # Format coordinates for VMF plane string: "(x1 y1 z1) (x2 y2 z2) (x3 y3 z3)"
-            vmf_lines.append(f"            \"plane\" \"({p1_s[0]:.6f} {p1_s[1]:.6f} {p1_s[2]:.6f}) ({p2_s[0]:.6f} {p2_s[1]:.6f} {p2_s[2]:.6f}) ({p3_s[0]:.6f} {p3_s[1]:.6f} {p3_s[2]:.6f})\"")
+def format_events(events):
+    """Joins the console text carried by log/text events into a single string."""
+    return "".join(event['message'] + "\n" if event['type'] == 'log' else event['text']
+                   for event in events if event['type'] in ('log', 'text'))
 
-            # Assign the original Quake texture name.
-            # Source 1 VMFs typically reference materials without the 'materials/' prefix and without '.vtf' extension.
-            # Hammer will look for 'materials/TEXTURE_NAME.vtf' in the game's content.
-            vmf_lines.append(f"            \"material\" \"{plane_data['texture'].upper()}\"") 
 
-            # Basic UVs for VMF. These are simplified and might require manual fine-tuning in Hammer.
-            # A common scale for Quake-like textures might be 16 units per texture repeat (1/16 = 0.0625).
-            vmf_lines.append("            \"uaxis\" \"[1 0 0 0] 0.0625\"") # X-axis projection, scale 0.0625
-            vmf_lines.append("            \"vaxis\" \"[0 1 0 0] 0.0625\"") # Y-axis projection, scale 0.0625
-            vmf_lines.append("            \"rotation\" \"0\"")
-            vmf_lines.append("            \"lightmapscale\" \"16\"") # Default lightmap scale for lightmap grid
-            vmf_lines.append("            \"smoothing_groups\" \"0\"")
-            vmf_lines.append("        }") # End side
-        
-        # Editor block for solid (brush) in VMF
-        vmf_lines.append("        \"editor\"")
-        vmf_lines.append("        {")
-        vmf_lines.append("            \"color\" \"255 0 0\"") # Default brush color in Hammer (Red)
-        vmf_lines.append("            \"visgroupshown\" \"1\"") # Brush visible in Hammer
-        vmf_lines.append("            \"visgroupautoshown\" \"1\"") # Brush auto-visible
-        vmf_lines.append("        }")
-        vmf_lines.append("    }") # End solid
+def conversion_summary(addon_content_dir, map_results, texture_results):
+    """
+    Condenses convert_maps/convert_textures results into a JSON-serialisable summary.
+    A map fails if it produced no .vmf; a texture fails if its encoder (or vtex.exe) did not convert it,
+    or if it is missing from the WADs ('not_extracted'), since the maps would then reference an absent
+    material. Tool textures (clip, trigger, sky, ...; see tool_material) are emitted as Source tool
+    materials, so their absence from the WADs is listed but does not fail the run.
+    """
+    maps = [{'map': result['map'], 'vmf': result['vmf'], 'obj': result.get('obj'), 'brushes': result['brushes'],
+             'cached': bool(result.get('cached'))} for result in map_results]
+    textures = {}
+    for result in texture_results:
+        textures.setdefault(result['status'], []).append(result['texture'])
+    missing_textures = [texture_name for texture_name in textures.get('not_extracted', []) if tool_material(texture_name) is None]
+    failed = any(entry['vmf'] is None for entry in maps) or 'encode_failed' in textures or 'vtex_failed' in textures or bool(missing_textures)
+    return {'status': 'failed' if failed else 'ok', 'error': None, 'output': addon_content_dir,
+            'maps': maps, 'textures': textures}
 
-    # Editor block for worldspawn in VMF
-    vmf_lines.append("    \"editor\"")
-    vmf_lines.append("    {")
-    vmf_lines.append("        \"color\" \"255 0 0\"")
-    vmf_lines.append("        \"visgroupshown\" \"1\"")
-    vmf_lines.append("        \"visgroupautoshown\" \"1\"")
-    vmf_lines.append("        \"logicalpos\" \"[0 0]\"")
-    vmf_lines.append("    }")
-    vmf_lines.append("}") # End world
 
-    # Add a minimal info_player_start entity
-    vmf_lines.append("entity")
-    vmf_lines.append("{")
-    vmf_lines.append(f"    \"id\" \"{current_id}\"")
-    current_id += 1
-    vmf_lines.append("    \"classname\" \"info_player_start\"")
-    vmf_lines.append("    \"origin\" \"0 0 64\"") # Default spawn point
-    vmf_lines.append("    \"angles\" \"0 0 0\"") # Default orientation
-    vmf_lines.append("    \"editor\"")
-    vmf_lines.append("    {")
-    vmf_lines.append("        \"color\" \"255 255 0\"") # Yellow for player start
-    vmf_lines.append("        \"visgroupshown\" \"1\"")
-    vmf_lines.append("        \"visgroupautoshown\" \"1\"")
-    vmf_lines.append("        \"logicalpos\" \"[0 0]\"")
-    vmf_lines.append("    }")
-    vmf_lines.append("}")
+def texture_search_paths(wad_files_paths):
+    """
+    Where WADs named by maps are looked for, given the texture sources: the PAKs and game
+    folders among them (and the PAKs inside those folders), and the folders holding the rest.
+    """
+    search_paths = []
+    for source_path in wad_files_paths:
+        pak_file_path, name = split_pak_path(source_path)
+        if name is not None or source_path.lower().endswith('.pak'):
+            search_paths.append(pak_file_path)
+        elif os.path.isdir(source_path):
+            search_paths.append(source_path)
+            search_paths.extend(os.path.join(source_path, entry) for entry in sorted(os.listdir(source_path), reverse=True)
+                                if entry.lower().endswith('.pak'))
+        else:
+            search_paths.append(os.path.dirname(os.path.abspath(source_path)))
+    return list(dict.fromkeys(search_paths))
 
-    # Add an empty hidden block (often present in VMFs)
-    vmf_lines.append("hidden")
-    vmf_lines.append("{")
-    vmf_lines.append("}")
 
-    return "\n".join(vmf_lines)
+def resolve_map_wads(map_filepaths, input_folder, wad_files_paths, log=print):
+    """
+    Resolves the WADs named by the worldspawn "wad" keys of map_filepaths (see scan_map_wads)
+    by file name: next to each map, in input_folder, then in the texture sources already given
+    (see texture_search_paths), including inside PAK files. Returns the virtual paths of the
+    WADs found that wad_files_paths do not already provide, in the order the maps name them.
+    """
+    search_paths = texture_search_paths(wad_files_paths)
+    resolved_paths = []
+    missing_names = set()
+    file_system = QuakeFileSystem()
+    try:
+        known_paths = {os.path.normcase(os.path.abspath(wad_path)) for source_path in wad_files_paths
+                       for wad_path in file_system.texture_source_paths(source_path)}
+        for map_filepath in map_filepaths:
+            for wad_name in scan_map_wads(map_filepath):
+                wad_path = file_system.find(wad_name, [os.path.dirname(map_filepath), input_folder] + search_paths)
+                if wad_path is None:
+                    missing_names.add(wad_name.lower())
+                elif os.path.normcase(os.path.abspath(wad_path)) not in known_paths:
+                    known_paths.add(os.path.normcase(os.path.abspath(wad_path)))
+                    resolved_paths.append(wad_path)
+                    log(f"Using '{wad_path}' named by the \"wad\" key of {os.path.basename(map_filepath)}.")
+    finally:
+        file_system.close()
+    if missing_names:
+        log(f"  [WARNING] WAD(s) named by the maps were not found: {', '.join(sorted(missing_names))}.")
+    return resolved_paths
 
 
-def convert_folder(input_folder, output_base_folder, wad_files_paths, vtex_path, s1_game_content_root, console_widget):
+def convert_folder(input_folder, output_base_folder, wad_files_paths, vtex_path, s1_game_content_root, events=None, texture_workers=None, map_workers=None, transform=None, use_cache=True, texture_backend='native', palette=None, atlas_max_texture_size=None, export_mesh=False, optimize=True, coordinate_grid=None):
     """
     Orchestrates the conversion process:
-    1. Parses Quake .map files.
-    2. Extracts textures from WADs to PNG.
-    3. Converts PNGs to Source 1 VTF files using vtex.exe.
-    4. Generates Source 1 .vmf files (using original texture names).
-    Output messages are redirected to the provided console_widget.
+    1. Parses Quake .map files. The WADs named by their worldspawn "wad" keys are added to the
+       texture sources in wad_files_paths (.wad, .bsp and .pak files, or game folders; see
+       resolve_map_wads and QuakeFileSystem).
+    2. Generates Source 1 .vmf files (using original texture names). With export_mesh, each
+       map's world brushes are also written as a merged, welded and material-batched .obj
+       mesh for import into Source 2 Hammer (see build_map_mesh). With optimize, adjacent box
+       brushes are merged and hidden faces set to nodraw before emission (see optimize_map_geometry).
+       Plane coordinates are snapped to multiples of coordinate_grid output units if given.
+    3. Converts the textures they use from the WADs to Source 1 VTF files, with the built-in
+       encoder (texture_backend='native') or through PNG files and vtex.exe ('vtex').
+       vtex_path and s1_game_content_root are only needed for the 'vtex' backend.
+       Textures are expanded through palette (a Palette); if None, a palette.lmp next to the
+       WAD files (or in their gfx/ folder) is used, else the built-in Quake palette.
+       With atlas_max_texture_size (native backend only), the static opaque textures of all the
+       maps up to that size are packed into shared atlas sheets (see TextureAtlas), the VMFs
+       reference the sheets, and the name -> UV-rect table is written to materials/atlas.json.
+       Textures that a map tiles across its faces stay on their own VTF in that map (see
+       fit_texture_atlas).
+    Maps are parsed and emitted on up to map_workers processes, and steps 2 and 3 run
+    concurrently on up to texture_workers processes (both default to the CPU count).
+    transform (a MapTransform) sets the output scale, axis convention and origin offset.
+    With use_cache, maps and textures whose inputs and settings match the build manifest
+    (see BuildManifest) are skipped, and outputs of removed inputs are deleted. With
+    use_cache=False everything is rebuilt and the manifest is refreshed.
+    Output messages and per-stage progress are posted to events (a ProgressEventBus);
+    without one, messages are printed.
+    Returns a summary dict (see conversion_summary); 'status' is 'ok', 'failed' (some maps
+    or textures did not convert, or textures the maps use are missing from the WADs) or
+    'error' (invalid inputs, nothing was converted).
     """
     def print_to_console(s):
-        """Helper function to print messages to the GUI console and auto-scroll."""
-        console_widget.insert(tk.END, s + "\n")
-        console_widget.see(tk.END) # Auto-scroll to the end
-        console_widget.update_idletasks() # Force GUI update
+        """Helper function to post a console line to the event bus (or stdout)."""
+        if events is None:
+            print(s)
+        else:
+            events.log(s)
+
+    def progress_reporter(stage):
+        """Returns a progress(done, total) callback posting to the event bus for stage."""
+        if events is None:
+            return None
+        return lambda done, total: events.progress(stage, done, total)
+
+    def input_error(s):
+        """Reports an invalid input and returns the matching 'error' summary."""
+        print_to_console(s)
+        return {'status': 'error', 'error': s, 'output': None, 'maps': [], 'textures': {}}
 
     # --- Input Validation ---
     if not os.path.exists(input_folder):
-        print_to_console(f"Error: Quake Maps Input folder '{input_folder}' does not exist. Please check the path.")
-        return
-    if not vtex_path or not os.path.exists(vtex_path):
-        print_to_console(f"Error: vtex.exe not found at '{vtex_path}'. Please check the path.")
-        return
-    if not s1_game_content_root or not os.path.exists(s1_game_content_root):
-        print_to_console(f"Error: Source 1 Game Content Root '{s1_game_content_root}' does not exist. Please check the path.")
-        return
-    if not wad_files_paths:
-        print_to_console(f"Error: No Quake WAD files paths provided. Cannot extract textures.")
-        return
-    for wad_path in (wad_files_paths if isinstance(wad_files_paths, list) else [wad_files_paths]):
-        if not os.path.exists(wad_path):
-            print_to_console(f"Error: Quake WAD file '{wad_path}' not found. Please check the path(s).")
-            return
+        return input_error(f"Error: Quake Maps Input folder '{input_folder}' does not exist. Please check the path.")
+    if texture_backend not in TEXTURE_BACKENDS:
+        return input_error(f"Error: Unknown texture backend '{texture_backend}'. Expected one of: {', '.join(TEXTURE_BACKENDS)}.")
+    if texture_backend == 'vtex' and (not vtex_path or not os.path.exists(vtex_path)):
+        return input_error(f"Error: vtex.exe not found at '{vtex_path}'. Please check the path.")
+    if texture_backend == 'vtex' and (not s1_game_content_root or not os.path.exists(s1_game_content_root)):
+        return input_error(f"Error: Source 1 Game Content Root '{s1_game_content_root}' does not exist. Please check the path.")
+    wad_files_paths = [wad_files_paths] if isinstance(wad_files_paths, str) else list(wad_files_paths or [])
+    file_system = QuakeFileSystem()
+    try:
+        for wad_path in wad_files_paths:
+            if not file_system.exists(wad_path):
+                return input_error(f"Error: Quake WAD file '{wad_path}' not found. Please check the path(s).")
+    finally:
+        file_system.close()
 
     # Define the addon content structure: [output_base_folder]/quakeautomatedscriptport/[maps|materials]
     addon_content_dir = os.path.join(output_base_folder, "quakeautomatedscriptport")
@@ -505,7 +3777,6 @@ def convert_folder(input_folder, output_base_folder, wad_files_paths, vtex_path,
     os.makedirs(maps_output_dir, exist_ok=True)
     os.makedirs(materials_output_dir, exist_ok=True) # Create materials dir for VTF files
 
-    map_files_found = False
     all_unique_textures = set()
 
     print_to_console(f"\n--- Starting Map Conversion Process ---")
@@ -519,53 +3790,171 @@ def convert_folder(input_folder, output_base_folder, wad_files_paths, vtex_path,
 
     if not map_files_to_process:
         print_to_console(f"No .map files found in '{input_folder}' or its subdirectories. Nothing to convert.")
-        return
+        return conversion_summary(addon_content_dir, [], [])
 
+    # Sorted so that the processing order (and therefore the log) is stable across file systems
+    map_files_to_process.sort()
     print_to_console(f"Found {len(map_files_to_process)} .map files to convert:")
     for map_filepath in map_files_to_process:
         print_to_console(f"- {map_filepath}")
-        map_files_found = True
-        map_name = os.path.splitext(os.path.basename(map_filepath))[0]
-        # Construct the .vmf file path within the 'maps' subdirectory
-        vmf_filepath = os.path.join(maps_output_dir, f"{map_name}.vmf")
 
-        print_to_console(f"\nProcessing Quake map: {map_filepath}...")
-        brushes, unique_textures_in_map = parse_quake_map(map_filepath) 
-        all_unique_textures.update(unique_textures_in_map) # Collect all unique textures across all maps
+    wad_files_paths += resolve_map_wads(map_files_to_process, input_folder, wad_files_paths, print_to_console)
+    if not wad_files_paths:
+        return input_error(f"Error: No Quake WAD files paths provided and none of the maps' \"wad\" keys could be resolved. Cannot extract textures.")
 
-        if brushes:
-            vmf_content = generate_vmf_content(brushes)
-            try:
-                with open(vmf_filepath, 'w') as f:
-                    f.write(vmf_content)
-                print_to_console(f"Generated Source 1 .vmf file: {vmf_filepath}")
-            except IOError as e:
-                print_to_console(f"[ERROR] Could not write .vmf file '{vmf_filepath}': {e}")
-            except Exception as e:
-                print_to_console(f"[ERROR] An unexpected error occurred during VMF generation for {map_name}.vmf: {e}")
+    # Texture sizes (and the atlas) must be known before the VMFs are written, so the texture
+    # names are pre-scanned and looked up in the WAD indexes
+    map_texture_names = {map_filepath: scan_map_textures(map_filepath) for map_filepath in map_files_to_process}
+    texture_sizes = {}
+    texture_atlas = None
+    wad_archives = open_wad_archives(wad_files_paths, lambda message: None)
+    try:
+        for texture_name in set().union(*map_texture_names.values()):
+            wad_archive = find_texture_archive(texture_name, wad_archives)
+            if wad_archive is not None:
+                try:
+                    texture_sizes[texture_name] = wad_archive.miptex_dimensions(texture_name)
+                except ValueError:
+                    pass
+        if atlas_max_texture_size and texture_backend != 'native':
+            print_to_console("  [WARNING] Texture atlases need the native texture backend; converting textures individually.")
+        elif atlas_max_texture_size:
+            map_textures = {texture_family_name(texture_name) for texture_names in map_texture_names.values() for texture_name in texture_names}
+            texture_atlas = build_texture_atlas(map_textures, wad_archives, atlas_max_texture_size)
+    finally:
+        for wad_archive in wad_archives:
+            wad_archive.close()
+    if texture_atlas is not None:
+        print_to_console(f"Packing {len(texture_atlas.rects)} textures of up to {atlas_max_texture_size}x{atlas_max_texture_size} into {len(texture_atlas)} atlas sheet(s).")
+
+    manifest = BuildManifest.load(addon_content_dir) if use_cache else BuildManifest(os.path.join(addon_content_dir, BuildManifest.FILENAME))
+    map_keys = {map_filepath: map_content_key(map_filepath, transform, texture_atlas,
+                                              {name: texture_sizes[name] for name in map_texture_names[map_filepath] if name in texture_sizes},
+                                              export_mesh, optimize, coordinate_grid)
+                for map_filepath in map_files_to_process}
+    cached_map_results = {}
+    if use_cache:
+        for map_filepath, key in map_keys.items():
+            cached_result = manifest.up_to_date_map(map_filepath, key)
+            if cached_result is not None:
+                cached_map_results[map_filepath] = cached_result
+    maps_to_convert = [map_filepath for map_filepath in map_files_to_process if map_filepath not in cached_map_results]
+    if cached_map_results:
+        print_to_console(f"{len(cached_map_results)} map(s) unchanged since the last run; converting {len(maps_to_convert)}.")
+
+    if map_workers is None:
+        map_workers = os.cpu_count() or 1
+    converted_results = convert_maps(maps_to_convert, maps_output_dir, map_workers, transform, progress_reporter('maps'), texture_atlas, texture_sizes, export_mesh, optimize,
+                                     coordinate_grid)
+    converted_map_results = dict(zip(maps_to_convert, converted_results))
+    map_results = [cached_map_results.get(map_filepath) or converted_map_results[map_filepath] for map_filepath in map_files_to_process]
+    for map_result in map_results:
+        if map_result.get('cached'):
+            continue
+        # A mesh from an earlier run with export_mesh is removed once the map is rebuilt without one
+        previous_entry = manifest.maps.get(map_result['map']) or {}
+        for field in ('obj', 'mtl'):
+            if previous_entry.get(field) and not map_result.get(field) and os.path.isfile(previous_entry[field]):
+                os.remove(previous_entry[field])
+        if map_result['vmf'] is not None and map_keys[map_result['map']] is not None:
+            manifest.maps[map_result['map']] = {'key': map_keys[map_result['map']], 'vmf': map_result['vmf'], 'obj': map_result['obj'], 'mtl': map_result['mtl'],
+                                                'brushes': map_result['brushes'], 'textures': map_result['textures'],
+                                                'atlas_fallback': map_result['atlas_fallback']}
         else:
-            print_to_console(f"No brushes found in {map_filepath}. Skipping .vmf generation.")
+            manifest.maps.pop(map_result['map'], None)
+    manifest.remove_stale(set(map_files_to_process), manifest.maps, ('vmf', 'obj', 'mtl'), print_to_console)
+    for map_result in map_results:
+        print_to_console(f"\nProcessing Quake map: {map_result['map']}...")
+        for message in map_result['messages']:
+            print_to_console(message)
+    # Merge the per-map texture sets in input order for a deterministic texture stage
+    for map_result in map_results:
+        all_unique_textures.update(map_result['textures'])
 
-    if not map_files_found:
-        print_to_console(f"No .map files were processed. Please ensure your input folder contains .map files.")
-        return
+    if texture_backend == 'vtex':
+        print_to_console("\n--- Extracting textures to PNG and converting to VTF ---")
+    else:
+        print_to_console("\n--- Encoding textures from the WADs to VTF ---")
+    if palette is None:
+        palette = load_palette(search_dirs=palette_search_dirs(wad_files_paths))
+    print_to_console(f"Using palette: {palette.source}")
+    # Animation frames are converted once per sequence, under the sequence's family name
+    all_unique_textures = {texture_family_name(texture_name) for texture_name in all_unique_textures}
+    atlas_textures = set(texture_atlas.rects) if texture_atlas is not None else set()
+    texture_keys = texture_content_keys(sorted(all_unique_textures | atlas_textures), wad_files_paths, texture_backend, vtex_path, palette)
+    # Textures packed into the atlas are only written as part of their sheet, unless a map tiles them
+    atlas_fallback = set().union(*(map_result['atlas_fallback'] for map_result in map_results))
+    all_unique_textures -= atlas_textures - atlas_fallback
+    sheets_to_convert = []
+    atlas_sheets = set()
+    if texture_atlas is not None:
+        for sheet_index in range(len(texture_atlas)):
+            sheet_name = texture_atlas.sheet_name(sheet_index)
+            member_keys = [texture_keys[texture_name] for texture_name, rect in sorted(texture_atlas.rects.items()) if rect[0] == sheet_index]
+            texture_keys[sheet_name] = None if None in member_keys else _content_key(
+                {'atlas': texture_atlas.key, 'sheet': sheet_index}, *(key.encode('ascii') for key in member_keys))
+            atlas_sheets.add(sheet_name)
+            if not (use_cache and manifest.up_to_date_texture(sheet_name, texture_keys[sheet_name])):
+                sheets_to_convert.append(sheet_index)
+    all_unique_textures |= atlas_sheets
+    textures_to_convert = sorted(texture_name for texture_name in all_unique_textures
+                                 if not (use_cache and manifest.up_to_date_texture(texture_name, texture_keys[texture_name])))
+    if len(textures_to_convert) < len(all_unique_textures):
+        print_to_console(f"{len(all_unique_textures) - len(textures_to_convert)} texture(s) unchanged since the last run.")
+    if texture_workers is None:
+        texture_workers = os.cpu_count() or 1
+    individual_textures = [texture_name for texture_name in textures_to_convert if texture_name not in atlas_sheets]
+    print_to_console(f"Converting {len(individual_textures)} textures with up to {texture_workers} worker process(es)...")
+    texture_results = convert_textures(individual_textures, materials_output_dir, wad_files_paths,
+                                       vtex_path, s1_game_content_root, texture_workers,
+                                       progress_reporter('textures'), texture_backend, palette) if individual_textures else []
 
-    print_to_console("\n--- Extracting textures to PNG and converting to VTF ---")
-    for texture in all_unique_textures:
-        png_temp_filepath = os.path.join(materials_output_dir, f"{texture}.png")
-        
-        # 1. Extract to PNG
-        if extract_and_save_texture_png(texture, materials_output_dir, wad_files_paths):
-            # 2. Convert PNG to VTF
-            convert_png_to_vtf(png_temp_filepath, materials_output_dir, vtex_path, s1_game_content_root, console_widget)
-            # Optionally, remove the temporary PNG after VTF conversion
-            try:
-                os.remove(png_temp_filepath)
-                print_to_console(f"  Removed temporary PNG: {os.path.basename(png_temp_filepath)}")
-            except Exception as e:
-                print_to_console(f"  [WARNING] Could not remove temporary PNG '{os.path.basename(png_temp_filepath)}': {e}")
+    if texture_atlas is not None:
+        # The sheets are few and large, so they are composed in this process
+        wad_archives = open_wad_archives(wad_files_paths, lambda message: None)
+        try:
+            for sheet_index in sheets_to_convert:
+                messages = []
+                written = write_atlas_sheet(texture_atlas, sheet_index, materials_output_dir, wad_archives, palette, messages.append)
+                texture_results.append({'texture': texture_atlas.sheet_name(sheet_index), 'status': 'converted' if written else 'encode_failed',
+                                        'frames': [], 'messages': messages})
+        finally:
+            for wad_archive in wad_archives:
+                wad_archive.close()
+        atlas_table_filepath = os.path.join(materials_output_dir, "atlas.json")
+        fd, temp_filepath = tempfile.mkstemp(prefix=".", suffix=".json.tmp", dir=materials_output_dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(texture_atlas.uv_table(), f, indent=1, sort_keys=True)
+            replace_with_temp_file(temp_filepath, atlas_table_filepath)
+        except OSError as e:
+            print_to_console(f"  [WARNING] Could not write atlas table '{atlas_table_filepath}': {e}")
+    elif os.path.exists(os.path.join(materials_output_dir, "atlas.json")):
+        os.remove(os.path.join(materials_output_dir, "atlas.json"))
+
+    for result in texture_results:
+        if result['status'] == 'converted' and texture_keys[result['texture']] is not None:
+            manifest.textures[result['texture']] = {'key': texture_keys[result['texture']],
+                                                    'vtf': os.path.join(materials_output_dir, f"{result['texture']}.vtf")}
         else:
-            print_to_console(f"  Skipping VTF conversion for '{texture}' due to failed PNG extraction.")
+            manifest.textures.pop(result['texture'], None)
+    manifest.remove_stale(all_unique_textures, manifest.textures, ('vtf',), print_to_console)
+    try:
+        manifest.save()
+    except OSError as e:
+        print_to_console(f"  [WARNING] Could not write build manifest '{manifest.path}': {e}")
+
+    # Report a per-texture summary instead of the interleaved worker output
+    converted_count = sum(1 for result in texture_results if result['status'] == 'converted')
+    print_to_console(f"\nTexture summary: {converted_count}/{len(texture_results)} converted, "
+                     f"{sum(1 for result in texture_results if result['status'] == 'not_extracted')} not extracted, "
+                     f"{sum(1 for result in texture_results if result['status'] == 'encode_failed')} failed to encode, "
+                     f"{sum(1 for result in texture_results if result['status'] == 'vtex_failed')} failed in vtex.")
+    for result in texture_results:
+        if result['status'] != 'converted':
+            print_to_console(f"  [{result['status'].upper()}] {result['texture']}")
+            for message in result['messages']:
+                print_to_console(f"    {message.strip()}")
 
 
     print_to_console("\n--- Conversion process completed. ---")
@@ -574,13 +3963,19 @@ def convert_folder(input_folder, output_base_folder, wad_files_paths, vtex_path,
     print_to_console(f"1. Copy the entire '{os.path.basename(addon_content_dir)}' folder (located at '{addon_content_dir}')")
     print_to_console("   into your Half-Life: Alyx addon's 'content' directory.")
     print_to_console("   Example: `Half-Life Alyx/game/hlvr_addons/my_addon_name/content/`")
-    print_to_console("2. This script provides a simplified conversion of Quake map geometry. Complex geometry (e.g., curved surfaces, precise UVs, advanced entities) are not fully handled.")
+    print_to_console("2. This script provides a simplified conversion of Quake map geometry. Complex geometry (e.g., curved surfaces) and game-specific entity logic are not fully handled.")
     print_to_console("3. Quake uses a Z-up coordinate system, while Source 2 typically uses Y-up. The script attempts to convert (X,Y,Z) to (X,Z,-Y). You might still need to adjust the map's orientation in Hammer after import.")
     print_to_console("4. **Material Assignment:** The generated VMFs will now include the original Quake texture names (e.g., 'WALL_TEX'). The script will generate corresponding Source 1 VTF files. Hammer will automatically look for these VTFs in the `materials/` folder.")
     print_to_console("5. For best results, you may need to manually adjust materials, brush geometry, and add entities in Half-Life: Alyx's Hammer editor.")
 
+    cached_textures = [{'texture': texture_name, 'status': 'cached', 'messages': []}
+                       for texture_name in sorted(all_unique_textures) if texture_name not in textures_to_convert]
+    return conversion_summary(addon_content_dir, map_results, sorted(texture_results + cached_textures, key=lambda result: result['texture']))
+
 
 class QuakeVmapConverterApp:
+    EVENT_DRAIN_INTERVAL_MS = 100 # How often queued console output is flushed to the widget
+
     def __init__(self, master):
         self.master = master
         master.title("Quake .map to Alyx .vmap Converter")
@@ -600,9 +3995,9 @@ class QuakeVmapConverterApp:
         self.input_folder_var = tk.StringVar(value=os.path.normpath(os.path.join(script_dir, "quake_maps_input")))
         self.output_folder_var = tk.StringVar(value=os.path.normpath(os.path.join(script_dir, "alyx_output")))
         
-        # New: Quake WAD files path(s)
+        # New: Quake texture source path(s): WAD, BSP or PAK files, or a game folder
         # Pre-fill with common Quake paths for convenience, or leave empty.
-        self.wad_files_var = tk.StringVar(value=os.path.normpath(r"F:\SteamLibrary\steamapps\common\Quake\id1\pak0.wad"))
+        self.wad_files_var = tk.StringVar(value=os.path.normpath(r"F:\SteamLibrary\steamapps\common\Quake\id1\pak0.pak"))
         
         # New: vtex.exe path
         self.vtex_path_var = tk.StringVar(value=os.path.normpath(r"C:\Program Files (x86)\Steam\steamapps\common\Source SDK Base 2013 Singleplayer\bin\ep1\bin\vtex.exe"))
@@ -610,9 +4005,24 @@ class QuakeVmapConverterApp:
         # New: Source 1 Game Content Root (for VPROJECT)
         self.s1_game_content_root_var = tk.StringVar(value=os.path.normpath(r"C:\Program Files (x86)\Steam\steamapps\common\Source SDK Base 2013 Singleplayer\hl2"))
 
+        # New: number of worker processes for the texture stage (extraction + vtex.exe)
+        self.texture_workers_var = tk.StringVar(value=str(os.cpu_count() or 1))
+        # New: number of worker processes used to parse and emit maps in parallel
+        self.map_workers_var = tk.StringVar(value=str(os.cpu_count() or 1))
+        # New: use vtex.exe instead of the built-in VTF encoder
+        self.use_vtex_var = tk.BooleanVar(value=False)
+        # New: also export the world brushes as .obj meshes for Source 2 Hammer
+        self.export_mesh_var = tk.BooleanVar(value=False)
+
+
+        # Pipeline output and progress arrive as events and are drained on a timer (see drain_events)
+        self.events = ProgressEventBus()
+        self.event_queue = self.events.subscribe(EventQueue())
+        self.stage_progress = {} # stage -> latest progress text
 
         self.create_widgets()
         self.setup_dummy_files() # Setup dummy files on app start for convenience
+        self.master.after(self.EVENT_DRAIN_INTERVAL_MS, self.drain_events)
 
     def create_widgets(self):
         # Input Folder Selection
@@ -629,12 +4039,12 @@ class QuakeVmapConverterApp:
         tk.Entry(output_frame, textvariable=self.output_folder_var, width=50, bg=self.button_bg, fg=self.button_fg, insertbackground=self.fg_light_gray).pack(side=tk.LEFT, fill=tk.X, expand=True)
         tk.Button(output_frame, text="Browse", command=lambda: self.browse_folder(self.output_folder_var), bg=self.button_bg, fg=self.button_fg, activebackground=self.fg_light_gray, activeforeground=self.button_bg).pack(side=tk.RIGHT)
 
-        # Quake WAD Files Path(s)
-        tk.Label(self.master, text="Quake WAD Files Path(s) (e.g., pak0.wad):", bg=self.bg_dark_gray, fg=self.fg_light_gray).pack(pady=(10, 0))
+        # Quake texture sources (WAD, BSP or PAK files)
+        tk.Label(self.master, text="Quake Texture Sources (.wad, .bsp, .pak, e.g., pak0.pak):", bg=self.bg_dark_gray, fg=self.fg_light_gray).pack(pady=(10, 0))
         wad_frame = tk.Frame(self.master, bg=self.bg_dark_gray)
         wad_frame.pack(fill=tk.X, padx=10)
         tk.Entry(wad_frame, textvariable=self.wad_files_var, width=50, bg=self.button_bg, fg=self.button_fg, insertbackground=self.fg_light_gray).pack(side=tk.LEFT, fill=tk.X, expand=True)
-        tk.Button(wad_frame, text="Browse", command=lambda: self.browse_file(self.wad_files_var, filetypes=[("WAD files", "*.wad")]), bg=self.button_bg, fg=self.button_fg, activebackground=self.fg_light_gray, activeforeground=self.button_bg).pack(side=tk.RIGHT)
+        tk.Button(wad_frame, text="Browse", command=lambda: self.browse_file(self.wad_files_var, filetypes=[("Quake texture sources", "*.wad *.bsp *.pak"), ("All files", "*.*")]), bg=self.button_bg, fg=self.button_fg, activebackground=self.fg_light_gray, activeforeground=self.button_bg).pack(side=tk.RIGHT)
         tk.Label(self.master, text="Separate multiple paths with ';'", bg=self.bg_dark_gray, fg=self.fg_light_gray, font=("Arial", 8)).pack(padx=10, anchor='w')
 
         # Source 1 VTF Converter (vtex.exe) Path
@@ -652,6 +4062,18 @@ class QuakeVmapConverterApp:
         tk.Button(s1_game_root_frame, text="Browse", command=lambda: self.browse_folder(self.s1_game_content_root_var), bg=self.button_bg, fg=self.button_fg, activebackground=self.fg_light_gray, activeforeground=self.button_bg).pack(side=tk.RIGHT)
         tk.Label(self.master, text="e.g., C:/Steam/steamapps/common/Team Fortress 2/tf", bg=self.bg_dark_gray, fg=self.fg_light_gray, font=("Arial", 8)).pack(padx=10, anchor='w')
 
+        # Map and Texture Worker Processes
+        workers_frame = tk.Frame(self.master, bg=self.bg_dark_gray)
+        workers_frame.pack(pady=(10, 0))
+        tk.Label(workers_frame, text="Map Worker Processes:", bg=self.bg_dark_gray, fg=self.fg_light_gray).pack(side=tk.LEFT)
+        tk.Entry(workers_frame, textvariable=self.map_workers_var, width=6, bg=self.button_bg, fg=self.button_fg, insertbackground=self.fg_light_gray).pack(side=tk.LEFT, padx=(5, 15))
+        tk.Label(workers_frame, text="Texture Worker Processes:", bg=self.bg_dark_gray, fg=self.fg_light_gray).pack(side=tk.LEFT)
+        tk.Entry(workers_frame, textvariable=self.texture_workers_var, width=6, bg=self.button_bg, fg=self.button_fg, insertbackground=self.fg_light_gray).pack(side=tk.LEFT, padx=5)
+
+        # Texture encoder selection
+        tk.Checkbutton(self.master, text="Convert textures with vtex.exe instead of the built-in VTF encoder", variable=self.use_vtex_var, bg=self.bg_dark_gray, fg=self.fg_light_gray, selectcolor=self.button_bg, activebackground=self.bg_dark_gray, activeforeground=self.fg_light_gray).pack(pady=(5, 0))
+        tk.Checkbutton(self.master, text="Also export world geometry as .obj meshes for Source 2 Hammer", variable=self.export_mesh_var, bg=self.bg_dark_gray, fg=self.fg_light_gray, selectcolor=self.button_bg, activebackground=self.bg_dark_gray, activeforeground=self.fg_light_gray).pack()
+
 
         # Frame for buttons
         button_frame = tk.Frame(self.master, bg=self.bg_dark_gray)
@@ -669,9 +4091,13 @@ class QuakeVmapConverterApp:
         # Apply tag for console text color (though fg already sets it, this is for consistency/future tags)
         self.console_text.tag_config("console_output", foreground=self.console_text_color)
 
+        # Per-stage progress, updated from progress events
+        self.progress_var = tk.StringVar(value="")
+        tk.Label(self.master, textvariable=self.progress_var, bg=self.bg_dark_gray, fg=self.fg_light_gray).pack(padx=10, anchor='w')
+
 
         # Redirect stdout to the console_text widget
-        self.text_redirector = TextRedirector(self.console_text)
+        self.text_redirector = TextRedirector(self.events)
         sys.stdout = self.text_redirector
         sys.stderr = self.text_redirector # Also redirect stderr
 
@@ -693,9 +4119,31 @@ class QuakeVmapConverterApp:
         self.console_text.delete(1.0, tk.END)
         self.console_text.config(state='disabled')
 
+    def drain_events(self):
+        """
+        Flushes queued pipeline events to the GUI in one batch: all console text is inserted
+        with a single widget update and only the latest progress per stage is shown.
+        Reschedules itself, so it runs for the lifetime of the window.
+        """
+        events = self.event_queue.drain()
+        text = format_events(events)
+        if text:
+            self.console_text.config(state='normal')
+            self.console_text.insert(tk.END, text, "console_output")
+            self.console_text.see(tk.END) # Auto-scroll to the end
+            self.console_text.config(state='disabled')
+        progress_events = [event for event in events if event['type'] == 'progress']
+        if progress_events:
+            for event in progress_events:
+                self.stage_progress[event['stage']] = f"{event['stage'].capitalize()}: {event['done']}/{event['total']}"
+            self.progress_var.set("   ".join(self.stage_progress.values()))
+        self.master.after(self.EVENT_DRAIN_INTERVAL_MS, self.drain_events)
+
     def start_conversion_thread(self):
         """Starts the conversion process in a separate thread to keep the GUI responsive."""
         self.clear_console()
+        self.stage_progress = {}
+        self.progress_var.set("")
         self.compile_button.config(state='disabled') # Disable buttons during conversion
         self.clear_button.config(state='disabled')
 
@@ -705,20 +4153,31 @@ class QuakeVmapConverterApp:
         wad_files_paths_str = self.wad_files_var.get()
         vtex_path = self.vtex_path_var.get()
         s1_game_content_root = self.s1_game_content_root_var.get()
+        texture_workers = self.read_worker_count(self.texture_workers_var)
+        map_workers = self.read_worker_count(self.map_workers_var)
+        texture_backend = 'vtex' if self.use_vtex_var.get() else 'native'
 
         # Split WAD paths string into a list
         wad_files_paths = [os.path.normpath(p.strip()) for p in wad_files_paths_str.split(';') if p.strip()]
 
         # Run conversion in a separate thread
-        self.conversion_thread = threading.Thread(target=self.run_conversion, args=(input_folder, output_base_folder, wad_files_paths, vtex_path, s1_game_content_root))
+        self.conversion_thread = threading.Thread(target=self.run_conversion, args=(input_folder, output_base_folder, wad_files_paths, vtex_path, s1_game_content_root, texture_workers, map_workers, texture_backend, self.export_mesh_var.get()))
         self.conversion_thread.start()
         # Start checking thread status periodically to re-enable buttons
         self.master.after(100, self.check_conversion_thread) 
 
-    def run_conversion(self, input_folder, output_base_folder, wad_files_paths, vtex_path, s1_game_content_root):
+    def read_worker_count(self, workers_var):
+        """Parses a worker-count entry; anything that is not a positive integer falls back to the CPU count."""
+        try:
+            return max(1, int(workers_var.get()))
+        except ValueError:
+            return os.cpu_count() or 1
+
+    def run_conversion(self, input_folder, output_base_folder, wad_files_paths, vtex_path, s1_game_content_root, texture_workers, map_workers, texture_backend, export_mesh=False):
         """Executes the map conversion logic."""
         try:
-            convert_folder(input_folder, output_base_folder, wad_files_paths, vtex_path, s1_game_content_root, self.console_text)
+            convert_folder(input_folder, output_base_folder, wad_files_paths, vtex_path, s1_game_content_root, self.events, texture_workers, map_workers,
+                           texture_backend=texture_backend, export_mesh=export_mesh)
             messagebox.showinfo("Conversion Complete", "Map conversion and texture preparation finished successfully!")
         except Exception as e:
             messagebox.showerror("Conversion Error", f"An unexpected error occurred during conversion: {e}")
@@ -761,11 +4220,11 @@ class QuakeVmapConverterApp:
         ( -128 128 0 ) ( 128 128 0 ) ( -128 128 128 ) {CLIP [ 1 0 0 0 ] [ 0 1 0 0 ] 0 1 1
         ( -128 -128 0 ) ( -128 128 0 ) ( 128 -128 0 ) WATER_TEX [ 1 0 0 0 ] [ 0 1 0 0 ] 0 1 1
     }
-    {
-        "classname" "light"
-        "origin" "0 0 64"
-        "light" "300"
-    }
+}
+{
+    "classname" "light"
+    "origin" "0 0 64"
+    "light" "300"
 }
 """
             with open(sample_map_path, "w") as f:
@@ -776,28 +4235,113 @@ class QuakeVmapConverterApp:
 
 
 class TextRedirector:
-    """A class to redirect stdout and stderr to a Tkinter Text widget."""
-    def __init__(self, widget):
-        self.widget = widget
+    """
+    A file-like object that redirects stdout and stderr to the GUI console.
+    Writes are posted to a ProgressEventBus instead of touching the Tkinter widget,
+    so they are safe from any thread and are drawn in batches by the GUI's event timer.
+    """
+    def __init__(self, events):
+        self.events = events
 
     def write(self, s):
-        # Schedule the update on the main Tkinter thread to prevent threading issues with Tkinter
-        self.widget.after(0, self._write_to_widget, s)
-
-    def _write_to_widget(self, s):
-        """Internal method to safely write text to the Tkinter Text widget."""
-        self.widget.config(state='normal') # Enable editing
-        self.widget.insert(tk.END, s, "console_output") # Apply tag for color
-        self.widget.see(tk.END) # Auto-scroll to the end
-        self.widget.config(state='disabled') # Disable editing
-        self.widget.update_idletasks() # Force GUI update immediately
+        if s:
+            self.events.text(s)
 
     def flush(self):
         """Required for file-like object compatibility."""
         pass 
 
 
-if __name__ == "__main__":
+def run_gui():
+    """Starts the Tkinter front end."""
+    global tk, scrolledtext, messagebox, filedialog
+    import tkinter as tk
+    from tkinter import scrolledtext, messagebox, filedialog
     root = tk.Tk()
     app = QuakeVmapConverterApp(root)
     root.mainloop()
+
+
+def build_argument_parser():
+    """Command-line interface: `python -m vmapconverter convert ...` runs convert_folder without Tk."""
+    parser = argparse.ArgumentParser(prog="vmapconverter", description="Quake .map to Source .vmf/.vtf converter.")
+    subparsers = parser.add_subparsers(dest="command")
+    convert_parser = subparsers.add_parser("convert", help="Convert a folder of .map files and their textures (headless).")
+    convert_parser.add_argument("-i", "--input", required=True, help="Folder searched recursively for .map files.")
+    convert_parser.add_argument("-o", "--output", required=True, help="Addon content base folder; output goes to <output>/quakeautomatedscriptport.")
+    convert_parser.add_argument("-w", "--wad", action="append", default=[],
+                                help="Texture source: a .wad, .bsp or .pak file or a game folder (e.g. id1); repeat for several (searched in order). "
+                                     "WADs named by the maps' \"wad\" keys are added automatically.")
+    convert_parser.add_argument("--texture-backend", choices=TEXTURE_BACKENDS, default='native', help="Built-in VTF encoder (default) or vtex.exe.")
+    convert_parser.add_argument("--vtex", help="Path to vtex.exe (vtex backend only).")
+    convert_parser.add_argument("--game-root", help="Source 1 game content root used as VPROJECT (vtex backend only).")
+    convert_parser.add_argument("--map-workers", type=int, default=None, help="Processes used to convert maps (default: CPU count).")
+    convert_parser.add_argument("--texture-workers", type=int, default=None, help="Processes used to convert textures (default: CPU count).")
+    convert_parser.add_argument("--palette", help="palette.lmp, or a game folder containing (gfx/)palette.lmp (default: next to the WADs, else built-in).")
+    convert_parser.add_argument("--fullbright-alpha", action="store_true", help="Store the fullbright pixel mask in texture alpha (for $selfillum).")
+    convert_parser.add_argument("--atlas", type=int, metavar="SIZE", dest="atlas_max_texture_size", default=None,
+                                help="Pack static opaque textures up to SIZE texels into shared atlas sheets (native backend only).")
+    convert_parser.add_argument("--mesh", action="store_true", dest="export_mesh",
+                                help="Also write each map's world brushes as a merged, welded .obj mesh batched by material, for Source 2 Hammer import.")
+    convert_parser.add_argument("--grid", type=float, metavar="UNITS", dest="coordinate_grid", default=None,
+                                help="Snap VMF plane coordinates to multiples of UNITS output units (e.g. 0.125); default: no snapping.")
+    convert_parser.add_argument("--no-optimize", action="store_true", help="Emit every brush and face as parsed, without merging brushes or setting hidden faces to nodraw.")
+    convert_parser.add_argument("--no-cache", action="store_true", help="Rebuild everything instead of skipping unchanged inputs.")
+    convert_parser.add_argument("-q", "--quiet", action="store_true", help="Suppress the conversion log; only print the JSON summary.")
+    return parser
+
+
+def main(argv=None):
+    """
+    Command-line entry point. The conversion log goes to stderr and a JSON summary
+    (see conversion_summary) to stdout. Returns the process exit code: 0 when everything
+    converted, 1 when some maps or textures failed, 2 for invalid inputs. A texture the
+    maps reference but the WADs do not contain counts as a failure, so an incomplete build
+    is never reported as successful; only missing tool textures (clip, trigger, sky, ...;
+    see tool_material) are tolerated, as they are emitted as Source tool materials.
+    Without a command the GUI is started.
+    """
+    args = build_argument_parser().parse_args(argv)
+    if args.command is None:
+        run_gui()
+        return 0
+
+    for option in ("map_workers", "texture_workers"):
+        if getattr(args, option) is not None and getattr(args, option) < 1:
+            print(f"[ERROR] --{option.replace('_', '-')} must be at least 1.", file=sys.stderr)
+            return 2
+    if args.atlas_max_texture_size is not None and args.atlas_max_texture_size < 1:
+        print("[ERROR] --atlas must be at least 1.", file=sys.stderr)
+        return 2
+    if args.coordinate_grid is not None and not args.coordinate_grid > 0:
+        print("[ERROR] --grid must be positive.", file=sys.stderr)
+        return 2
+
+    palette = None
+    if args.palette or args.fullbright_alpha:
+        with contextlib.redirect_stdout(sys.stderr):
+            palette = load_palette(args.palette, palette_search_dirs(args.wad), args.fullbright_alpha)
+
+    events = ProgressEventBus()
+    log_stream = open(os.devnull, 'w') if args.quiet else sys.stderr
+    if not args.quiet:
+        events.subscribe(lambda event: log_stream.write(format_events([event])))
+    try:
+        with contextlib.redirect_stdout(log_stream):
+            summary = convert_folder(args.input, args.output, [os.path.normpath(wad_path) for wad_path in args.wad],
+                                     args.vtex, args.game_root, events, args.texture_workers, args.map_workers,
+                                     use_cache=not args.no_cache, texture_backend=args.texture_backend, palette=palette,
+                                     atlas_max_texture_size=args.atlas_max_texture_size, export_mesh=args.export_mesh,
+                                     optimize=not args.no_optimize, coordinate_grid=args.coordinate_grid)
+    except Exception as e:
+        summary = {'status': 'error', 'error': f"Critical error during conversion: {e}", 'output': None, 'maps': [], 'textures': {}}
+    finally:
+        if log_stream is not sys.stderr:
+            log_stream.close()
+
+    print(json.dumps(summary, indent=2))
+    return {'ok': 0, 'failed': 1}.get(summary['status'], 2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())